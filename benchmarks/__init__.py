@@ -0,0 +1 @@
+"""Benchmarks for Hydrate's cluster collection and matching paths."""
@@ -0,0 +1,78 @@
+"""Load-test Cluster.get_components against the fake API server.
+
+Serves a synthetic cluster with injected latency and times a full
+component collection, listing the objects of every namespace, for several
+collection settings. With --max-in-flight the server throttles concurrent
+requests with 429s, and the retries and final concurrency of each setting
+are reported too.
+
+Usage:
+    python -m benchmarks.bench_collection [--namespaces N] [--deployments N]
+        [--pods N] [--latency SECONDS] [--max-in-flight N]
+"""
+import os
+import tempfile
+from argparse import ArgumentParser
+from timeit import default_timer
+
+from benchmarks.fake_apiserver import FakeApiServer, SyntheticCluster
+from hydrate.cluster import COMPONENT_KINDS, Cluster
+
+# (label, Cluster keyword arguments)
+SETTINGS = [
+    ("serial, per-namespace", dict(workers=1, all_namespaces_threshold=0)),
+    ("8 workers, per-namespace", dict(workers=8, all_namespaces_threshold=0)),
+    ("cluster-wide list", dict(workers=8, all_namespaces_threshold=1)),
+    ("cluster-wide, raw JSON", dict(workers=8, all_namespaces_threshold=1,
+                                    raw_json=True)),
+    ("cluster-wide, metadata", dict(workers=8, all_namespaces_threshold=1,
+                                    metadata_only=True)),
+    ("all kinds, per-namespace", dict(workers=8, all_namespaces_threshold=0,
+                                      kinds=COMPONENT_KINDS)),
+    ("all kinds, cluster-wide", dict(workers=8, all_namespaces_threshold=1,
+                                     kinds=COMPONENT_KINDS)),
+]
+
+
+def time_collection(kubeconfig, **kwargs):
+    """Return the wall time and the Cluster of one get_components run."""
+    cluster = Cluster(kubeconfig, namespaced_components=True, **kwargs)
+    cluster.connect_to_cluster()
+    start_time = default_timer()
+    cluster.get_components()
+    return default_timer() - start_time, cluster
+
+
+def main():
+    """Run the benchmark."""
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--namespaces", type=int, default=200)
+    parser.add_argument("--deployments", type=int, default=5,
+                        help="deployments per namespace")
+    parser.add_argument("--pods", type=int, default=4, help="pods per deployment")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds each request is delayed")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="requests the server serves at once, others get a 429")
+    args = parser.parse_args()
+
+    cluster = SyntheticCluster(args.namespaces, args.deployments, args.pods)
+    print("{} namespaces, {} deployments, {:.0f}ms latency".format(
+        cluster.count("namespaces"), cluster.count("deployments"),
+        args.latency * 1000))
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            FakeApiServer(cluster, args.latency,
+                          max_in_flight=args.max_in_flight) as server:
+        kubeconfig = server.write_kubeconfig(os.path.join(tmp_dir, "kubeconfig"))
+        for label, kwargs in SETTINGS:
+            runtime, cluster = time_collection(kubeconfig, **kwargs)
+            line = "{:<26} {:7.3f}s {:6} calls".format(
+                label, runtime, len(cluster.call_latencies))
+            if args.max_in_flight:
+                line += " {:5} retries, concurrency {:3}".format(
+                    cluster.retries, cluster.limiter.get_limit())
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Measure gzip negotiation of the Kubernetes client on large lists.
+
+Serves a synthetic cluster from the fake API server, throttled to a given
+bandwidth, and times a paged cluster-wide pod list with and without gzip
+responses. Responses are cached by the server, and a first untimed run
+fills the cache.
+
+Usage:
+    python -m benchmarks.bench_http [--namespaces N] [--pods N]
+        [--bandwidth MBIT] [--latency SECONDS]
+"""
+import os
+import tempfile
+from argparse import ArgumentParser
+from timeit import default_timer
+
+from benchmarks.fake_apiserver import FakeApiServer, SyntheticCluster
+from hydrate.cluster import Cluster
+
+
+def run(server, kubeconfig, namespaces, **kwargs):
+    """Time one pod collection; return seconds and bytes sent."""
+    cluster = Cluster(kubeconfig, **kwargs)
+    cluster.connect_to_cluster()
+    bytes_sent = server.bytes_sent
+    start_time = default_timer()
+    cluster.get_pods_by_namespace(namespaces)
+    return default_timer() - start_time, server.bytes_sent - bytes_sent
+
+
+def main():
+    """Run the benchmark."""
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--namespaces", type=int, default=200)
+    parser.add_argument("--pods", type=int, default=20,
+                        help="pods per deployment, 5 deployments per namespace")
+    parser.add_argument("--bandwidth", type=float, default=100,
+                        help="Mbit/s of each response")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds each request is delayed")
+    args = parser.parse_args()
+
+    cluster = SyntheticCluster(args.namespaces, 5, args.pods)
+    namespaces = [cluster.namespace_name(i) for i in range(cluster.count("namespaces"))]
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            FakeApiServer(cluster, args.latency, cache=True,
+                          bandwidth=args.bandwidth * 1e6 / 8) as server:
+        kubeconfig = server.write_kubeconfig(os.path.join(tmp_dir, "kubeconfig"))
+
+        print("Cluster-wide list of {} pods, {:.0f} Mbit/s:".format(
+            cluster.count("pods"), args.bandwidth))
+        for raw_json in (False, True):
+            results = dict()
+            for compress in (False, True):
+                run(server, kubeconfig, namespaces, all_namespaces_threshold=1,
+                    raw_json=raw_json, compress=compress)
+                results[compress] = run(server, kubeconfig, namespaces,
+                                        all_namespaces_threshold=1,
+                                        raw_json=raw_json, compress=compress)
+            for compress, (runtime, size) in results.items():
+                print("  {:<13} gzip {:<5} {:7.3f}s {:8.1f} MB".format(
+                    "raw JSON" if raw_json else "client models", str(compress),
+                    runtime, size / 1e6))
+
+
+if __name__ == "__main__":
+    main()
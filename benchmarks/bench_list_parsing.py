@@ -0,0 +1,57 @@
+"""Compare client-model and raw-JSON parsing of large pod lists.
+
+Serves one namespace of synthetic pods from the fake API server, with
+cached responses, and times Cluster.get_namespaced_pods with and without
+the raw-JSON fast path.
+
+Usage:
+    python -m benchmarks.bench_list_parsing [--pods N] [--repeat N]
+"""
+from argparse import ArgumentParser
+from timeit import default_timer
+
+from kubernetes.client import ApiClient, AppsV1Api, Configuration, CoreV1Api
+
+from benchmarks.fake_apiserver import FakeApiServer, SyntheticCluster
+from hydrate.cluster import Cluster
+
+
+NAMESPACE = "nginx-0"
+
+
+def time_path(host, raw_json, repeat):
+    """Return the best wall time of get_namespaced_pods for one parsing path."""
+    configuration = Configuration()
+    configuration.host = host
+    api_client = ApiClient(configuration)
+    best = None
+    for _ in range(repeat):
+        cluster = Cluster(None, page_size=0, raw_json=raw_json)
+        cluster.core_v1_api = CoreV1Api(api_client)
+        cluster.apps_v1_api = AppsV1Api(api_client)
+        start_time = default_timer()
+        cluster.get_namespaced_pods(NAMESPACE)
+        runtime = default_timer() - start_time
+        best = runtime if best is None else min(best, runtime)
+    return best
+
+
+def main():
+    """Run the benchmark."""
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pods", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with FakeApiServer(SyntheticCluster(1, args.pods, 1), cache=True) as server:
+        _, body, _ = server.respond("/api/v1/namespaces/{}/pods".format(NAMESPACE))
+        size = len(body)
+        print("{} pods, {:.1f} MB response".format(args.pods, size / 1e6))
+        model = time_path(server.host, False, args.repeat)
+        raw = time_path(server.host, True, args.repeat)
+    print("client models: {:.3f}s".format(model))
+    print("raw JSON:      {:.3f}s ({:.1f}x faster)".format(raw, model / raw))
+
+
+if __name__ == "__main__":
+    main()
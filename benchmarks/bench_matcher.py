@@ -0,0 +1,165 @@
+"""Compare Matcher with the linear scan it replaced, on synthetic catalogs.
+
+Builds a catalog of Fabrikate definitions named from a vocabulary of
+tokens, and cluster components of which a share use those tokens, then
+times the full and partial matching of the cluster with the engines of
+Matcher and with the previous Matcher, which built the token set of
+every definition on every call. All must give the same matches. The
+bitset engine is skipped when numpy is not installed.
+
+Usage:
+    python -m benchmarks.bench_matcher [--definitions N] [--components N]
+                                       [--matching RATIO] [--repeat N]
+"""
+from argparse import ArgumentParser
+from collections import namedtuple
+from random import Random
+from timeit import default_timer
+
+from hydrate.component import Component
+from hydrate.match import Match, Matcher, MatchCategory
+
+FullMatchResults = namedtuple('FullMatchResults', ['full_matches', 'leftovers'])
+PartialMatchResults = namedtuple('PartialMatchResults', ['partial_matches', 'no_matches'])
+
+
+def make_catalog(definitions, components, matching, seed=0):
+    """Return synthetic repo and cluster components.
+
+    Args:
+        definitions: number of repo components, named from 1 to 3 tokens
+        components: number of cluster components
+        matching: share of the cluster components named after a token
+
+    """
+    random = Random(seed)
+    vocabulary = ["tok{}".format(i) for i in range(max(definitions, 1))]
+    names = {}
+    while len(names) < definitions:
+        name = "-".join(random.sample(vocabulary, random.randint(1, 3)))
+        names[name] = None
+    repo_components = [Component(name=name) for name in names]
+    unused = random.sample(vocabulary, len(vocabulary))
+    cluster_names = {}
+    while len(cluster_names) < components:
+        if unused and random.random() < matching:
+            name = unused.pop()
+        else:
+            name = "app{}".format(random.randrange(10 * components))
+        cluster_names[name] = None
+    return repo_components, [Component(name=name) for name in cluster_names]
+
+
+class ScanMatcher(Matcher):
+    """Matcher as it was before its token index, scanning the whole catalog."""
+
+    def get_full_matches(self, cluster_components):
+        """Determine which components fully match the cluster."""
+        full_matches = []
+        leftovers = None
+        cluster_map = {cc.name: cc for cc in cluster_components}
+        cluster_set = set(cluster_map.keys())
+
+        for rc in self.repo_components:
+            repo_set = set(rc.name.split('-'))
+            if repo_set.issubset(cluster_set):
+                cc_names = cluster_set.intersection(repo_set)
+                cluster_matches = [cluster_map[name] for name in cc_names]
+                cluster_set.difference_update(repo_set)
+                full_matches.append(Match(category=MatchCategory.FULL_MATCH,
+                                          cluster_matches=cluster_matches,
+                                          repo_match=rc))
+
+        if cluster_set:
+            leftovers = [cc for cc in cluster_components if cc.name in cluster_set]
+        return FullMatchResults(full_matches, leftovers)
+
+    def get_partial_matches(self, full_match_leftovers):
+        """Determine which components partially match the cluster."""
+        partial_matches = []
+        no_matches = None
+        cluster_map = {cc.name: cc for cc in full_match_leftovers}
+        cluster_name_set = set(cluster_map.keys())
+
+        for repo_component in self.repo_components:
+            repo_component_name_set = set(repo_component.name.split('-'))
+            common_names = repo_component_name_set.intersection(cluster_name_set)
+            if common_names:
+                cluster_name_set.difference_update(common_names)
+                cluster_matches = [cluster_map[c_name] for c_name in common_names]
+                partial_matches.append(Match(category=MatchCategory.PARTIAL_MATCH,
+                                             cluster_matches=cluster_matches,
+                                             repo_match=repo_component))
+
+        if cluster_name_set:
+            no_matches = [cc for cc in full_match_leftovers
+                          if cc.name in cluster_name_set]
+        return PartialMatchResults(partial_matches, no_matches)
+
+
+def matches(matcher, cluster_components):
+    """Return the full and partial matches of matcher, as comparable tuples."""
+    results = matcher.get_full_matches(cluster_components)
+    full = [(m.repo_match, m.cluster_matches) for m in results.full_matches]
+    partial = []
+    if results.leftovers:
+        partial = [(m.repo_match, m.cluster_matches) for m in
+                   matcher.get_partial_matches(results.leftovers).partial_matches]
+    return full, partial
+
+
+def best_time(func, repeat):
+    """Return the result and the best wall time of repeat calls of func."""
+    best = None
+    for _ in range(repeat):
+        start_time = default_timer()
+        result = func()
+        runtime = default_timer() - start_time
+        best = runtime if best is None else min(best, runtime)
+    return result, best
+
+
+def main():
+    """Run the benchmark."""
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--definitions", type=int, default=10000)
+    parser.add_argument("--components", type=int, default=100000)
+    parser.add_argument("--matching", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    repo_components, cluster_components = make_catalog(
+        args.definitions, args.components, args.matching)
+    start_time = default_timer()
+    matcher = Matcher(repo_components)
+    build = default_timer() - start_time
+    scan_matcher = ScanMatcher(repo_components)
+
+    scanned, scan = best_time(
+        lambda: matches(scan_matcher, cluster_components), args.repeat)
+    indexed, index = best_time(
+        lambda: matches(matcher, cluster_components), args.repeat)
+    assert indexed == scanned, "the token index changed the matches"
+    try:
+        start_time = default_timer()
+        bitset_matcher = Matcher(repo_components, engine="bitset")
+        bitset_build = default_timer() - start_time
+    except ImportError:
+        bitset_matcher = None
+    else:
+        bitset_matched, bitset = best_time(
+            lambda: matches(bitset_matcher, cluster_components), args.repeat)
+        assert bitset_matched == scanned, "the bitset engine changed the matches"
+
+    print("{} definitions x {} cluster components: {} full, {} partial matches".format(
+        args.definitions, args.components, len(scanned[0]), len(scanned[1])))
+    print("scan:        {:.3f}s".format(scan))
+    print("token index: {:.3f}s ({:.1f}x speedup, built once in {:.3f}s)".format(
+        index, scan / index, build))
+    if bitset_matcher is not None:
+        print("bitset:      {:.3f}s ({:.1f}x speedup, built once in {:.3f}s)".format(
+            bitset, scan / bitset, bitset_build))
+
+
+if __name__ == "__main__":
+    main()
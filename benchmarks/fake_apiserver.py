@@ -0,0 +1,521 @@
+"""Local fake Kubernetes API server serving synthetic clusters.
+
+Namespaces, deployments and pods are generated from their index on each
+request, so clusters of 10k namespaces and 1M pods cost no memory up
+front. List calls support limit/continue paging, cluster-wide lists and
+PartialObjectMetadataList responses and gzip compression, and every
+request can be delayed or throttled to mimic a remote API server. A cap
+on the requests served at once answers the others with 429 Too Many
+Requests, like API Priority and Fairness on a busy server.
+
+Usage:
+    python -m benchmarks.fake_apiserver [--namespaces N] [--deployments N]
+        [--pods N] [--latency SECONDS] [--max-in-flight N] [--port N]
+        [--kubeconfig FILE]
+"""
+import gzip
+import json
+import re
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+# First words of the synthetic application names
+APPS = ("nginx", "prometheus", "grafana", "elasticsearch", "jaeger", "istio",
+        "redis", "kafka", "fluentd", "traefik")
+# Response size from which the API server gzips responses, when asked to
+GZIP_THRESHOLD = 128 * 1024
+# Namespaces every cluster has
+SYSTEM_NAMESPACES = ("default", "kube-public", "kube-system")
+
+# Second words of the names of the other workload kinds and services
+OTHER_KINDS = {"statefulsets": "db", "daemonsets": "agent", "cronjobs": "backup",
+               "services": "svc"}
+# API group path of each listed kind
+KIND_GROUPS = {"pods": ("/api/v1",), "services": ("/api/v1",),
+               "deployments": ("/apis/apps/v1",), "statefulsets": ("/apis/apps/v1",),
+               "daemonsets": ("/apis/apps/v1",),
+               "cronjobs": ("/apis/batch/v1", "/apis/batch/v1beta1")}
+
+ROUTES = [(re.compile(r"^/api/v1/namespaces$"), "namespaces")]
+ROUTES += [(re.compile(r"^{}/namespaces/(?P<namespace>[^/]+)/{}$".format(group, kind)),
+            kind)
+           for kind, groups in KIND_GROUPS.items() for group in groups]
+ROUTES += [(re.compile(r"^{}/{}$".format(group, kind)), kind)
+           for kind, groups in KIND_GROUPS.items() for group in groups]
+
+
+class SyntheticCluster():
+    """Describe a cluster whose objects are generated from their index.
+
+    Every application namespace holds the same number of deployments, and
+    every deployment the same number of pods. It also holds the same number
+    of statefulsets, daemonsets, cronjobs and services. The system
+    namespaces are empty, except for the "kubernetes" service in default.
+    """
+
+    def __init__(self, namespaces=100, deployments=5, pods=4, others=1):
+        """Instantiate SyntheticCluster object.
+
+        Args:
+            namespaces: number of application namespaces
+            deployments: deployments per application namespace
+            pods: pods per deployment
+            others: statefulsets, daemonsets, cronjobs and services per
+                    application namespace
+
+        """
+        self.namespace_count = namespaces
+        self.deployments_per_namespace = deployments
+        self.pods_per_deployment = pods
+        self.others_per_namespace = others
+
+    def namespace_name(self, index):
+        """Return the name of the namespace at index."""
+        if index < len(SYSTEM_NAMESPACES):
+            return SYSTEM_NAMESPACES[index]
+        index -= len(SYSTEM_NAMESPACES)
+        return "{}-{}".format(APPS[index % len(APPS)], index)
+
+    def namespace_index(self, namespace):
+        """Return the application namespace index of a name, or None."""
+        app, _, index = namespace.rpartition("-")
+        if not index.isdigit() or int(index) >= self.namespace_count:
+            return None
+        if app != APPS[int(index) % len(APPS)]:
+            return None
+        return int(index)
+
+    def per_namespace(self, kind):
+        """Return the number of objects of a kind per application namespace."""
+        if kind == "pods":
+            return self.deployments_per_namespace * self.pods_per_deployment
+        if kind in OTHER_KINDS:
+            return self.others_per_namespace
+        return self.deployments_per_namespace
+
+    def count(self, kind, namespace=None):
+        """Return the number of objects of a kind, in a namespace or in total."""
+        if kind == "namespaces":
+            return len(SYSTEM_NAMESPACES) + self.namespace_count
+        builtin = 1 if kind == "services" else 0
+        if namespace is None:
+            return builtin + self.per_namespace(kind) * self.namespace_count
+        if namespace == "default":
+            return builtin
+        if self.namespace_index(namespace) is None:
+            return 0
+        return self.per_namespace(kind)
+
+    def object(self, kind, index, namespace=None):
+        """Return the object of a kind at index, as a JSON-ready dict.
+
+        The index counts from the start of the namespace, or from the start
+        of the cluster when namespace is None.
+        """
+        if kind == "namespaces":
+            return namespace_object(self.namespace_name(index), index)
+        if kind == "services" and namespace in (None, "default"):
+            if index == 0:
+                return other_object(kind, "default", "kubernetes", 0)
+            index -= 1
+        per_namespace = self.per_namespace(kind)
+        if namespace is not None:
+            index += self.namespace_index(namespace) * per_namespace
+        namespace = self.namespace_name(len(SYSTEM_NAMESPACES) + index // per_namespace)
+        local = index % per_namespace
+        app = namespace.split("-")[0]
+        if kind == "deployments":
+            return deployment_object(namespace, "{}-{}".format(app, local), index)
+        if kind in OTHER_KINDS:
+            return other_object(kind, namespace,
+                                "{}-{}-{}".format(app, OTHER_KINDS[kind], local), index)
+        deployment = "{}-{}".format(app, local // self.pods_per_deployment)
+        return pod_object(namespace, deployment, local % self.pods_per_deployment,
+                          index)
+
+
+def namespace_object(name, index):
+    """Return a namespace dict shaped like an API server response."""
+    return {"metadata": {"name": name,
+                         "uid": "ns-{:08d}".format(index),
+                         "resourceVersion": str(index + 1),
+                         "creationTimestamp": "2019-07-01T12:00:00Z"},
+            "spec": {"finalizers": ["kubernetes"]},
+            "status": {"phase": "Active"}}
+
+
+def deployment_object(namespace, name, index):
+    """Return a deployment dict shaped like an API server response."""
+    return {
+        "metadata": {"name": name,
+                     "namespace": namespace,
+                     "uid": "deploy-{:08d}".format(index),
+                     "resourceVersion": str(index + 1),
+                     "generation": 1,
+                     "creationTimestamp": "2019-07-01T12:00:00Z",
+                     "labels": {"app": name}},
+        "spec": {"replicas": 2,
+                 "selector": {"matchLabels": {"app": name}},
+                 "template": {
+                     "metadata": {"labels": {"app": name}},
+                     "spec": {"containers": [{
+                         "name": "main",
+                         "image": "registry.example.com/{}:1.0".format(name)}]}}},
+        "status": {"replicas": 2, "readyReplicas": 2, "availableReplicas": 2},
+    }
+
+
+def other_object(kind, namespace, name, index):
+    """Return a statefulset, daemonset, cronjob or service dict."""
+    labels = {"app": name}
+    template = {"metadata": {"labels": labels},
+                "spec": {"containers": [{"name": "main",
+                                         "image": "registry.example.com/{}:1.0"
+                                                  .format(name)}],
+                         "restartPolicy": "Always"}}
+    if kind == "services":
+        spec = {"type": "ClusterIP", "selector": labels,
+                "ports": [{"port": 80, "protocol": "TCP", "targetPort": 8080}]}
+    elif kind == "cronjobs":
+        template["spec"]["restartPolicy"] = "OnFailure"
+        spec = {"schedule": "0 * * * *",
+                "jobTemplate": {"spec": {"template": template}}}
+    else:
+        spec = {"selector": {"matchLabels": labels}, "template": template}
+        if kind == "statefulsets":
+            spec["serviceName"] = name
+    return {"metadata": {"name": name,
+                         "namespace": namespace,
+                         "uid": "{}-{:08d}".format(kind, index),
+                         "resourceVersion": str(index + 1),
+                         "creationTimestamp": "2019-07-01T12:00:00Z",
+                         "labels": labels},
+            "spec": spec}
+
+
+def pod_object(namespace, deployment, replica, index):
+    """Return a pod dict shaped like an API server response."""
+    name = "{}-7d9f8c6b5-{:05d}".format(deployment, replica)
+    return {
+        "metadata": {
+            "name": name,
+            "namespace": namespace,
+            "uid": "pod-{:08d}".format(index),
+            "resourceVersion": str(index + 1),
+            "creationTimestamp": "2019-07-01T12:00:00Z",
+            "labels": {"app": deployment, "pod-template-hash": "7d9f8c6b5"},
+            "ownerReferences": [{"apiVersion": "apps/v1", "kind": "ReplicaSet",
+                                 "name": deployment + "-7d9f8c6b5", "uid": "0",
+                                 "controller": True}],
+        },
+        "spec": {
+            "containers": [{
+                "name": "main",
+                "image": "registry.example.com/{}:1.0".format(deployment),
+                "ports": [{"containerPort": 8080, "protocol": "TCP"}],
+                "env": [{"name": "ENV_{}".format(i), "value": "value"}
+                        for i in range(5)],
+                "resources": {"limits": {"cpu": "500m", "memory": "256Mi"},
+                              "requests": {"cpu": "100m", "memory": "128Mi"}},
+                "volumeMounts": [{"name": "token", "mountPath": "/var/run/secrets",
+                                  "readOnly": True}],
+            }],
+            "nodeName": "node-{}".format(index % 20),
+            "restartPolicy": "Always",
+            "volumes": [{"name": "token", "secret": {"secretName": "token"}}],
+        },
+        "status": {
+            "phase": "Running",
+            "podIP": "10.{}.{}.{}".format(index // 62500 % 250, index // 250 % 250,
+                                          index % 250),
+            "conditions": [{"type": "Ready", "status": "True",
+                            "lastTransitionTime": "2019-07-01T12:00:05Z"}],
+        },
+    }
+
+
+LIST_KINDS = {"namespaces": ("NamespaceList", "v1"),
+              "deployments": ("DeploymentList", "apps/v1"),
+              "pods": ("PodList", "v1"),
+              "statefulsets": ("StatefulSetList", "apps/v1"),
+              "daemonsets": ("DaemonSetList", "apps/v1"),
+              "cronjobs": ("CronJobList", "batch/v1"),
+              "services": ("ServiceList", "v1")}
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    """HTTP server answering each connection from its own thread.
+
+    http.server.ThreadingHTTPServer only exists from Python 3.7.
+    """
+
+    daemon_threads = True
+
+
+class FakeApiServer():
+    """Serve a SyntheticCluster over HTTP on localhost."""
+
+    def __init__(self, cluster=None, latency=0, port=0, cache=False,
+                 bandwidth=None, max_in_flight=None, retry_after=1):
+        """Instantiate FakeApiServer object.
+
+        Args:
+            cluster: SyntheticCluster to serve (default:SyntheticCluster())
+            latency: seconds each request is delayed (default:0)
+            port: port to listen on, 0 for any free port (default:0)
+            cache: keep encoded responses, so repeated requests measure the
+                   client rather than the object generation (default:False)
+            bandwidth: bytes per second each response is throttled to, None
+                   for no limit (default:None)
+            max_in_flight: requests served at once, like API Priority and
+                   Fairness seats; others get a 429 (default:None, no limit)
+            retry_after: Retry-After seconds of 429 responses (default:1)
+
+        """
+        self.cluster = cluster or SyntheticCluster()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.throttled = 0
+        self.requests = []
+        self.bytes_sent = 0
+        self.connections = 0
+        self.cache = dict() if cache else None
+        self._lock = threading.Lock()
+        self._server = ThreadingServer(("127.0.0.1", port), make_handler(self))
+        self._thread = None
+
+    @property
+    def host(self):
+        """Return the base URL of the server."""
+        return "http://127.0.0.1:{}".format(self._server.server_port)
+
+    def __enter__(self):
+        """Start serving."""
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        """Stop serving."""
+        self.stop()
+
+    def start(self):
+        """Serve requests from a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def write_kubeconfig(self, path):
+        """Write a kubeconfig file pointing at this server."""
+        with open(path, "w") as of:
+            of.write(KUBECONFIG.format(host=self.host))
+        return path
+
+    def respond(self, path, accept="", accept_encoding=""):
+        """Answer one GET request.
+
+        Args:
+            path: request path with its query string
+            accept: Accept header of the request
+            accept_encoding: Accept-Encoding header of the request
+
+        Returns:
+            (status code, encoded JSON body, gzipped)
+
+        """
+        metadata_only = "as=PartialObjectMetadataList" in accept
+        compress = "gzip" in accept_encoding
+        key = (path, metadata_only, compress)
+        if self.cache is not None and key in self.cache:
+            return self.cache[key]
+        url = urlsplit(path)
+        for pattern, kind in ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            return 404, encode(status_object(404, "NotFound")), False
+        namespace = match.groupdict().get("namespace")
+        if (namespace is not None and namespace not in SYSTEM_NAMESPACES
+                and self.cluster.namespace_index(namespace) is None):
+            return 404, encode(status_object(404, "NotFound")), False
+        data = encode(self.list_response(kind, namespace, parse_qs(url.query),
+                                         metadata_only))
+        compress = compress and len(data) >= GZIP_THRESHOLD
+        if compress:
+            data = gzip.compress(data, compresslevel=1)
+        response = 200, data, compress
+        if self.cache is not None:
+            self.cache[key] = response
+        return response
+
+    def list_response(self, kind, namespace, query, metadata_only):
+        """Build the body of one list response.
+
+        Args:
+            kind: "namespaces", "deployments" or "pods"
+            namespace: namespace being listed, or None for all namespaces
+            query: parsed query string with optional limit and continue
+            metadata_only: answer with a PartialObjectMetadataList
+
+        Returns:
+            dict of the list response
+
+        """
+        total = self.cluster.count(kind, namespace)
+        start = int(query.get("continue", ["0"])[0] or 0)
+        limit = int(query.get("limit", ["0"])[0] or 0)
+        end = min(total, start + limit) if limit else total
+        items = [self.cluster.object(kind, index, namespace)
+                 for index in range(start, end)]
+        list_kind, api_version = LIST_KINDS[kind]
+        if metadata_only:
+            items = [{"metadata": item["metadata"]} for item in items]
+            list_kind, api_version = "PartialObjectMetadataList", "meta.k8s.io/v1"
+        metadata = {"resourceVersion": str(total)}
+        if end < total:
+            metadata["continue"] = str(end)
+            metadata["remainingItemCount"] = total - end
+        return {"kind": list_kind, "apiVersion": api_version,
+                "metadata": metadata, "items": items}
+
+
+def make_handler(api_server):
+    """Return a request handler class bound to a FakeApiServer."""
+    class Handler(BaseHTTPRequestHandler):
+        """Answer list requests of the Kubernetes API."""
+
+        protocol_version = "HTTP/1.1"
+        # Headers and body are separate writes; do not let Nagle delay the body
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            """Count the connections opened by clients."""
+            super().setup()
+            with api_server._lock:
+                api_server.connections += 1
+
+        def do_GET(self):
+            """Answer a list request, or throttle it when all seats are taken."""
+            with api_server._lock:
+                throttle = (api_server.max_in_flight is not None and
+                            api_server.in_flight >= api_server.max_in_flight)
+                if throttle:
+                    api_server.throttled += 1
+                else:
+                    api_server.in_flight += 1
+            if throttle:
+                self.send_data(429, encode(status_object(429, "TooManyRequests")),
+                               False, {"Retry-After": str(api_server.retry_after)})
+                return
+            try:
+                self.serve_list()
+            finally:
+                with api_server._lock:
+                    api_server.in_flight -= 1
+
+        def serve_list(self):
+            """Answer a list request from the synthetic cluster."""
+            if api_server.latency:
+                time.sleep(api_server.latency)
+            status, data, compressed = api_server.respond(
+                self.path, self.headers.get("Accept", ""),
+                self.headers.get("Accept-Encoding", ""))
+            with api_server._lock:
+                api_server.requests.append(self.path)
+                api_server.bytes_sent += len(data)
+            if api_server.bandwidth:
+                time.sleep(len(data) / api_server.bandwidth)
+            self.send_data(status, data, compressed)
+
+        def send_data(self, status, data, compressed, headers=None):
+            """Send a JSON response."""
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            if compressed:
+                self.send_header("Content-Encoding", "gzip")
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            """Keep the benchmark output quiet."""
+
+    return Handler
+
+
+def encode(doc):
+    """Encode a response document as compact JSON."""
+    return json.dumps(doc, separators=(",", ":")).encode()
+
+
+def status_object(code, reason):
+    """Return a Kubernetes Status failure response."""
+    return {"kind": "Status", "apiVersion": "v1", "status": "Failure",
+            "reason": reason, "code": code}
+
+
+KUBECONFIG = """apiVersion: v1
+kind: Config
+clusters:
+- name: fake
+  cluster:
+    server: {host}
+users:
+- name: fake
+  user:
+    token: fake-token
+contexts:
+- name: fake
+  context:
+    cluster: fake
+    user: fake
+current-context: fake
+"""
+
+
+def main():
+    """Serve a synthetic cluster until interrupted."""
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--namespaces", type=int, default=100)
+    parser.add_argument("--deployments", type=int, default=5,
+                        help="deployments per namespace")
+    parser.add_argument("--pods", type=int, default=4, help="pods per deployment")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds each request is delayed")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="requests served at once, others get a 429")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--kubeconfig", default="fake-kubeconfig")
+    args = parser.parse_args()
+
+    cluster = SyntheticCluster(args.namespaces, args.deployments, args.pods)
+    with FakeApiServer(cluster, args.latency, args.port,
+                       max_in_flight=args.max_in_flight) as server:
+        server.write_kubeconfig(args.kubeconfig)
+        print("Serving {} namespaces, {} deployments, {} pods on {}".format(
+            cluster.count("namespaces"), cluster.count("deployments"),
+            cluster.count("pods"), server.host))
+        print("Kubeconfig written to {}".format(args.kubeconfig))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ GitHub Repo: https://github.com/microsoft/hydrate
 Functions:
     - main()
     - parse_args()
+    - parse_index_args()
 """
 import os
 import sys
@@ -12,8 +13,11 @@ from argparse import ArgumentParser
 from pathlib import Path
 from timeit import default_timer
 
-from .hld import HLD_Generator
-from .telemetry import Telemetry
+from .cluster import ALL_NAMESPACES_THRESHOLD, DEFAULT_PAGE_SIZE, DEFAULT_WORKERS
+from .cluster import COMPONENT_KINDS, DEFAULT_KINDS, MAX_RETRIES, SNAPSHOT_TTL
+from .index import DEFAULT_INDEX
+from .match import DEFAULT_ENGINE, ENGINES
+from .scrape import FAB_DEFS_URL, HTTP_CACHE_DIR, github_repo
 
 
 def parse_args(args):
@@ -53,22 +57,257 @@ def parse_args(args):
         action='store_true',
         default=False,
         help='Enable telemetry data collection.')
+    parser.add_argument(
+        '-w', '--workers',
+        action='store',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help='Max concurrent cluster API calls (default:{})'.format(DEFAULT_WORKERS),
+        metavar='N')
+    parser.add_argument(
+        '--page-size',
+        action='store',
+        type=int,
+        default=DEFAULT_PAGE_SIZE,
+        help='Max objects per cluster list call, 0 to disable paging '
+             '(default:{})'.format(DEFAULT_PAGE_SIZE),
+        metavar='N')
+    parser.add_argument(
+        '--all-namespaces-threshold',
+        action='store',
+        type=int,
+        default=ALL_NAMESPACES_THRESHOLD,
+        help='Namespace count from which one cluster-wide list call replaces '
+             'per-namespace calls, 0 to disable (default:{})'.format(
+                 ALL_NAMESPACES_THRESHOLD),
+        metavar='N')
+    parser.add_argument(
+        '--pool-size',
+        action='store',
+        type=int,
+        default=None,
+        help='Max kept-alive connections to the cluster (default:one per '
+             'concurrent call)',
+        metavar='N')
+    parser.add_argument(
+        '--max-retries',
+        action='store',
+        type=int,
+        default=MAX_RETRIES,
+        help='Retries of a throttled or failed cluster list call, 0 to disable '
+             '(default:{})'.format(MAX_RETRIES),
+        metavar='N')
+    parser.add_argument(
+        '--no-gzip',
+        action='store_true',
+        help='Do not ask the cluster for gzip-compressed responses.')
+    parser.add_argument(
+        '--metadata-only',
+        action='store_true',
+        help='Fetch only object metadata from the cluster.')
+    parser.add_argument(
+        '--raw-json',
+        action='store_true',
+        help='Parse cluster list responses as raw JSON instead of client models.')
+    parser.add_argument(
+        '--kinds',
+        action='store',
+        nargs='+',
+        choices=COMPONENT_KINDS,
+        default=list(DEFAULT_KINDS),
+        help='Resource kinds matched to Fabrikate components, collected '
+             'concurrently (default:{})'.format(" ".join(DEFAULT_KINDS)),
+        metavar='KIND')
+    parser.add_argument(
+        '--namespaced-components',
+        action='store_true',
+        help='Also turn the objects of every application namespace into '
+             'components, for namespaces shared by several applications.')
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Crawl the cluster while the Fabrikate definitions are fetched, '
+             'and write component.yaml while the manifests are written.')
+    parser.add_argument(
+        '--watch',
+        action='store',
+        type=float,
+        default=None,
+        help='Keep running and regenerate component.yaml when the cluster '
+             'changes, at most once every SECONDS.',
+        metavar='SECONDS')
+    parser.add_argument(
+        '--snapshot',
+        action='store',
+        default=None,
+        help='Reuse the cluster snapshot FILE while it is fresh, otherwise '
+             'crawl the cluster and write it.',
+        metavar='FILE')
+    parser.add_argument(
+        '--snapshot-ttl',
+        action='store',
+        type=float,
+        default=SNAPSHOT_TTL,
+        help='Seconds a --snapshot is reused (default:{})'.format(SNAPSHOT_TTL),
+        metavar='SECONDS')
+    parser.add_argument(
+        '--from-snapshot',
+        action='store',
+        default=None,
+        help='Generate from the cluster snapshot FILE, whatever its age, '
+             'without contacting the cluster.',
+        metavar='FILE')
+    add_definition_arguments(parser)
+    parser.add_argument(
+        '--index',
+        action='store',
+        default=None,
+        help='Read the Fabrikate definitions from the index FILE built by '
+             '"hydrate index build", instead of scraping them.',
+        metavar='FILE')
+    parser.add_argument(
+        '--matcher',
+        action='store',
+        choices=ENGINES,
+        default=DEFAULT_ENGINE,
+        help='Engine matching the cluster with the Fabrikate definitions, '
+             'bitset needs numpy (default:{})'.format(DEFAULT_ENGINE),
+        metavar='ENGINE')
+    parser.add_argument(
+        '--kubeconfigs',
+        action='store',
+        nargs='+',
+        default=None,
+        help='Generate one component.yaml per kubeconfig file, in '
+             '<output>/<file name>/.',
+        metavar='FILE')
+    parser.add_argument(
+        '--contexts',
+        action='store',
+        nargs='+',
+        default=None,
+        help='Generate one component.yaml per context of --kubeconfig, in '
+             '<output>/<context>/.',
+        metavar='CONTEXT')
+    parser.add_argument(
+        '-p', '--processes',
+        action='store',
+        type=int,
+        default=None,
+        help='Max clusters processed at once with --kubeconfigs or --contexts '
+             '(default:CPU count)',
+        metavar='N')
+    # Set per cluster by --kubeconfigs and --contexts
+    parser.set_defaults(context=None, manifests='manifests')
+
+    args = parser.parse_args(args)
+    if args.watch is not None and (args.kubeconfigs or args.contexts):
+        parser.error('--watch follows a single cluster and cannot be combined '
+                     'with --kubeconfigs or --contexts')
+    if args.watch is not None and (args.snapshot or args.from_snapshot):
+        parser.error('--watch keeps an up-to-date index of the cluster and '
+                     'cannot be combined with --snapshot or --from-snapshot')
+    check_definition_sources(parser, args)
+    return args
+
+
+def parse_index_args(args):
+    """Parse the arguments of hydrate index."""
+    parser = ArgumentParser(
+        prog='hydrate index',
+        description='Build an index of the Fabrikate definitions, read by '
+                    'hydrate run --index instead of scraping them.')
+    parser.add_argument(
+        'build',
+        choices=['build'],
+        help='Scrape the Fabrikate definitions and write their index.')
+    parser.add_argument(
+        '-o', '--output',
+        action='store',
+        default=DEFAULT_INDEX,
+        help='Index file to write (default:{})'.format(DEFAULT_INDEX),
+        metavar='FILE')
+    add_definition_arguments(parser)
+    parser.set_defaults(index=None)
+    args = parser.parse_args(args)
+    check_definition_sources(parser, args)
+    return args
 
-    return parser.parse_args(args)
+
+def add_definition_arguments(parser):
+    """Add the arguments choosing where the Fabrikate definitions come from."""
+    parser.add_argument(
+        '--http-cache',
+        action='store',
+        default=HTTP_CACHE_DIR,
+        help='Folder caching the Fabrikate definitions fetched from GitHub, '
+             'revalidated with conditional requests (default:{})'.format(
+                 HTTP_CACHE_DIR),
+        metavar='DIR')
+    parser.add_argument(
+        '--no-http-cache',
+        action='store_const',
+        const=None,
+        dest='http_cache',
+        help='Download the Fabrikate definitions on every run.')
+    parser.add_argument(
+        '--definitions',
+        action='store',
+        nargs='+',
+        default=None,
+        help='Fabrikate definition sources, GitHub repositories or local '
+             'checkouts, fetched concurrently. A definition found in several '
+             'sources is taken from the first one (default:{})'.format(FAB_DEFS_URL),
+        metavar='SOURCE')
+    parser.add_argument(
+        '--definitions-dir',
+        action='store',
+        default=None,
+        help='Read the Fabrikate definitions from DIR, a local checkout of '
+             'fabrikate-definitions, instead of GitHub. With --definitions, '
+             'DIR is the last source.',
+        metavar='DIR')
+    parser.add_argument(
+        '--enrich-definitions',
+        action='store_true',
+        help='Also read the component.yaml of every Fabrikate definition, '
+             'for its generator, helm charts and subcomponents.')
+
+
+def check_definition_sources(parser, args):
+    """Exit with an error unless every definition source exists."""
+    for source in args.definitions or []:
+        if not github_repo(source) and not os.path.isdir(source):
+            parser.error('--definitions {} is neither a GitHub repository nor '
+                         'a folder'.format(source))
 
 
 def main():
     """Generate the HLD for the cluster."""
+    if sys.argv[1:2] == ['index']:
+        return index(parse_index_args(sys.argv[2:]))
     args = parse_args(sys.argv[1:])
+    # The pipeline pulls in ruamel.yaml, requests and kubernetes; --help
+    # and argument errors exit above without paying for them.
+    from .hld import HLD_Generator, cluster_targets, generate_clusters
+    from .telemetry import Telemetry
 
     # Enable/Disable telemetry based on argument. Default: Disabled
     telemetry = Telemetry(args.telemetry)
 
     start_time = default_timer()
+    failed = []
 
     # Generates HLD and manifests directory.
-    hydrator = HLD_Generator(args)
-    hydrator.generate()
+    if args.kubeconfigs or args.contexts:
+        targets = cluster_targets(args.kubeconfigs, args.contexts, args.kubeconfig)
+        failed = generate_clusters(args, targets, args.processes)
+    else:
+        hydrator = HLD_Generator(args)
+        if args.watch is None:
+            hydrator.generate()
+        else:
+            hydrator.watch(args.watch)
 
     runtime = default_timer() - start_time
 
@@ -76,6 +315,17 @@ def main():
     telemetry.track_metric("Hydrate runtime", runtime)
     print(f"Hydrate runtime: {runtime}")
     telemetry.flush()
+    if failed:
+        sys.exit("Failed clusters: {}".format(", ".join(failed)))
+
+
+def index(args):
+    """Build the index of the Fabrikate definitions."""
+    from .hld import build_index
+    start_time = default_timer()
+    components = build_index(args)
+    print("Indexed {} definitions in {} ({:.2f}s)".format(
+        len(components), args.output, default_timer() - start_time))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,231 @@
+"""Asyncio Kubernetes Cluster API Class."""
+from .cluster import CallLatency
+from .cluster import DEFAULT_PAGE_SIZE
+from .cluster import NAMESPACES
+from .cluster import PARTIAL_METADATA_ACCEPT
+from .cluster import QueryCache
+from .cluster import json_loads
+from .cluster import json_page
+from timeit import default_timer
+import asyncio
+
+# Number of Kubernetes API requests allowed in flight at once
+DEFAULT_CONCURRENCY = 100
+
+# REST paths of the list calls
+LIST_PATHS = {
+    "list_namespace": "/api/v1/namespaces",
+    "list_namespaced_deployment": "/apis/apps/v1/namespaces/{}/deployments",
+    "list_namespaced_pod": "/api/v1/namespaces/{}/pods",
+}
+
+
+class AsyncCluster():
+    """Define Cluster data and coroutines on a single event loop.
+
+    Every request shares one aiohttp connection pool, so many namespaces
+    can be listed concurrently from one thread. Responses are parsed as raw
+    JSON, like Cluster with raw_json set.
+    """
+
+    def __init__(self, kubeconfig, concurrency=DEFAULT_CONCURRENCY,
+                 page_size=DEFAULT_PAGE_SIZE, metadata_only=False):
+        """Instantiate AsyncCluster object.
+
+        Args:
+            kubeconfig: credential file for cluster
+            concurrency: max requests in flight and pooled connections
+                       (default:100)
+            page_size: max objects per list response, None or 0 to
+                       request whole lists (default:500)
+            metadata_only: fetch PartialObjectMetadata lists instead of full
+                       objects (default:False)
+
+        """
+        self.kubeconfig = kubeconfig
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.metadata_only = metadata_only
+        self.host = None
+        self.session = None
+        self.query_cache = QueryCache()
+        self.namespaced_pods = self.query_cache.table("pods")
+        self.namespaced_deployments = self.query_cache.table("deployments")
+        self.call_latencies = []
+        self._semaphore = None
+
+    @property
+    def namespaces(self):
+        """Namespaces listed so far, None before the first list."""
+        return self.query_cache.table(NAMESPACES).get(None)
+
+    async def __aenter__(self):
+        """Connect to the cluster."""
+        await self.connect_to_cluster()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Close the connection pool."""
+        await self.close()
+
+    async def connect_to_cluster(self):
+        """Load the kubeconfig and open the shared connection pool."""
+        import aiohttp
+        from kubernetes.client import Configuration
+        from kubernetes.config import load_kube_config
+        config = Configuration()
+        load_kube_config(self.kubeconfig, client_configuration=config)
+        headers = {'Accept': PARTIAL_METADATA_ACCEPT if self.metadata_only
+                   else 'application/json'}
+        auth = get_authorization(config)
+        if auth:
+            headers['Authorization'] = auth
+        connector = aiohttp.TCPConnector(limit=self.concurrency,
+                                         ssl=ssl_context(config))
+        self.host = config.host.rstrip("/")
+        self.session = aiohttp.ClientSession(connector=connector, headers=headers)
+
+    async def close(self):
+        """Close the shared connection pool."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def get_namespaces(self):
+        """Query the cluster for namespaces, once."""
+        return await self.query_cache.get_async(
+            NAMESPACES, None, lambda: self._list_names("list_namespace", None))
+
+    async def get_namespaced_deployments(self, namespace):
+        """Store the list of deployments in the namespace.
+
+        Args:
+            namespace: The namespace to look in.
+
+        Return:
+            deployment_list: list of deployments found in the namespace.
+
+        """
+        return await self.query_cache.get_async(
+            "deployments", namespace,
+            lambda: self._list_names("list_namespaced_deployment", namespace))
+
+    async def get_namespaced_pods(self, namespace):
+        """Store the list of pods in the namespace.
+
+        Args:
+            namespace: The namespace to look in.
+
+        Return:
+            pod_list: list of pods found in the namespace.
+
+        """
+        return await self.query_cache.get_async(
+            "pods", namespace,
+            lambda: self._list_names("list_namespaced_pod", namespace))
+
+    async def get_deployments_by_namespace(self, namespaces):
+        """Collect the deployments of several namespaces concurrently.
+
+        Returns:
+            {namespace: deployment_list, ...} in the order of namespaces
+
+        """
+        return await gather_by_namespace(self.get_namespaced_deployments, namespaces)
+
+    async def get_pods_by_namespace(self, namespaces):
+        """Collect the pods of several namespaces concurrently.
+
+        Returns:
+            {namespace: pod_list, ...} in the order of namespaces
+
+        """
+        return await gather_by_namespace(self.get_namespaced_pods, namespaces)
+
+    async def _list_names(self, call, namespace):
+        """Return the object names from every page of a list call."""
+        url = self.host + LIST_PATHS[call].format(namespace)
+        params = {}
+        if self.page_size:
+            params['limit'] = str(self.page_size)
+        names = []
+        while True:
+            page = await self._timed_get(call, namespace, url, params)
+            names.extend(ref.name for ref in page.items)
+            token = page.continue_token
+            if not (self.page_size and isinstance(token, str) and token):
+                return names
+            params['continue'] = token
+
+    async def _timed_get(self, call, namespace, url, params):
+        """GET one list page and record its latency.
+
+        Returns:
+            ListPage of the response
+
+        """
+        if self._semaphore is None:
+            # Created here, so it belongs to the loop running the requests
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            start_time = default_timer()
+            try:
+                async with self.session.get(url, params=params) as resp:
+                    resp.raise_for_status()
+                    body = await resp.read()
+            finally:
+                self.call_latencies.append(
+                    CallLatency(call, namespace, default_timer() - start_time))
+        return json_page(json_loads(body))
+
+    def latency_summary(self):
+        """Summarize the API calls made so far and their latency."""
+        latencies = [latency.seconds for latency in self.call_latencies]
+        if not latencies:
+            return "No cluster API calls made."
+        return "{} cluster API calls: {:.3f}s total, {:.3f}s max".format(
+            len(latencies), sum(latencies), max(latencies))
+
+
+async def gather_by_namespace(func, namespaces):
+    """Await func once per namespace, concurrently.
+
+    Returns:
+        {namespace: result, ...} in the order of namespaces
+
+    """
+    namespaces = list(namespaces)
+    results = await asyncio.gather(*[func(namespace) for namespace in namespaces])
+    return dict(zip(namespaces, results))
+
+
+def get_authorization(config):
+    """Return the Authorization header value of a client Configuration."""
+    if getattr(config, 'refresh_api_key_hook', None) is not None:
+        config.refresh_api_key_hook(config)
+    for key in ('authorization', 'BearerToken'):
+        auth = config.get_api_key_with_prefix(key)
+        if auth:
+            return auth
+    if config.username and config.password:
+        return config.get_basic_auth_token()
+    return None
+
+
+def ssl_context(config):
+    """Build the SSL context of a client Configuration.
+
+    Returns:
+        ssl.SSLContext, or None for plain HTTP
+
+    """
+    import ssl
+    if not config.host.startswith("https"):
+        return None
+    context = ssl.create_default_context(cafile=config.ssl_ca_cert)
+    if config.cert_file:
+        context.load_cert_chain(config.cert_file, config.key_file)
+    if not config.verify_ssl:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
@@ -1,64 +1,316 @@
 """Kubernetes Cluster API Class."""
 from .component import Component
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Condition, Event, Lock, RLock, Thread
+from timeit import default_timer
+import gzip
+import json
+import os
+import random
 import re
+import time
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Number of Kubernetes API calls allowed in flight at once
+DEFAULT_WORKERS = 8
+# Max objects per list response, the same chunk size kubectl uses
+DEFAULT_PAGE_SIZE = 500
+# Pause before reopening a watch stream that failed
+WATCH_RETRY_SECONDS = 5
+# Namespace count from which one cluster-wide list beats per-namespace lists
+ALL_NAMESPACES_THRESHOLD = 20
+# Retries of a list call the API server throttled or failed
+MAX_RETRIES = 5
+# Seconds of the first retry backoff, doubled on every retry
+RETRY_BACKOFF = 0.5
+# Max seconds between two attempts of a call
+MAX_RETRY_DELAY = 30
+# Statuses of list calls worth retrying: throttled or transient server errors
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# Format version of cluster snapshot files
+SNAPSHOT_VERSION = 3
+# Seconds a cluster snapshot is reused before the cluster is crawled again
+SNAPSHOT_TTL = 3600
+
+# Query cache table of the namespace list
+NAMESPACES = "namespaces"
+
+# List query plans
+NAMESPACED = "namespaced"
+CLUSTER_WIDE = "cluster-wide"
+
+# Ask for PartialObjectMetadataList, falling back to full objects on old servers
+PARTIAL_METADATA_ACCEPT = ("application/json;as=PartialObjectMetadataList;"
+                           "g=meta.k8s.io;v=v1,application/json")
+
+# Cluster API attribute serving each list call
+LIST_APIS = {
+    "list_namespace": "core_v1_api",
+}
+
+CallLatency = namedtuple('CallLatency', ['call', 'namespace', 'seconds'])
+ObjectRef = namedtuple('ObjectRef', ['namespace', 'name'])
+ListPage = namedtuple('ListPage', ['items', 'continue_token', 'resource_version'])
+Collector = namedtuple('Collector', ['kind', 'api', 'namespaced_call',
+                                     'all_namespaces_call', 'exclude'])
+
+# Resource kinds Cluster can list, by kind
+COLLECTORS = dict()
+
+
+def register_collector(kind, api, namespaced_call, all_namespaces_call, exclude=()):
+    """Register how a resource kind is listed.
+
+    Args:
+        kind: plural resource name, such as "deployments"
+        api: Cluster API attribute serving the list calls
+        namespaced_call: name of the per-namespace list call
+        all_namespaces_call: name of the cluster-wide list call
+        exclude: object names to leave out, such as built-in objects
+
+    """
+    COLLECTORS[kind] = Collector(kind, api, namespaced_call, all_namespaces_call,
+                                 frozenset(exclude))
+    LIST_APIS[namespaced_call] = api
+    LIST_APIS[all_namespaces_call] = api
+
+
+register_collector("deployments", "apps_v1_api", "list_namespaced_deployment",
+                   "list_deployment_for_all_namespaces")
+register_collector("statefulsets", "apps_v1_api", "list_namespaced_stateful_set",
+                   "list_stateful_set_for_all_namespaces")
+register_collector("daemonsets", "apps_v1_api", "list_namespaced_daemon_set",
+                   "list_daemon_set_for_all_namespaces")
+register_collector("cronjobs", "batch_api", "list_namespaced_cron_job",
+                   "list_cron_job_for_all_namespaces")
+register_collector("services", "core_v1_api", "list_namespaced_service",
+                   "list_service_for_all_namespaces", exclude=("kubernetes",))
+register_collector("pods", "core_v1_api", "list_namespaced_pod",
+                   "list_pod_for_all_namespaces")
+
+# Kinds that can be matched to Fabrikate components
+COMPONENT_KINDS = ("deployments", "statefulsets", "daemonsets", "cronjobs",
+                   "services")
+DEFAULT_KINDS = ("deployments",)
 
 
 class Cluster():
     """Define Cluster data and methods."""
 
-    def __init__(self, kubeconfig):
+    def __init__(self, kubeconfig, workers=DEFAULT_WORKERS,
+                 page_size=DEFAULT_PAGE_SIZE,
+                 all_namespaces_threshold=ALL_NAMESPACES_THRESHOLD,
+                 metadata_only=False, raw_json=False, context=None,
+                 kinds=DEFAULT_KINDS, pool_size=None, compress=True,
+                 max_retries=MAX_RETRIES, namespaced_components=False):
         """Instantiate Cluster object.
 
         Args:
             kubeconfig: credential file for cluster
+            workers: max concurrent per-namespace API calls (default:8)
+            page_size: max objects per list response, None or 0 to
+                       request whole lists (default:500)
+            all_namespaces_threshold: namespace count from which a single
+                       cluster-wide list is used, 0 to never use one (default:20)
+            metadata_only: fetch PartialObjectMetadata lists instead of full
+                       objects (default:False)
+            raw_json: parse list responses as raw JSON instead of client
+                       models (default:False)
+            context: kubeconfig context to use, None for the current
+                       context (default:None)
+            kinds: resource kinds collected into components
+                       (default:("deployments",))
+            pool_size: max kept-alive connections to the cluster, None for
+                       one per concurrent call (default:None)
+            compress: ask for gzip-compressed responses (default:True)
+            max_retries: retries of a throttled or failed list call, 0 to
+                       fail on the first error (default:5)
+            namespaced_components: also turn the objects of application
+                       namespaces into components (default:False)
 
         """
         self.kubeconfig = kubeconfig
+        self.context = context
+        self.kinds = tuple(kinds)
+        self.pool_size = pool_size
+        self.compress = compress
+        self.workers = workers
+        self.page_size = page_size
+        self.all_namespaces_threshold = all_namespaces_threshold
+        self.metadata_only = metadata_only
+        self.raw_json = raw_json
+        self.max_retries = max_retries
+        self.namespaced_components = namespaced_components
         self.apps_v1_api = None
         self.core_v1_api = None
-        self.namespaced_pods = dict()
-        self.namespaced_deployments = dict()
+        self.batch_api = None
+        self.metadata_apps_v1_api = None
+        self.metadata_core_v1_api = None
+        self.metadata_batch_api = None
+        self.query_cache = QueryCache()
+        self.namespaced_objects = {kind: self.query_cache.table(kind)
+                                   for kind in COLLECTORS}
+        self.namespaced_pods = self.namespaced_objects["pods"]
+        self.namespaced_deployments = self.namespaced_objects["deployments"]
+        self.call_latencies = []
+        self.kind_timings = dict()
+        self._latency_lock = Lock()
+        self.limiter = AdaptiveLimiter(self.get_pool_size())
+        self.retries = 0
+
+    @property
+    def namespaces(self):
+        """Namespaces listed so far, None before the first list."""
+        return self.query_cache.table(NAMESPACES).get(None)
+
+    @namespaces.setter
+    def namespaces(self, namespaces):
+        self.query_cache.table(NAMESPACES)[None] = namespaces
 
     def connect_to_cluster(self):
         """Connect to the cluster. Set API attributes."""
         from kubernetes.config import load_kube_config
-        from kubernetes.client import AppsV1Api, CoreV1Api
-        load_kube_config(self.kubeconfig)
-        self.apps_v1_api = AppsV1Api()
-        self.core_v1_api = CoreV1Api()
+        from kubernetes.client import ApiClient, AppsV1Api, Configuration, CoreV1Api
+        from urllib3.util.retry import Retry
+        configuration = Configuration()
+        load_kube_config(self.kubeconfig, context=self.context,
+                         client_configuration=configuration)
+        configuration.connection_pool_maxsize = self.get_pool_size()
+        # urllib3 would wait out Retry-After itself, holding the call's slot
+        # and hiding the throttling from the limiter; _timed_call retries
+        configuration.retries = Retry(respect_retry_after_header=False)
+        # One client, so every API object reuses the same kept-alive connections
+        api_client = ApiClient(configuration)
+        if self.compress:
+            api_client.set_default_header('Accept-Encoding', 'gzip')
+        batch_api = get_batch_api_class()
+        self.apps_v1_api = AppsV1Api(api_client)
+        self.core_v1_api = CoreV1Api(api_client)
+        self.batch_api = batch_api(api_client)
+        if self.metadata_only:
+            # Default headers override the Accept header of generated calls
+            metadata_client = ApiClient(configuration, header_name='Accept',
+                                        header_value=PARTIAL_METADATA_ACCEPT)
+            metadata_client.rest_client = api_client.rest_client
+            if self.compress:
+                metadata_client.set_default_header('Accept-Encoding', 'gzip')
+            self.metadata_apps_v1_api = AppsV1Api(metadata_client)
+            self.metadata_core_v1_api = CoreV1Api(metadata_client)
+            self.metadata_batch_api = batch_api(metadata_client)
+
+    def get_pool_size(self):
+        """Return the max number of kept-alive connections to the cluster.
+
+        Without a configured size, there is one connection for each call
+        that can be in flight: workers per kind, for every kind collected
+        at once.
+        """
+        if self.pool_size:
+            return self.pool_size
+        return max(self.workers, 1) * max(len(self.kinds), 1)
 
     def get_components(self):
         """Query the cluster for components.
 
+        Application namespaces and the objects of the default namespace are
+        components. With namespaced_components, the objects of every
+        application namespace are collected concurrently too, so several
+        applications sharing a namespace become separate components. Every
+        kind in self.kinds is collected concurrently.
+
         Returns:
             sorted dictionary of components in the cluster
 
         """
-        components = []
-        default_deployments = self.get_namespaced_deployments("default")
-        namespaces = self.get_namespaces()
-        namespaces = remove_default_namespaces(namespaces)
-        # Scenario where cluster applications live in namespaces
-        if namespaces:
-            first_words = [get_first_word(name) for name in namespaces]
-            components.extend([Component(name=word) for word in first_words])
-        # Scenario where cluster applications live in default
-        if default_deployments:
-            dep_names = [re.sub(r'-deployment', '', d) for d in default_deployments]
-            components.extend([Component(name=name) for name in dep_names])
+        namespaces = remove_default_namespaces(self.get_namespaces())
+        listed = ["default"]
+        if self.namespaced_components:
+            listed += namespaces or []
+        objects = self.get_objects_by_kind(self.kinds, listed)
+        default_objects = [name for by_namespace in objects.values()
+                           for name in by_namespace.pop("default") or []]
+        return build_components(namespaces, default_objects,
+                                [name for by_namespace in objects.values()
+                                 for names in by_namespace.values()
+                                 for name in names or []])
+
+    def get_objects_by_kind(self, kinds, namespaces):
+        """Collect several resource kinds in several namespaces concurrently.
+
+        The time taken by each kind is kept in self.kind_timings.
+
+        Args:
+            kinds: registered resource kinds
+            namespaces: list of namespaces to look in
+
+        Returns:
+            {kind: {namespace: names, ...}, ...} in the order of kinds
+
+        """
+        def collect(kind):
+            start_time = default_timer()
+            try:
+                return self.get_objects_by_namespace(kind, namespaces)
+            finally:
+                with self._latency_lock:
+                    self.kind_timings[kind] = default_timer() - start_time
+        kinds = list(kinds)
+        if len(kinds) <= 1:
+            return {kind: collect(kind) for kind in kinds}
+        with ThreadPoolExecutor(max_workers=len(kinds)) as executor:
+            return dict(zip(kinds, executor.map(collect, kinds)))
+
+    def get_namespaced_objects(self, kind, namespace):
+        """Store the list of objects of a kind in the namespace.
+
+        Args:
+            kind: registered resource kind
+            namespace: The namespace to look in.
+
+        Return:
+            list of object names found in the namespace.
 
-        return components
+        """
+        def list_objects():
+            return list(self.iter_namespaced_objects(kind, namespace))
+        return self.query_cache.get(kind, namespace, list_objects)
+
+    def iter_namespaced_objects(self, kind, namespace):
+        """Yield object names of a kind in the namespace, one page at a time."""
+        collector = COLLECTORS[kind]
+        list_func = getattr(getattr(self, collector.api), collector.namespaced_call)
+        for name in self._iter_names(collector.namespaced_call, namespace,
+                                     list_func, namespace):
+            if name not in collector.exclude:
+                yield name
+
+    def get_objects_by_namespace(self, kind, namespaces):
+        """Collect the objects of a kind in several namespaces concurrently.
+
+        Args:
+            kind: registered resource kind
+            namespaces: list of namespaces to look in.
+
+        Returns:
+            {namespace: names, ...} in the order of namespaces
 
-    def get_statefulsets(self):
-        """Query the cluster for statefulsets."""
-        ret = self.apps_v1_api.list_stateful_set_for_all_namespaces()
-        with open("statefulsets.json", "w") as of:
-            of.write(dict(ret))
+        """
+        return self._collect(kind, namespaces)
 
     def get_namespaces(self):
-        """Query the cluster for namespaces."""
-        ret = self.core_v1_api.list_namespace()
-        return [i.metadata.name for i in ret.items]
+        """Query the cluster for namespaces.
+
+        The list is kept so later stages, such as the manifest generation,
+        do not query the cluster again.
+        """
+        return self.query_cache.get(NAMESPACES, None,
+                                    lambda: list(self.iter_namespaces()))
 
     def get_namespaced_deployments(self, namespace):
         """Store the list of deployments in the namespace.
@@ -70,13 +322,7 @@ class Cluster():
             deployment_list: list of pods found in the namespace.
 
         """
-        if namespace in self.namespaced_deployments:
-            return self.namespaced_deployments[namespace]
-        else:
-            ret = self.apps_v1_api.list_namespaced_deployment(namespace)
-            deployment_list = [i.metadata.name for i in ret.items]
-            self.namespaced_pods[namespace] = deployment_list
-            return deployment_list
+        return self.get_namespaced_objects("deployments", namespace)
 
     def get_namespaced_pods(self, namespace):
         """Store the list of pods in the namespace.
@@ -88,29 +334,789 @@ class Cluster():
             pod_list: list of pods found in the namespace.
 
         """
-        if namespace in self.namespaced_pods:
-            return self.namespaced_pods[namespace]
-        else:
-            ret = self.core_v1_api.list_namespaced_pod(namespace)
-            pod_list = [i.metadata.name for i in ret.items]
-            self.namespaced_pods[namespace] = pod_list
-            return pod_list
+        return self.get_namespaced_objects("pods", namespace)
+
+    def iter_namespaces(self):
+        """Yield namespace names, one list page at a time."""
+        return self._iter_names("list_namespace", None,
+                                self.core_v1_api.list_namespace)
+
+    def iter_namespaced_deployments(self, namespace):
+        """Yield deployment names in the namespace, one list page at a time."""
+        return self.iter_namespaced_objects("deployments", namespace)
+
+    def iter_namespaced_pods(self, namespace):
+        """Yield pod names in the namespace, one list page at a time.
+
+        Unlike get_namespaced_pods, nothing is cached and only one page of
+        pods is held in memory, so the names can be streamed straight into
+        count_first_word or process_cluster_objects.
+        """
+        return self.iter_namespaced_objects("pods", namespace)
+
+    def get_pod_components(self, namespace):
+        """Stream the pods of a namespace into components.
+
+        Args:
+            namespace: The namespace to look in.
+
+        Returns:
+            components named by pod prefix, most frequent first
+
+        """
+        return self.process_cluster_objects(self.iter_namespaced_pods(namespace))
+
+    def get_deployments_by_namespace(self, namespaces):
+        """Collect the deployments of several namespaces concurrently.
+
+        Args:
+            namespaces: list of namespaces to look in.
+
+        Returns:
+            {namespace: deployment_list, ...} in the order of namespaces
+
+        """
+        return self.get_objects_by_namespace("deployments", namespaces)
+
+    def get_pods_by_namespace(self, namespaces):
+        """Collect the pods of several namespaces concurrently.
+
+        Args:
+            namespaces: list of namespaces to look in.
+
+        Returns:
+            {namespace: pod_list, ...} in the order of namespaces
+
+        """
+        return self.get_objects_by_namespace("pods", namespaces)
+
+    def plan_list_query(self, namespace_count):
+        """Pick how to list a resource kind across several namespaces.
+
+        Args:
+            namespace_count: number of namespaces still to be listed
+
+        Returns:
+            CLUSTER_WIDE for one paged cluster-wide list, NAMESPACED for one
+            list per namespace
+
+        """
+        if (self.all_namespaces_threshold
+                and namespace_count >= self.all_namespaces_threshold):
+            return CLUSTER_WIDE
+        return NAMESPACED
+
+    def _collect(self, kind, namespaces):
+        """List a resource kind in several namespaces, as planned.
+
+        The cluster-wide list is split by namespace locally and fills the
+        cache, dropping objects of namespaces that were not asked for.
+
+        Args:
+            kind: registered resource kind
+            namespaces: list of namespaces to look in
+
+        Returns:
+            {namespace: names, ...} in the order of namespaces
+
+        """
+        collector = COLLECTORS[kind]
+
+        def namespaced_func(namespace):
+            return self.get_namespaced_objects(kind, namespace)
+        namespaces = list(namespaces)
+        missing = self.query_cache.missing(kind, namespaces)
+        if self.plan_list_query(len(missing)) == NAMESPACED:
+            return self._fan_out(namespaced_func, namespaces)
+        by_namespace = {namespace: [] for namespace in missing}
+        call = collector.all_namespaces_call
+        all_namespaces_func = getattr(getattr(self, collector.api), call)
+        for page in self._list_pages(call, None, all_namespaces_func):
+            for ref in page.items:
+                names = by_namespace.get(ref.namespace)
+                if names is not None and ref.name not in collector.exclude:
+                    names.append(ref.name)
+        listed = self.query_cache.fill(kind, by_namespace)
+        return {namespace: listed[namespace] if namespace in listed
+                else namespaced_func(namespace) for namespace in namespaces}
+
+    def _fan_out(self, func, namespaces):
+        """Call func once per namespace using at most self.workers threads.
+
+        Results are keyed in the order of namespaces, regardless of the
+        order in which the calls complete.
+        """
+        namespaces = list(namespaces)
+        if self.workers <= 1 or len(namespaces) <= 1:
+            return {namespace: func(namespace) for namespace in namespaces}
+        max_workers = min(self.workers, len(namespaces))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(namespaces, executor.map(func, namespaces)))
+
+    def _iter_names(self, call, namespace, list_func, *args):
+        """Yield object names from every page of a list call."""
+        for page in self._list_pages(call, namespace, list_func, *args):
+            for ref in page.items:
+                yield ref.name
+
+    def _list_pages(self, call, namespace, list_func, *args):
+        """Yield ListPages, following continue tokens until the list ends.
+
+        Args:
+            call: name of the API call, used for latency records
+            namespace: namespace being listed, or None
+            list_func: Kubernetes client list function
+            args: positional arguments for list_func
+
+        """
+        kwargs = {}
+        if self.page_size:
+            kwargs['limit'] = self.page_size
+        if self.metadata_only:
+            list_func = getattr(getattr(self, "metadata_" + LIST_APIS[call]), call)
+        while True:
+            if self.metadata_only or self.raw_json:
+                page = self._timed_call(call, namespace, list_json, list_func,
+                                        *args, **kwargs)
+            else:
+                page = model_page(self._timed_call(call, namespace, list_func,
+                                                   *args, **kwargs))
+            yield page
+            token = page.continue_token
+            if not (self.page_size and isinstance(token, str) and token):
+                return
+            kwargs['_continue'] = token
+
+    def _timed_call(self, call, namespace, func, *args, **kwargs):
+        """Call a Kubernetes API function and record its latency.
+
+        Calls wait for a slot of the adaptive limiter. Throttled calls and
+        transient server errors are retried after the server's Retry-After
+        delay, or a jittered exponential backoff, outside of any slot.
+        """
+        from kubernetes.client.rest import ApiException
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            throttled = False
+            start_time = default_timer()
+            try:
+                return func(*args, **kwargs)
+            except ApiException as e:
+                throttled = e.status == 429
+                if attempt >= self.max_retries or e.status not in RETRY_STATUSES:
+                    raise
+                delay = retry_delay(e, attempt)
+            finally:
+                latency = CallLatency(call, namespace, default_timer() - start_time)
+                self.limiter.release(throttled)
+                with self._latency_lock:
+                    self.call_latencies.append(latency)
+            attempt += 1
+            with self._latency_lock:
+                self.retries += 1
+            time.sleep(delay)
+
+    def latency_summary(self):
+        """Summarize the API calls made so far and their latency."""
+        with self._latency_lock:
+            latencies = [latency.seconds for latency in self.call_latencies]
+            kind_timings = list(self.kind_timings.items())
+        if not latencies:
+            return "No cluster API calls made."
+        summary = "{} cluster API calls: {:.3f}s total, {:.3f}s max".format(
+            len(latencies), sum(latencies), max(latencies))
+        if self.retries:
+            summary += "\n  {} retries, {} throttled, final concurrency {}".format(
+                self.retries, self.limiter.throttles, self.limiter.get_limit())
+        for kind, seconds in kind_timings:
+            summary += "\n  {}: {:.3f}s".format(kind, seconds)
+        return summary
+
+    def save_snapshot(self, path):
+        """Write the collected namespaces and objects of every kind to a file.
+
+        The snapshot is gzipped JSON, written to a temporary file first so
+        readers never see a partial snapshot.
+
+        Args:
+            path: snapshot file path
+
+        """
+        with self.query_cache.lock:
+            snapshot = {"version": SNAPSHOT_VERSION,
+                        "created": time.time(),
+                        "kinds": list(self.kinds),
+                        "namespaced_components": self.namespaced_components,
+                        "namespaces": self.namespaces,
+                        "objects": self.namespaced_objects}
+            data = json.dumps(snapshot, separators=(",", ":")).encode()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wb") as of:
+            of.write(data)
+        os.replace(tmp_path, path)
+
+    def load_snapshot(self, path, ttl=None):
+        """Fill the caches from a snapshot file instead of the cluster.
+
+        Args:
+            path: snapshot file path
+            ttl: max snapshot age in seconds, None to accept any age
+
+        Returns:
+            True if the snapshot was loaded, False if it is missing,
+            unreadable, stale, of another format version or lacks objects
+            this cluster collects
+
+        """
+        try:
+            with gzip.open(path, "rb") as f:
+                snapshot = json_loads(f.read())
+        except (OSError, EOFError, ValueError):
+            # Missing, truncated or corrupt: as good as no snapshot
+            return False
+        if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+            return False
+        if ttl is not None and time.time() - snapshot["created"] > ttl:
+            return False
+        if not set(self.kinds) <= set(snapshot["kinds"]):
+            return False
+        if self.namespaced_components and not snapshot["namespaced_components"]:
+            return False
+        self.namespaces = snapshot["namespaces"]
+        for kind, by_namespace in snapshot["objects"].items():
+            self.query_cache.fill(kind, by_namespace, count=False)
+            self.namespaced_objects.setdefault(kind, self.query_cache.table(kind))
+        return True
 
     def process_cluster_objects(self, object_list):
         """Process a list of kubernetes objects.
 
         Args:
-            object_list: list of object names
+            object_list: list or iterator of object names
 
         Returns:
             comp_list: component names sorted by value in desc. order
 
         """
-        comp_list = count_first_word(object_list)
-        comp_list = sort_dict_by_value(comp_list)
-        # Take just the component name, not the frequency
-        comp_list = [Component(component[0]) for component in comp_list]
-        return comp_list
+        return objects_to_components(object_list)
+
+
+class ClusterInventory():
+    """Keep an in-memory index of a cluster up to date with watch streams.
+
+    The cluster is listed once, then the watches of namespaces and of every
+    kind the cluster collects are followed from the listed resourceVersion.
+    Components are only rebuilt after the index changes, so regenerating the
+    HLD costs about as much as the number of changes instead of a full crawl.
+    """
+
+    def __init__(self, cluster, timeout_seconds=300):
+        """Instantiate ClusterInventory object.
+
+        Args:
+            cluster: connected Cluster object
+            timeout_seconds: server-side timeout of each watch request
+
+        """
+        self.cluster = cluster
+        self.timeout_seconds = timeout_seconds
+        self.kinds = (NAMESPACES,) + tuple(cluster.kinds)
+        self.namespaces = dict()
+        self.objects = {kind: dict() for kind in cluster.kinds}
+        self.resource_versions = dict()
+        self.changes = 0
+        self._components = None
+        self._changed = Condition()
+        self._stop = Event()
+        self._threads = []
+        self.error = None
+
+    def sync(self):
+        """List namespaces and every collected kind, replacing the whole index."""
+        for kind in self.kinds:
+            self._relist(kind)
+
+    def start(self):
+        """Sync the index and follow the watch streams in the background."""
+        self.sync()
+        self._stop.clear()
+        self._threads = [Thread(target=self._follow, args=(kind,), daemon=True)
+                         for kind in self.kinds]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop following the watch streams."""
+        self._stop.set()
+        with self._changed:
+            self._changed.notify_all()
+
+    def wait_for_changes(self, changes, timeout=None):
+        """Wait until the index has seen more than `changes` changes.
+
+        Returns:
+            the current number of changes
+
+        Raises:
+            the error that stopped a watch stream
+
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: (self.changes > changes or self._stop.is_set()
+                         or self.error is not None), timeout)
+            if self.error is not None:
+                raise self.error
+            return self.changes
+
+    def get_namespaces(self):
+        """Return the namespace names in the index."""
+        with self._changed:
+            return list(self.namespaces)
+
+    def get_components(self):
+        """Return the cluster components, rebuilt only after changes."""
+        with self._changed:
+            if self._components is None:
+                namespaces = remove_default_namespaces(self.namespaces)
+                listed = namespaces if self.cluster.namespaced_components else []
+                self._components = build_components(
+                    namespaces,
+                    self._names(["default"]), self._names(listed))
+            return self._components
+
+    def _names(self, namespaces):
+        """Return the indexed object names of every kind in the namespaces.
+
+        The caller must hold self._changed.
+        """
+        return [name for kind, by_namespace in self.objects.items()
+                for namespace in namespaces
+                for name in by_namespace.get(namespace, ())
+                if name not in COLLECTORS[kind].exclude]
+
+    def apply_event(self, kind, event):
+        """Apply one watch event to the index.
+
+        Args:
+            kind: "namespaces" or a collected resource kind
+            event: watch event dict with 'type' and 'raw_object' keys
+
+        """
+        obj = event['raw_object']
+        if event['type'] == 'ERROR':
+            raise WatchExpired(obj.get('message'))
+        metadata = obj['metadata']
+        with self._changed:
+            self.resource_versions[kind] = metadata['resourceVersion']
+            if event['type'] == 'BOOKMARK':
+                return
+            name = metadata['name']
+            if kind == NAMESPACES:
+                if event['type'] == 'DELETED':
+                    self.namespaces.pop(name, None)
+                    for by_namespace in self.objects.values():
+                        by_namespace.pop(name, None)
+                else:
+                    self.namespaces[name] = None
+            else:
+                names = self.objects[kind].setdefault(metadata['namespace'], dict())
+                if event['type'] == 'DELETED':
+                    names.pop(name, None)
+                else:
+                    names[name] = None
+            self._record_change()
+
+    def _record_change(self):
+        """Invalidate the components and wake up waiters.
+
+        The caller must hold self._changed.
+        """
+        self._components = None
+        self.changes += 1
+        self._changed.notify_all()
+
+    def _list_func(self, kind):
+        """Return the cluster-wide list call name and function for the kind."""
+        if kind == NAMESPACES:
+            return "list_namespace", self.cluster.core_v1_api.list_namespace
+        collector = COLLECTORS[kind]
+        call = collector.all_namespaces_call
+        return call, getattr(getattr(self.cluster, collector.api), call)
+
+    def _relist(self, kind):
+        """List every object of the kind and record the list resourceVersion."""
+        call, list_func = self._list_func(kind)
+        index = dict()
+        resource_version = None
+        for page in self.cluster._list_pages(call, None, list_func):
+            for ref in page.items:
+                if kind == NAMESPACES:
+                    index[ref.name] = None
+                else:
+                    index.setdefault(ref.namespace, dict())[ref.name] = None
+            resource_version = page.resource_version
+        with self._changed:
+            if kind == NAMESPACES:
+                self.namespaces = index
+            else:
+                self.objects[kind] = index
+            self.resource_versions[kind] = resource_version
+            self._record_change()
+
+    def _follow(self, kind):
+        """Follow the watch stream of the kind until stop() is called.
+
+        An unexpected error stops the inventory and is raised by
+        wait_for_changes, so watchers do not wait forever on a dead stream.
+        """
+        try:
+            self._follow_stream(kind)
+        except Exception as e:
+            with self._changed:
+                self.error = e
+                self._changed.notify_all()
+            self._stop.set()
+
+    def _follow_stream(self, kind):
+        """Follow the watch stream of the kind, resuming after failures."""
+        from kubernetes.client.rest import ApiException
+        from kubernetes.watch import Watch
+        from urllib3.exceptions import HTTPError
+        _, list_func = self._list_func(kind)
+        relist = False
+        while not self._stop.is_set():
+            watch = Watch()
+            try:
+                if relist:
+                    self._relist(kind)
+                    relist = False
+                for event in watch.stream(
+                        list_func,
+                        resource_version=self.resource_versions[kind],
+                        timeout_seconds=self.timeout_seconds):
+                    if self._stop.is_set():
+                        watch.stop()
+                        return
+                    self.apply_event(kind, event)
+            except WatchExpired:
+                relist = True
+            except ApiException as e:
+                # 410 Gone: the resourceVersion is too old to resume from
+                if e.status == 410:
+                    relist = True
+                else:
+                    self._stop.wait(WATCH_RETRY_SECONDS)
+            except (HTTPError, OSError):
+                # Dropped connections are routine on long watches
+                self._stop.wait(WATCH_RETRY_SECONDS)
+
+
+class QueryCache():
+    """Cache the cluster list queries of one run.
+
+    Results are kept in one table per query, such as a resource kind, keyed
+    by namespace. Concurrent callers asking for the same key wait on the
+    first caller's request instead of querying the cluster again. Hits,
+    misses and coalesced requests are counted.
+    """
+
+    def __init__(self):
+        """Instantiate QueryCache object."""
+        self.tables = dict()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.lock = RLock()
+        self._pending = dict()
+
+    def table(self, name):
+        """Return the results of a query by key, created empty if needed."""
+        with self.lock:
+            return self.tables.setdefault(name, dict())
+
+    def get(self, name, key, fetch):
+        """Return the result of a query, calling fetch() at most once per key.
+
+        Args:
+            name: query table name
+            key: query key within the table, such as a namespace
+            fetch: function querying the cluster on a miss
+
+        """
+        with self.lock:
+            table = self.tables.setdefault(name, dict())
+            if key in table:
+                self.hits += 1
+                return table[key]
+            pending = self._pending.get((name, key))
+            if pending is None:
+                self.misses += 1
+                pending = self._pending[(name, key)] = Future()
+                owner = True
+            else:
+                self.coalesced += 1
+                owner = False
+        if not owner:
+            return pending.result()
+        try:
+            result = fetch()
+        except Exception as e:
+            with self.lock:
+                del self._pending[(name, key)]
+            pending.set_exception(e)
+            raise
+        with self.lock:
+            table[key] = result
+            del self._pending[(name, key)]
+        pending.set_result(result)
+        return result
+
+    async def get_async(self, name, key, fetch):
+        """Return the result of a query, awaiting fetch() at most once per key.
+
+        The coroutine counterpart of get, for callers on one event loop:
+        concurrent callers await the first caller's task. A cache serves
+        either threads or one event loop, not both.
+
+        Args:
+            name: query table name
+            key: query key within the table, such as a namespace
+            fetch: function returning the awaitable querying the cluster
+
+        """
+        import asyncio
+        with self.lock:
+            table = self.tables.setdefault(name, dict())
+            if key in table:
+                self.hits += 1
+                return table[key]
+            pending = self._pending.get((name, key))
+            if pending is None:
+                self.misses += 1
+                pending = self._pending[(name, key)] = asyncio.ensure_future(fetch())
+                owner = True
+            else:
+                self.coalesced += 1
+                owner = False
+        if not owner:
+            return await asyncio.shield(pending)
+        try:
+            result = await asyncio.shield(pending)
+        finally:
+            with self.lock:
+                del self._pending[(name, key)]
+        with self.lock:
+            table[key] = result
+        return result
+
+    def missing(self, name, keys):
+        """Return the keys that are neither cached nor being fetched."""
+        with self.lock:
+            table = self.tables.get(name, {})
+            return [key for key in keys
+                    if key not in table and (name, key) not in self._pending]
+
+    def fill(self, name, results, count=True):
+        """Cache results fetched together, such as by one cluster-wide list.
+
+        Results already cached win, so callers all see the same lists.
+
+        Args:
+            name: query table name
+            results: {key: result, ...}
+            count: count the results as misses (default:True)
+
+        Returns:
+            {key: cached result, ...} for the keys of results
+
+        """
+        with self.lock:
+            table = self.tables.setdefault(name, dict())
+            if count:
+                self.misses += len(results)
+            return {key: table.setdefault(key, result)
+                    for key, result in results.items()}
+
+    def clear(self):
+        """Forget every result and count, to start a new run."""
+        with self.lock:
+            for table in self.tables.values():
+                table.clear()
+            self.hits = self.misses = self.coalesced = 0
+
+    def summary(self):
+        """Summarize how often queries were answered from the cache."""
+        with self.lock:
+            return "Cluster query cache: {} hits, {} misses, {} coalesced".format(
+                self.hits, self.misses, self.coalesced)
+
+
+class AdaptiveLimiter():
+    """Bound the API calls in flight, adapting the bound to throttling.
+
+    The bound follows additive increase, multiplicative decrease (AIMD):
+    it grows by one after a full window of successful calls and halves when
+    the server throttles a call. Calls already in flight when the bound was
+    halved were sent at the old rate, so their throttling does not halve it
+    again.
+    """
+
+    def __init__(self, maximum, minimum=1):
+        """Instantiate AdaptiveLimiter object.
+
+        Args:
+            maximum: max calls in flight, the initial bound
+            minimum: bound never reached by halving (default:1)
+
+        """
+        self.maximum = max(maximum, minimum)
+        self.minimum = minimum
+        self.limit = float(self.maximum)
+        self.in_flight = 0
+        self.throttles = 0
+        self._completed = 0
+        self._next_decrease = 0
+        self._condition = Condition()
+
+    def get_limit(self):
+        """Return the current max number of calls in flight."""
+        return int(self.limit)
+
+    def acquire(self):
+        """Wait for a free slot and take it."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        """Free a slot and adapt the bound to the outcome of its call.
+
+        Args:
+            throttled: whether the server throttled the call (default:False)
+
+        """
+        with self._condition:
+            self.in_flight -= 1
+            self._completed += 1
+            if throttled:
+                self.throttles += 1
+                if self._completed > self._next_decrease:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._next_decrease = self._completed + self.in_flight
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class WatchExpired(Exception):
+    """The watch resourceVersion expired and the index must be relisted."""
+
+
+def build_components(namespaces, default_deployments, namespaced_deployments):
+    """Build the cluster components from namespace and deployment names.
+
+    Args:
+        namespaces: application namespaces, without the default ones
+        default_deployments: deployments in the default namespace
+        namespaced_deployments: deployments in the application namespaces
+
+    Returns:
+        components: list of Components
+
+    """
+    components = []
+    # Scenario where cluster applications live in namespaces
+    if namespaces:
+        first_words = [get_first_word(name) for name in namespaces]
+        components.extend([Component(name=word) for word in first_words])
+    # Scenario where cluster applications live in default
+    if default_deployments:
+        dep_names = [re.sub(r'-deployment', '', d) for d in default_deployments]
+        components.extend([Component(name=name) for name in dep_names])
+    # Scenario where several applications share a namespace
+    names = {component.name for component in components}
+    components.extend([component for component
+                       in objects_to_components(namespaced_deployments)
+                       if component.name not in names])
+    return components
+
+
+def objects_to_components(object_list):
+    """Turn kubernetes object names into components.
+
+    Args:
+        object_list: list or iterator of object names
+
+    Returns:
+        comp_list: component names sorted by value in desc. order
+
+    """
+    comp_list = count_first_word(object_list)
+    comp_list = sort_dict_by_value(comp_list)
+    # Take just the component name, not the frequency
+    comp_list = [Component(name=component[0]) for component in comp_list]
+    return comp_list
+
+
+def get_batch_api_class():
+    """Return the Kubernetes client API class serving CronJobs.
+
+    CronJobs moved from batch/v1beta1 to batch/v1 in Kubernetes 1.21, and
+    clients only generate the batch/v1 calls since then.
+    """
+    from kubernetes import client
+    if hasattr(client.BatchV1Api, "list_namespaced_cron_job"):
+        return client.BatchV1Api
+    return client.BatchV1beta1Api
+
+
+def retry_delay(error, attempt):
+    """Return the seconds to wait before retrying a failed API call.
+
+    Honour the Retry-After header of throttled calls, with a little jitter
+    so retries do not arrive together; otherwise back off exponentially
+    with full jitter.
+
+    Args:
+        error: ApiException raised by the call
+        attempt: number of retries made so far
+
+    """
+    retry_after = (error.headers or {}).get("Retry-After")
+    try:
+        return min(MAX_RETRY_DELAY,
+                   float(retry_after) + random.uniform(0, RETRY_BACKOFF))
+    except (TypeError, ValueError):
+        return random.uniform(0, min(MAX_RETRY_DELAY, RETRY_BACKOFF * 2 ** attempt))
+
+
+def list_json(list_func, *args, **kwargs):
+    """Call a Kubernetes client list function and parse the raw response.
+
+    The response body is decoded with the fastest available JSON parser and
+    only the fields Hydrate needs are kept, skipping the client models.
+    """
+    resp = list_func(*args, _preload_content=False, **kwargs)
+    return json_page(json_loads(resp.data))
+
+
+def model_page(ret):
+    """Convert a Kubernetes client list response into a ListPage."""
+    items = [ObjectRef(i.metadata.namespace, i.metadata.name) for i in ret.items]
+    return ListPage(items, ret.metadata._continue, ret.metadata.resource_version)
+
+
+def json_page(doc):
+    """Convert a decoded JSON list response into a ListPage."""
+    items = [ObjectRef(i['metadata'].get('namespace'), i['metadata']['name'])
+             for i in doc.get('items') or ()]
+    metadata = doc.get('metadata') or {}
+    return ListPage(items, metadata.get('continue'), metadata.get('resourceVersion'))
 
 
 def remove_default_namespaces(namespaces):
@@ -147,7 +1153,7 @@ def count_first_word(str_list):
     """Count the first word of each string in the list.
 
     Args:
-        str_list: List of strings
+        str_list: List or iterator of strings
 
     Returns:
         {"word": count, ...}
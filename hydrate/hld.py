@@ -1,22 +1,34 @@
 """Use to construct the High-Level Deployment."""
 from .comments import TOP_LEVEL_COMMENT
-from .cluster import Cluster
+from .cluster import Cluster, ClusterInventory
 from .component import TopComponent
-from .scrape import Scraper
+from .scrape import MergedScraper, Scraper, source_scraper
 from .manifest import generate_manifests
 from .match import Matcher
 from .telemetry import timeit_telemetry
 
+from argparse import Namespace
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 from sys import stdout
+from time import sleep
+from timeit import default_timer
 import os.path
-from ruamel.yaml.comments import CommentedMap, CommentedSeq
-from ruamel.yaml import YAML
-yaml = YAML()
 
 MAPPING = 2
 SEQUENCE = 4
 OFFSET = 2
+# Default output folder, outside of the hydrate module
+OUT_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "out")
 verbose_print = None
+# Shared ruamel dumper, built by get_yaml on the first dump
+yaml = None
+
+ClusterTarget = namedtuple('ClusterTarget', ['name', 'kubeconfig', 'context'])
+# Seconds since the start of generate at which a stage started and ended
+StageTiming = namedtuple('StageTiming', ['stage', 'start', 'end'])
 
 
 class HLD_Generator():
@@ -25,47 +37,158 @@ class HLD_Generator():
     def __init__(self, args):
         """Construct HLD_Generator object."""
         self.top_component = TopComponent(name=args.name)
-        self.cluster = Cluster(args.kubeconfig)
+        self.cluster = Cluster(args.kubeconfig,
+                               workers=args.workers,
+                               page_size=args.page_size,
+                               all_namespaces_threshold=args.all_namespaces_threshold,
+                               metadata_only=args.metadata_only,
+                               raw_json=args.raw_json,
+                               context=args.context,
+                               kinds=args.kinds,
+                               pool_size=args.pool_size,
+                               compress=not args.no_gzip,
+                               max_retries=args.max_retries,
+                               namespaced_components=args.namespaced_components)
         self.dry_run = args.dry_run
         self.output = args.output
+        self.manifests = args.manifests
+        self.snapshot = args.snapshot
+        self.snapshot_ttl = args.snapshot_ttl
+        self.from_snapshot = args.from_snapshot
+        self.scraper = make_scraper(args)
+        self.pipeline = args.pipeline
+        self.matcher_engine = args.matcher
+        self.timings = []
 
         self.matcher = None
+        self.inventory = None
 
         # Define verbose_print as print if -v, o.w. do nothing
         global verbose_print
         verbose_print = print if args.verbose else lambda *a, **k: None
         verbose_print("Printing verbosely...")
 
-    def generate(self):
-        """Generate the component.yaml."""
-        # Step 1a. Get cluster components
-        cluster_components = self._get_cluster_components()
-        # Step 1b. Get repo components
-        repo_components = self._get_component_definitions()
-        # Step 2. Instantiate matcher
-        self.matcher = Matcher(repo_components)
-        # Step 3. Find the matches between the cluster and repo
-        match_categories = self._get_matches(cluster_components)
-        # Step 3. Generate the HLD
-        self._generate_HLD(match_categories)
-        # Step 4. Generate the manifests directory
-        self._generate_manifests()
+    def generate(self, repo_components=None):
+        """Generate the component.yaml.
+
+        Args:
+            repo_components: Fabrikate definitions already scraped, None to
+                             scrape them from GitHub
+
+        """
+        self.timings = []
+        start = default_timer()
+        if self.pipeline:
+            self._generate_pipelined(repo_components, start)
+        else:
+            # Step 1a. Get cluster components
+            cluster_components = self._timed("cluster", start,
+                                             self._get_cluster_components)
+            # Step 1b. Get repo components, once per watch session
+            if self.matcher is None or self.inventory is None:
+                if repo_components is None:
+                    repo_components = self._timed("definitions", start,
+                                                  self._get_component_definitions)
+                # Step 2. Instantiate matcher
+                self.matcher = Matcher(repo_components, engine=self.matcher_engine)
+            # Step 3. Find the matches between the cluster and repo
+            match_categories = self._timed("matching", start, self._get_matches,
+                                           cluster_components)
+            # Step 3. Generate the HLD
+            self._timed("component.yaml", start, self._generate_HLD, match_categories)
+            # Step 4. Generate the manifests directory
+            self._timed("manifests", start, self._generate_manifests)
+        verbose_print(format_timings(self.timings))
+
+    def _generate_pipelined(self, repo_components, start):
+        """Generate the component.yaml, running independent stages at once.
+
+        The cluster crawl and the definitions scrape run concurrently, then
+        the matching, then the component.yaml and the manifests are written
+        concurrently.
+        """
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            definitions = None
+            if (self.matcher is None or self.inventory is None) \
+                    and repo_components is None:
+                definitions = executor.submit(self._timed, "definitions", start,
+                                              self._get_component_definitions)
+            cluster_components = self._timed("cluster", start,
+                                             self._get_cluster_components)
+            if self.matcher is None or self.inventory is None:
+                if definitions:
+                    repo_components = definitions.result()
+                self.matcher = Matcher(repo_components, engine=self.matcher_engine)
+            match_categories = self._timed("matching", start, self._get_matches,
+                                           cluster_components)
+            hld = executor.submit(self._timed, "component.yaml", start,
+                                  self._generate_HLD, match_categories)
+            self._timed("manifests", start, self._generate_manifests)
+            hld.result()
+
+    def _timed(self, stage, start, func, *args):
+        """Call func(*args), recording its StageTiming."""
+        begin = default_timer()
+        try:
+            return func(*args)
+        finally:
+            self.timings.append(StageTiming(stage, begin - start,
+                                            default_timer() - start))
+
+    def watch(self, interval):
+        """Regenerate the component.yaml every time the cluster changes.
+
+        Args:
+            interval: minimum seconds between two generations
+
+        """
+        print("Connecting to cluster...")
+        self.cluster.connect_to_cluster()
+        print("Connected!")
+        print("Watching the cluster for changes...")
+        self.inventory = ClusterInventory(self.cluster)
+        self.inventory.start()
+        try:
+            while True:
+                changes = self.inventory.changes
+                self.generate()
+                sleep(interval)
+                self.inventory.wait_for_changes(changes)
+                verbose_print("Cluster changed, regenerating...")
+        finally:
+            self.inventory.stop()
 
     @timeit_telemetry
     def _get_cluster_components(self):
         """Get objects living on the cluster."""
+        if self.inventory:
+            return self.inventory.get_components()
+        if self.from_snapshot:
+            print("Loading cluster snapshot {}...".format(self.from_snapshot))
+            if not self.cluster.load_snapshot(self.from_snapshot):
+                raise Exception("No usable snapshot at {}".format(self.from_snapshot))
+            return self.cluster.get_components()
+        if self.snapshot and self.cluster.load_snapshot(self.snapshot,
+                                                        self.snapshot_ttl):
+            print("Using cluster snapshot {}".format(self.snapshot))
+            return self.cluster.get_components()
         print("Connecting to cluster...")
         self.cluster.connect_to_cluster()
         print("Connected!")
         print("Collecting information from the cluster...")
-        return self.cluster.get_components()
+        components = self.cluster.get_components()
+        verbose_print(self.cluster.latency_summary())
+        verbose_print(self.cluster.query_cache.summary())
+        if self.snapshot:
+            verbose_print("Writing cluster snapshot {}".format(self.snapshot))
+            self.cluster.save_snapshot(self.snapshot)
+        return components
 
     @timeit_telemetry
     def _get_component_definitions(self):
         """Get component definitions from the Fabrikate-Definitions repository."""
         print("Collecting Fabrikate Component Definitions from GitHub...")
-        scraper = Scraper()
-        return scraper.get_repo_components()
+        return self.scraper.get_repo_components()
 
     @timeit_telemetry
     def _get_matches(self, cluster_components):
@@ -89,7 +212,7 @@ class HLD_Generator():
                 output_file = os.path.join(self.output, "component.yaml")
             else:
                 # Default: file written to an /out folder outside of the hydrate module
-                path = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "out")
+                path = OUT_DIRECTORY
                 os.makedirs(path, exist_ok =True)
                 verbose_print("Writing component.yaml to {}".format(path))
                 output_file = os.path.join(path, "component.yaml")
@@ -105,6 +228,7 @@ class HLD_Generator():
 
     def _set_subcomponents(self, match_categories):
         """Set subcomponents for the top component from the match categories."""
+        from ruamel.yaml.comments import CommentedMap, CommentedSeq
         data = CommentedMap(self.top_component.as_yaml())
         data.yaml_set_start_comment(TOP_LEVEL_COMMENT)
         temp_list = CommentedSeq()
@@ -135,10 +259,150 @@ class HLD_Generator():
     @timeit_telemetry
     def _generate_manifests(self):
         """Generate the manifests."""
-        namespaces = self.cluster.get_namespaces()
-        generate_manifests(namespaces)
+        namespaces = (self.inventory or self.cluster).get_namespaces()
+        generate_manifests(namespaces, directory=self.manifests)
 
     def dump_yaml(self, data, output):
         """Dump yaml to output."""
-        yaml.indent(mapping=MAPPING, sequence=SEQUENCE, offset=OFFSET)
-        yaml.dump(data, output)
+        dumper = get_yaml()
+        dumper.indent(mapping=MAPPING, sequence=SEQUENCE, offset=OFFSET)
+        dumper.dump(data, output)
+
+
+def get_yaml():
+    """Return the shared YAML dumper, importing ruamel.yaml on first use."""
+    global yaml
+    if yaml is None:
+        from ruamel.yaml import YAML
+        yaml = YAML()
+    return yaml
+
+
+def format_timings(timings):
+    """Describe StageTimings, overlapping stages sharing the same seconds."""
+    lines = ["Stage timings (seconds since start):"]
+    for timing in sorted(timings, key=lambda t: (t.start, t.end)):
+        lines.append("  {:<15} {:8.3f} - {:8.3f}  ({:.3f})".format(
+            timing.stage, timing.start, timing.end, timing.end - timing.start))
+    if timings:
+        lines.append("  {:<15} {:8.3f}".format(
+            "total", max(timing.end for timing in timings)))
+    return "\n".join(lines)
+
+
+def make_scraper(args):
+    """Return the Scraper of the Fabrikate definitions configured by args.
+
+    Several definition sources give a MergedScraper, in which the sources
+    listed first take precedence, and an index file gives its
+    DefinitionIndex.
+    """
+    if args.index:
+        from .index import DefinitionIndex
+        return DefinitionIndex(args.index)
+    options = dict(http_cache=args.http_cache, enrich=args.enrich_definitions)
+    sources = definition_sources(args)
+    if not sources:
+        return Scraper(**options)
+    scrapers = [source_scraper(source, **options) for source in sources]
+    return scrapers[0] if len(scrapers) == 1 else MergedScraper(scrapers)
+
+
+def build_index(args):
+    """Write the index of the definitions configured by args to args.output.
+
+    Returns:
+        the indexed components
+
+    """
+    from .index import write_index
+    print("Collecting Fabrikate Component Definitions...")
+    components = make_scraper(args).get_repo_components()
+    write_index(args.output, components)
+    return components
+
+
+def definition_sources(args):
+    """Return the definition sources of args, empty for the default one."""
+    return (args.definitions or []) + \
+        ([args.definitions_dir] if args.definitions_dir else [])
+
+
+def cluster_targets(kubeconfigs=None, contexts=None, kubeconfig=None):
+    """List the clusters of a multi-cluster run.
+
+    Args:
+        kubeconfigs: kubeconfig files, one cluster each
+        contexts: contexts of kubeconfig, one cluster each
+        kubeconfig: kubeconfig file holding the contexts
+
+    Returns:
+        list of ClusterTargets with unique names
+
+    """
+    targets = [(Path(path).stem, path, None) for path in kubeconfigs or ()]
+    targets += [(context, kubeconfig, context) for context in contexts or ()]
+    names = [name for name, _, _ in targets]
+    return [ClusterTarget(name if names.count(name) == 1 else f"{name}-{idx}",
+                          path, context)
+            for idx, (name, path, context) in enumerate(targets)]
+
+
+def generate_clusters(args, targets, processes=None):
+    """Generate one component.yaml per cluster in a process pool.
+
+    The Fabrikate definitions are scraped once and shared with every
+    process. Each cluster writes <output>/<name>/component.yaml and its
+    manifests directory next to it.
+
+    Args:
+        args: parsed command line arguments
+        targets: list of ClusterTargets
+        processes: max worker processes, None for one per CPU
+
+    Returns:
+        names of the clusters that failed
+
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    print("Collecting Fabrikate Component Definitions from GitHub...")
+    repo_components = make_scraper(args).get_repo_components()
+    failed = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(generate_cluster,
+                                   cluster_args(args, target),
+                                   repo_components): target.name
+                   for target in targets}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                future.result()
+                print(f"Generated component.yaml for {name}")
+            except Exception as e:
+                failed.append(name)
+                print(f"Failed to generate component.yaml for {name}: {e}")
+    return failed
+
+
+def cluster_args(args, target):
+    """Return a copy of args pointing at one cluster and its output folder."""
+    output = os.path.join(args.output or OUT_DIRECTORY, target.name)
+    cluster_vars = {'kubeconfig': target.kubeconfig,
+                    'context': target.context,
+                    'output': output,
+                    'manifests': os.path.join(output, "manifests")}
+    # Snapshot files get one file per cluster, prefixed with its name
+    for key in ('snapshot', 'from_snapshot'):
+        path = getattr(args, key)
+        if path:
+            cluster_vars[key] = os.path.join(
+                os.path.dirname(path),
+                "{}-{}".format(target.name, os.path.basename(path)))
+    return Namespace(**{**vars(args), **cluster_vars})
+
+
+def generate_cluster(args, repo_components):
+    """Generate the component.yaml of one cluster in a worker process."""
+    if not args.dry_run:
+        os.makedirs(args.output, exist_ok=True)
+    HLD_Generator(args).generate(repo_components)
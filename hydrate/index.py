@@ -0,0 +1,196 @@
+"""Prebuilt index of the Fabrikate definitions, loaded with mmap.
+
+The index is one binary file, in native byte order:
+
+    header       MAGIC, VERSION, byte order, string, record and item counts
+    offsets      (strings + 1) uint32, where each string starts in the data
+    records      records x RECORD_FIELDS uint32, one record per definition
+    items        uint32 string ids of the token, chart and subcomponent lists
+    data         UTF-8 bytes of the strings
+
+Loading maps the file and decodes strings on demand, so startup costs
+neither a scrape nor JSON parsing, and Components are only built for the
+definitions that are looked at.
+"""
+from array import array
+import mmap
+import os
+import struct
+import sys
+
+from .component import Component
+from .scrape import Definition
+
+MAGIC = b"HYDRIDX\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIcxxxIII")
+# name, source, path, generator, enriched, then (start, length) of the
+# tokens, charts and subcomponents lists
+RECORD_FIELDS = 11
+NONE = 0xFFFFFFFF
+DEFAULT_INDEX = "definitions.idx"
+
+
+class DefinitionIndex():
+    """Fabrikate definitions read from an index file.
+
+    Behaves as a read-only list of Components, and as a Scraper whose
+    get_repo_components returns that list.
+    """
+
+    def __init__(self, path):
+        """Map the index file at path."""
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, byteorder,
+             strings, records, items) = HEADER.unpack_from(self.map)
+        except struct.error:
+            raise ValueError("{} is not a definitions index".format(path))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("{} is not a version {} definitions index".format(
+                path, VERSION))
+        size = HEADER.size + 4 * (strings + 1 + records * RECORD_FIELDS + items)
+        if len(self.map) < size:
+            raise ValueError("{} is truncated".format(path))
+        view = memoryview(self.map)
+        offset = HEADER.size
+        self.offsets = uint32s(view, offset, strings + 1, byteorder)
+        offset += 4 * (strings + 1)
+        self.records = uint32s(view, offset, records * RECORD_FIELDS, byteorder)
+        offset += 4 * records * RECORD_FIELDS
+        self.items = uint32s(view, offset, items, byteorder)
+        self.data = view[offset + 4 * items:]
+        self.views = [view, self.offsets, self.records, self.items, self.data]
+        if len(self.data) < self.offsets[-1]:
+            self.close()
+            raise ValueError("{} is truncated".format(path))
+        self.components = [None] * records
+
+    def __reduce__(self):
+        """Pickle the path only, each process maps the file again."""
+        return DefinitionIndex, (self.path,)
+
+    def __len__(self):
+        """Return the number of definitions."""
+        return len(self.components)
+
+    def __getitem__(self, i):
+        """Return the Component of the i-th definition."""
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if self.components[i] is None:
+            self.components[i] = self.component(i)
+        return self.components[i]
+
+    def get_repo_components(self, force_update=False):
+        """Return the Fabrikate Component Definitions."""
+        return self
+
+    def string(self, string_id):
+        """Return the string of string_id, None for NONE."""
+        if string_id == NONE:
+            return None
+        return str(self.data[self.offsets[string_id]:self.offsets[string_id + 1]],
+                   "utf-8")
+
+    def field(self, i, field):
+        """Return the field-th uint32 of the i-th record."""
+        return self.records[i * RECORD_FIELDS + field]
+
+    def strings(self, i, field):
+        """Return the list starting at the field-th uint32 of the i-th record."""
+        start = self.field(i, field)
+        return [self.string(string_id)
+                for string_id in self.items[start:start + self.field(i, field + 1)]]
+
+    def name(self, i):
+        """Return the name of the i-th definition."""
+        return self.string(self.field(i, 0))
+
+    def tokens(self, i):
+        """Return the distinct name tokens of the i-th definition."""
+        return self.strings(i, 5)
+
+    def component(self, i):
+        """Build the Component of the i-th definition."""
+        component = Component(name=self.name(i),
+                              source=self.string(self.field(i, 1)),
+                              path=self.string(self.field(i, 2)))
+        if self.field(i, 4):
+            component.definition = Definition(
+                generator=self.string(self.field(i, 3)),
+                charts=self.strings(i, 7),
+                subcomponents=self.strings(i, 9))
+        return component
+
+    def close(self):
+        """Unmap the index file."""
+        for view in reversed(self.views):
+            if isinstance(view, memoryview):
+                view.release()
+        self.map.close()
+
+
+def uint32s(view, offset, count, byteorder):
+    """Return count uint32 of view at offset, without copy in native order."""
+    values = view[offset:offset + 4 * count]
+    if byteorder == sys.byteorder[0].encode():
+        return values.cast("I")
+    swapped = array("I")
+    swapped.frombytes(values)
+    swapped.byteswap()
+    return swapped
+
+
+def write_index(path, components):
+    """Write the index of components to path.
+
+    Args:
+        path: index file, replaced atomically
+        components: Components, with their Definition as definition
+                    attribute when they were enriched
+
+    """
+    strings = {}
+    records = array("I")
+    items = array("I")
+
+    def string_id(value):
+        if value is None:
+            return NONE
+        return strings.setdefault(value, len(strings))
+
+    def item_list(values):
+        start = len(items)
+        items.extend(string_id(value) for value in values)
+        return [start, len(items) - start]
+
+    for component in components:
+        definition = getattr(component, "definition", None)
+        record = [string_id(component.name), string_id(component.source),
+                  string_id(component.path),
+                  string_id(definition.generator if definition else None),
+                  int(definition is not None)]
+        record += item_list(dict.fromkeys(component.name.split("-")))
+        record += item_list(definition.charts if definition else [])
+        record += item_list(definition.subcomponents if definition else [])
+        records.extend(record)
+
+    data = [value.encode("utf-8") for value in strings]
+    offsets = array("I", [0])
+    for value in data:
+        offsets.append(offsets[-1] + len(value))
+
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, sys.byteorder[0].encode(), len(strings),
+                            len(records) // RECORD_FIELDS, len(items)))
+        offsets.tofile(f)
+        records.tofile(f)
+        items.tofile(f)
+        f.write(b"".join(data))
+    os.replace(tmp, path)
@@ -2,7 +2,6 @@
 
 import os
 from io import StringIO
-from ruamel.yaml import YAML
 from .cluster import remove_default_namespaces
 
 MAPPING = 2
@@ -87,6 +86,7 @@ def _generate_namespaces_yaml(namespace_yamls, outfile):
         namespace_yamls: list of NamespaceYAML objects
 
     """
+    from ruamel.yaml import YAML
     yaml = YAML()
     yaml.explicit_start = False
     yaml.indent(mapping=MAPPING, sequence=SEQUENCE, offset=OFFSET)
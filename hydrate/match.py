@@ -7,18 +7,29 @@ from .comments import PARTIAL_MATCH_COMMENT
 from .comments import NO_MATCH_COMMENT
 from .telemetry import Telemetry
 
+# Matching engines, by the name passed to Matcher
+ENGINES = ("index", "bitset")
+DEFAULT_ENGINE = "index"
+
 
 class Matcher():
     """Match the deployments found on a cluster with the Fabrikate Definitions."""
 
-    def __init__(self, repo_components):
+    def __init__(self, repo_components, engine=DEFAULT_ENGINE):
         """Instantiate a Matcher object.
 
         Args:
             repo_components: list of Component objects
+            engine: "index" to look the cluster tokens up in a TokenIndex,
+                    "bitset" to test them against a BitsetIndex with NumPy
 
         """
+        if engine not in ENGINES:
+            raise ValueError("Unknown matching engine {!r}, expected one of {}".format(
+                engine, ", ".join(ENGINES)))
         self.repo_components = repo_components
+        self.token_index = (BitsetIndex if engine == "bitset" else TokenIndex)(
+            repo_components)
         self.match_categories = []
 
     def match_components(self, cluster_components):
@@ -98,8 +109,9 @@ class Matcher():
         cluster_map = {cc.name: cc for cc in cluster_components}
         cluster_set = set(cluster_map.keys())
 
-        for rc in self.repo_components:
-            repo_set = set(rc.name.split('-'))
+        for position in self.token_index.subsets(cluster_set):
+            rc = self.repo_components[position]
+            repo_set = self.token_index.token_sets[position]
             if repo_set.issubset(cluster_set):
                 cc_names = cluster_set.intersection(repo_set)
                 cluster_matches = [cluster_map[component_name] for component_name in cc_names]
@@ -135,8 +147,9 @@ class Matcher():
         cluster_map = {cc.name: cc for cc in full_match_leftovers}
         cluster_name_set = set(cluster_map.keys())
 
-        for repo_component in self.repo_components:
-            repo_component_name_set = set(repo_component.name.split('-'))
+        for position in self.token_index.candidates(cluster_name_set):
+            repo_component = self.repo_components[position]
+            repo_component_name_set = self.token_index.token_sets[position]
             common_names = repo_component_name_set.intersection(cluster_name_set)
 
             if common_names:
@@ -166,6 +179,105 @@ class Matcher():
         return NoMatchResults
 
 
+class TokenIndex():
+    """Inverted index of the name tokens of the repo components.
+
+    Maps each token to the positions of the repo components whose name
+    holds it, so that matching only looks at the repo components sharing a
+    token with the cluster, in their original order. Against more cluster
+    tokens than repo components, testing the token set of every repo
+    component is cheaper than the lookups and gives the same positions.
+    """
+
+    def __init__(self, repo_components):
+        """Index the tokens of repo_components.
+
+        Args:
+            repo_components: list of Components, or a DefinitionIndex whose
+                             tokens are read without building Components
+
+        """
+        self.token_sets = name_token_sets(repo_components)
+        self.postings = {}
+        for position, token_set in enumerate(self.token_sets):
+            for token in token_set:
+                self.postings.setdefault(token, []).append(position)
+
+    def candidates(self, tokens):
+        """Return the positions of the repo components sharing a token with tokens."""
+        if len(tokens) >= len(self.token_sets):
+            return [position for position, token_set in enumerate(self.token_sets)
+                    if not token_set.isdisjoint(tokens)]
+        positions = set()
+        for token in tokens:
+            positions.update(self.postings.get(token, ()))
+        return sorted(positions)
+
+    def subsets(self, tokens):
+        """Return the positions of the repo components with all their tokens in tokens."""
+        if len(tokens) >= len(self.token_sets):
+            return [position for position, token_set in enumerate(self.token_sets)
+                    if token_set.issubset(tokens)]
+        counts = {}
+        for token in tokens:
+            for position in self.postings.get(token, ()):
+                counts[position] = counts.get(position, 0) + 1
+        return sorted(position for position, count in counts.items()
+                      if count == len(self.token_sets[position]))
+
+
+class BitsetIndex():
+    """Bit matrix of the name tokens of the repo components.
+
+    Numbers the tokens of the repo components and keeps one row of bits per
+    repo component, packed in 64-bit words. The cluster tokens are encoded
+    the same way, then the subset and intersection tests against every repo
+    component run as vectorized NumPy operations over the whole matrix.
+    Gives the positions of a TokenIndex, in the same order.
+    """
+
+    def __init__(self, repo_components):
+        """Encode the tokens of repo_components, see TokenIndex."""
+        import numpy
+        self.numpy = numpy
+        self.token_sets = name_token_sets(repo_components)
+        self.columns = {}
+        for token_set in self.token_sets:
+            for token in token_set:
+                self.columns.setdefault(token, len(self.columns))
+        rows = numpy.repeat(numpy.arange(len(self.token_sets)),
+                            [len(token_set) for token_set in self.token_sets])
+        columns = numpy.fromiter((self.columns[token] for token_set in self.token_sets
+                                  for token in token_set), dtype=numpy.intp,
+                                 count=len(rows))
+        self.words = (len(self.columns) + 63) // 64
+        self.matrix = self.pack(rows, columns, len(self.token_sets))
+
+    def pack(self, rows, columns, count):
+        """Return count rows of words, with the bits at rows, columns set."""
+        numpy = self.numpy
+        packed = numpy.zeros((count, 8 * self.words), dtype=numpy.uint8)
+        numpy.bitwise_or.at(packed, (rows, columns // 8),
+                            numpy.left_shift(1, columns % 8).astype(numpy.uint8))
+        return packed.view(numpy.uint64)
+
+    def encode(self, tokens):
+        """Return the words of tokens, ignoring those of no repo component."""
+        columns = self.numpy.array([self.columns[token] for token in tokens
+                                    if token in self.columns], dtype=self.numpy.intp)
+        return self.pack(self.numpy.zeros_like(columns), columns, 1)[0]
+
+    def candidates(self, tokens):
+        """Return the positions of the repo components sharing a token with tokens."""
+        shared = (self.matrix & self.encode(tokens)).any(axis=1)
+        return self.numpy.flatnonzero(shared).tolist()
+
+    def subsets(self, tokens):
+        """Return the positions of the repo components with all their tokens in tokens."""
+        missing = (self.matrix & ~self.encode(tokens)).any(axis=1)
+        return self.numpy.flatnonzero(~missing).tolist()
+
+
 class MatchCategory(Enum):
     """Flags for different kinds of matches."""
 
@@ -203,6 +315,20 @@ class Match():
             return self.cluster_matches
 
 
+def name_token_sets(repo_components):
+    """Return the set of name tokens of each repo component.
+
+    Args:
+        repo_components: list of Components, or a DefinitionIndex whose
+                         tokens are read without building Components
+
+    """
+    tokens = getattr(repo_components, 'tokens', None)
+    if tokens:
+        return [set(tokens(position)) for position in range(len(repo_components))]
+    return [set(rc.name.split('-')) for rc in repo_components]
+
+
 def send_match_name_telemetry(matches, match_type):
     """Send telemetry of the names of matches found."""
     TELEMETRY = Telemetry(None)
@@ -1,6 +1,11 @@
 """Scrapes Github for Fabrikate Component Information."""
-from requests import get
+from collections import namedtuple
+import hashlib
+import json
+import os
 import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 from .component import Component
 
@@ -8,30 +13,182 @@ from .component import Component
 FAB_DEFS_URL = "https://github.com/microsoft/fabrikate-definitions"
 API = "https://api.github.com/repos/microsoft/fabrikate-definitions/contents/definitions"
 FAB_DEFS_API = API
+TREES = "https://api.github.com/repos/microsoft/fabrikate-definitions/git/trees"
+# Whole repository tree in one call, for catalogs the contents API truncates
+FAB_DEFS_TREE = TREES + "/master?recursive=1"
+# Default folder of the on-disk HTTP cache
+HTTP_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "hydrate", "http")
+
+# component.yaml files fetched at once by Scraper.get_definitions
+DEFINITION_WORKERS = 16
+# Connect and read timeouts of GitHub requests, in seconds
+HTTP_TIMEOUT = (5, 30)
+# Retries of GitHub requests failing to connect or answering RETRY_STATUSES
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RAW_URL = "https://raw.githubusercontent.com/{owner}/{repo}/{branch}/{path}"
+GITHUB_REPO = re.compile(r'https://github\.com/([^/]+)/([^/]+?)(?:\.git)?/?$')
+
+Definition = namedtuple('Definition', ['generator', 'charts', 'subcomponents'])
+CachedResponse = namedtuple('CachedResponse', ['url', 'etag', 'last_modified', 'data'])
 
 
 class Scraper():
     """Scrapes GitHub for Fabrikate-Definitions."""
 
-    def __init__(self, definition_url=FAB_DEFS_URL, definition_api=FAB_DEFS_API):
-        """Construct Scraper object."""
+    def __init__(self, definition_url=FAB_DEFS_URL, definition_api=FAB_DEFS_API,
+                 http_cache=None, definitions_dir=None, definition_tree=FAB_DEFS_TREE,
+                 enrich=False, token=None):
+        """Construct Scraper object.
+
+        Args:
+            definition_url: repository of the Fabrikate definitions
+            definition_api: contents API listing the definitions
+            http_cache: folder of the on-disk HTTP cache, None to disable it
+            definitions_dir: local checkout of the definitions repository,
+                             read instead of definition_api
+            definition_tree: recursive git trees API listing the repository,
+                             tried before definition_api, None to skip it
+            enrich: set the Definition read from its component.yaml as the
+                    definition attribute of every repo component
+            token: GitHub token raising the rate limit, None to read the
+                   GITHUB_TOKEN environment variable
+
+        """
         self.definition_url = definition_url
         self.definition_api = definition_api
+        self.http_cache = HttpCache(http_cache) if http_cache else None
+        self.definitions_dir = definitions_dir
+        self.definition_tree = definition_tree
+        self.enrich = enrich
+        self.token = token if token is not None else os.environ.get("GITHUB_TOKEN")
+        self.session = None
         self.repo_components = None
+        self.definitions = None
 
     def get_repo_components(self, force_update=False):
         """Return the Fabrikate Component Definitions."""
         if self.repo_components and not force_update:
             return self.repo_components
         else:
-            json_obj = json_get(self.definition_api)
+            if self.definitions_dir:
+                json_obj = local_json_get(self.definitions_dir, self.definition_url,
+                                          self.http_cache)
+            else:
+                json_obj = None
+                if self.definition_tree:
+                    json_obj = tree_json_get(self.definition_tree, self.definition_url,
+                                             self.http_cache, self.get_session())
+                if not json_obj:
+                    json_obj = json_get(self.definition_api, self.http_cache,
+                                        self.get_session())
             if json_obj:
-                json_data = parse_json(json_obj)
+                json_data = self.parse_json(json_obj)
                 components = construct_components(json_data)
                 components = remove_fabrikate_prefix(components)
+                if self.enrich:
+                    definitions = self.get_definitions(components)
+                    for component in components:
+                        component.definition = definitions[component.name]
                 self.repo_components = components
                 return components
-            raise Exception('JSON not retrieved. URL:{}'.format(FAB_DEFS_API))
+            raise Exception('JSON not retrieved. URL:{}'.format(self.definition_api))
+
+    def get_session(self):
+        """Return the pooled session shared by the requests of the Scraper."""
+        if self.session is None:
+            self.session = make_session(DEFINITION_WORKERS, self.token)
+        return self.session
+
+    def get_definitions(self, components=None, workers=DEFINITION_WORKERS):
+        """Return the Definition of every repo component, by component name.
+
+        The component.yaml of the definitions are fetched concurrently over
+        one pooled session, or read from definitions_dir. Subcomponents
+        that are definitions of the catalog are not fetched again, and a
+        remote subcomponent shared by several definitions is fetched once.
+
+        Args:
+            components: repo components, None for get_repo_components()
+            workers: component.yaml files fetched at once
+
+        """
+        if self.definitions is not None:
+            return self.definitions
+        components = components or self.get_repo_components()
+        paths = {c.name: c.path for c in components}
+        catalog = {os.path.normpath(path): name for name, path in paths.items()}
+        session = None if self.definitions_dir else self.get_session()
+
+        def fetch(location):
+            if self.definitions_dir:
+                try:
+                    with open(location) as f:
+                        return f.read()
+                except OSError:
+                    return None
+            return text_get(location, self.http_cache, session)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            texts = executor.map(fetch, [self.component_yaml(c.source, c.path)
+                                         for c in components])
+            data = dict(zip(paths, map(parse_component_yaml, texts)))
+            links = {name: [self.locate(sub, paths[name], catalog)
+                            for sub in subcomponents(data[name])]
+                     for name in paths}
+            # Remote subcomponents shared by several definitions, fetched once
+            remote = sorted({url for name in links for _, url in links[name] if url})
+            if self.definitions_dir:
+                remote = []
+            remote = dict(zip(remote, map(parse_component_yaml,
+                                          executor.map(fetch, remote))))
+
+        self.definitions = {}
+        for name in paths:
+            charts = helm_charts(data[name])
+            for sub, (linked, url) in zip(subcomponents(data[name]), links[name]):
+                charts += helm_charts(sub)
+                charts += helm_charts(data[linked] if linked else remote.get(url, {}))
+            self.definitions[name] = Definition(
+                generator=data[name].get('generator'),
+                charts=sorted(set(charts)),
+                subcomponents=[sub['name'] for sub in subcomponents(data[name])
+                               if sub.get('name')])
+        return self.definitions
+
+    def component_yaml(self, source, path):
+        """Return where the component.yaml of a catalog definition is read."""
+        if self.definitions_dir:
+            return os.path.join(self.definitions_dir, path, "component.yaml")
+        return raw_url(source, path, "component.yaml")
+
+    def locate(self, subcomponent, parent_path, catalog):
+        """Locate the component.yaml of a subcomponent.
+
+        Args:
+            subcomponent: subcomponent entry of a component.yaml
+            parent_path: path of the definition holding the subcomponent
+            catalog: name of the catalog definitions, by normalized path
+
+        Returns:
+            (name of the catalog definition, None) for catalog definitions,
+            (None, url of its component.yaml) for remote Fabrikate
+            components, (None, None) for anything else
+
+        """
+        source = subcomponent.get('source')
+        if subcomponent.get('generator') or not source:  # helm chart, manifests
+            return None, None
+        path = subcomponent.get('path') or ""
+        if "://" not in source:  # relative to the definition
+            path = os.path.join(parent_path, source, path)
+        elif github_repo(source) != github_repo(self.definition_url):
+            return None, raw_url(source, path, "component.yaml",
+                                 subcomponent.get('branch') or "master")
+        return catalog.get(os.path.normpath(path)), None
 
     def parse_json(self, json_list):
         """Parse json to get information for each definition.
@@ -51,6 +208,87 @@ class Scraper():
         return json_dicts
 
 
+class MergedScraper():
+    """Merges the Fabrikate definitions of several sources.
+
+    The sources are scraped concurrently. When several sources define a
+    component of the same name, the first source wins.
+    """
+
+    def __init__(self, scrapers):
+        """Construct MergedScraper object.
+
+        Args:
+            scrapers: Scrapers of the sources, by decreasing precedence
+
+        """
+        self.scrapers = scrapers
+        self.repo_components = None
+
+    def get_repo_components(self, force_update=False):
+        """Return the Fabrikate Component Definitions of all the sources."""
+        if self.repo_components and not force_update:
+            return self.repo_components
+        with ThreadPoolExecutor(max_workers=len(self.scrapers)) as executor:
+            catalogs = list(executor.map(
+                lambda scraper: scraper.get_repo_components(force_update),
+                self.scrapers))
+        self.repo_components = merge_components(catalogs)
+        return self.repo_components
+
+
+def source_scraper(source, **kwargs):
+    """Return the Scraper of a definitions source.
+
+    Args:
+        source: GitHub repository url, or local checkout of a definitions
+                repository
+        kwargs: other Scraper arguments
+
+    """
+    repo = github_repo(source)
+    if repo:
+        api = "https://api.github.com/repos/{}/{}".format(*repo)
+        return Scraper(definition_url="https://github.com/{}/{}".format(*repo),
+                       definition_api=api + "/contents/definitions",
+                       definition_tree=api + "/git/trees/master?recursive=1",
+                       **kwargs)
+    if os.path.isdir(source):
+        return Scraper(definition_url=checkout_url(source), definitions_dir=source,
+                       **kwargs)
+    raise ValueError("Not a GitHub repository or a folder: {}".format(source))
+
+
+def checkout_url(directory):
+    """Return the repository a local checkout was cloned from.
+
+    Returns:
+        url of the origin remote, FAB_DEFS_URL when it is unknown
+
+    """
+    from configparser import ConfigParser, Error
+    config = ConfigParser(strict=False)
+    try:
+        config.read(os.path.join(directory, ".git", "config"))
+        url = config.get('remote "origin"', "url")
+    except Error:
+        return FAB_DEFS_URL
+    repo = github_repo(url)
+    return "https://github.com/{}/{}".format(*repo) if repo else url
+
+
+def merge_components(catalogs):
+    """Merge lists of components, keeping the first component of each name."""
+    names = set()
+    merged = []
+    for components in catalogs:
+        for component in components:
+            if component.name not in names:
+                names.add(component.name)
+                merged.append(component)
+    return merged
+
+
 def get_repo_components():
     """Return the Fabrikate Component List."""
     json_obj = json_get(FAB_DEFS_API)
@@ -103,9 +341,237 @@ def remove_fabrikate_prefix(components):
     return components
 
 
-def json_get(url):
-    """Get the json at the url."""
-    resp = get(url)
+def json_get(url, cache=None, session=None):
+    """Get the json at the url.
+
+    Args:
+        url: url of the json
+        cache: HttpCache revalidating and storing the response, None to
+               always download it
+        session: requests Session sending the request, None for a new
+                 connection without retries
+
+    """
+    return cached_get(url, cache, session, lambda resp: resp.json())
+
+
+def text_get(url, cache=None, session=None):
+    """Get the text at the url, see json_get."""
+    return cached_get(url, cache, session, lambda resp: resp.text)
+
+
+def cached_get(url, cache, session, decode):
+    """Get the url, decoded by decode, revalidating the cached response."""
+    if session is None:
+        from requests import get
+    else:
+        get = session.get
+    cached = cache.get(url) if cache else None
+    resp = get(url, headers=conditional_headers(cached), timeout=HTTP_TIMEOUT)
+    if resp.status_code == 304 and cached:
+        return cached.data
     if resp.status_code != 200:
         return None
-    return resp.json()
+    data = decode(resp)
+    if cache:
+        cache.store(url, resp.headers, data)
+    return data
+
+
+def make_session(pool_size=DEFINITION_WORKERS, token=None, retries=HTTP_RETRIES):
+    """Return a requests Session for GitHub.
+
+    The session keeps up to pool_size connections per host open, and
+    retries failed connections and RETRY_STATUSES answers with exponential
+    backoff, honouring Retry-After.
+
+    Args:
+        pool_size: connections kept open per host
+        token: GitHub token sent with every request, None for anonymous
+               requests
+        retries: retries of a failed request
+
+    """
+    from requests import Session
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    session = Session()
+    retry = Retry(total=retries, backoff_factor=HTTP_BACKOFF,
+                  status_forcelist=RETRY_STATUSES, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if token:
+        session.headers['Authorization'] = "token {}".format(token)
+    return session
+
+
+def local_json_get(checkout, definition_url=FAB_DEFS_URL, cache=None):
+    """List the definitions of a local checkout like the contents API does.
+
+    The listing is kept in the cache, keyed by the mtime of the definitions
+    folder, which changes whenever a definition is added, removed or
+    renamed. Unchanged checkouts are not scanned again.
+
+    Args:
+        checkout: local checkout of the definitions repository
+        definition_url: repository the checkout was cloned from
+        cache: HttpCache keeping the listing, None to always scan
+
+    """
+    directory = os.path.join(os.path.abspath(checkout), "definitions")
+    url = Path(directory).as_uri()
+    mtime = str(os.stat(directory).st_mtime_ns)
+    cached = cache.get(url) if cache else None
+    if cached and cached.etag == mtime:
+        return cached.data
+    data = [definition_entry(definition_url, "definitions/" + entry.name)
+            for entry in sorted(os.scandir(directory), key=lambda e: e.name)
+            if entry.is_dir() and not entry.name.startswith(".")]
+    if cache:
+        cache.store(url, {'ETag': mtime}, data)
+    return data
+
+
+def tree_json_get(url, definition_url=FAB_DEFS_URL, cache=None, session=None):
+    """List the definitions from a recursive git trees listing.
+
+    GitHub truncates recursive listings of very large repositories, in
+    which case the definitions folder is listed on its own with a second,
+    non-recursive call.
+
+    Args:
+        url: git trees API url of the repository, with recursive=1
+        definition_url: repository the tree belongs to
+        cache: HttpCache revalidating the listings
+        session: requests Session sending the requests
+
+    Returns:
+        the definitions in the shape of the contents API, None on failure
+
+    """
+    tree = json_get(url, cache, session)
+    if not tree:
+        return None
+    entries = tree["tree"]
+    if tree.get("truncated"):
+        base = url.split("?")[0]
+        sha = tree_sha(entries, "definitions")
+        if sha is None:
+            root = json_get(base, cache, session)
+            sha = root and tree_sha(root["tree"], "definitions")
+        subtree = sha and json_get(base.rsplit("/", 1)[0] + "/" + sha, cache,
+                                   session)
+        if not subtree:
+            return None
+        entries = [dict(entry, path="definitions/" + entry["path"])
+                   for entry in subtree["tree"]]
+    return [definition_entry(definition_url, entry["path"]) for entry in entries
+            if entry["type"] == "tree" and entry["path"].count("/") == 1
+            and entry["path"].startswith("definitions/")]
+
+
+def tree_sha(entries, path):
+    """Return the sha of the folder at path in git tree entries, if any."""
+    for entry in entries:
+        if entry["path"] == path and entry["type"] == "tree":
+            return entry["sha"]
+    return None
+
+
+def definition_entry(definition_url, path):
+    """Return the contents API entry of the definition folder at path."""
+    return {'name': path.rsplit("/", 1)[-1],
+            'html_url': "{}/tree/master/{}".format(definition_url, path)}
+
+
+def github_repo(url):
+    """Return the (owner, repository) of a GitHub url, None for other urls."""
+    match = GITHUB_REPO.match(url or "")
+    return match.groups() if match else None
+
+
+def raw_url(source, path, filename, branch="master"):
+    """Return the raw url of a file of a GitHub repository, None elsewhere."""
+    if not github_repo(source):
+        return None
+    owner, repo = github_repo(source)
+    return RAW_URL.format(owner=owner, repo=repo, branch=branch,
+                          path="/".join(p for p in (path, filename) if p))
+
+
+def parse_component_yaml(text):
+    """Return the mapping of a component.yaml, empty if missing or invalid."""
+    if not text:
+        return {}
+    from ruamel.yaml import YAML
+    from ruamel.yaml.error import YAMLError
+    try:
+        data = YAML(typ='safe').load(text)
+    except YAMLError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def subcomponents(data):
+    """Return the subcomponent mappings of a component.yaml mapping."""
+    return [sub for sub in data.get('subcomponents') or [] if isinstance(sub, dict)]
+
+
+def helm_charts(data):
+    """Return the name of the helm chart a component.yaml mapping generates."""
+    if data.get('generator') == 'helm' and data.get('path'):
+        return [os.path.basename(str(data['path']).rstrip("/"))]
+    return []
+
+
+def conditional_headers(cached):
+    """Return the headers revalidating a CachedResponse, if any."""
+    headers = {}
+    if cached and cached.etag:
+        headers['If-None-Match'] = cached.etag
+    if cached and cached.last_modified:
+        headers['If-Modified-Since'] = cached.last_modified
+    return headers
+
+
+class HttpCache():
+    """On-disk cache of JSON responses, revalidated with ETag/Last-Modified.
+
+    Each url is stored in its own file, so that the processes of a
+    multi-cluster run share the cache. GitHub does not count the 304
+    answers of conditional requests against the rate limit.
+    """
+
+    def __init__(self, directory=HTTP_CACHE_DIR):
+        """Construct HttpCache object."""
+        self.directory = directory
+
+    def path(self, url):
+        """Return the file caching the url."""
+        name = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.directory, name + ".json")
+
+    def get(self, url):
+        """Return the CachedResponse of the url, None if missing or unreadable."""
+        try:
+            with open(self.path(url)) as f:
+                cached = CachedResponse(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+        return cached if cached.url == url else None
+
+    def store(self, url, headers, data):
+        """Store the response of the url, if it can be revalidated later."""
+        cached = CachedResponse(url, headers.get('ETag'),
+                                headers.get('Last-Modified'), data)
+        if not (cached.etag or cached.last_modified):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(url)
+        # Write then rename, other processes never read a partial file
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(cached._asdict(), f)
+        os.replace(tmp, path)
@@ -4,7 +4,6 @@ This module is intended to be used as a singleton.
 """
 import os
 import functools
-from applicationinsights import TelemetryClient
 from timeit import default_timer
 from weakref import WeakValueDictionary
 
@@ -39,6 +38,7 @@ class Telemetry(metaclass=Singleton):
         """Initialize Telemetry instance."""
         self._toggle = toggle
         if self._toggle:
+            from applicationinsights import TelemetryClient
             self._telemetry_client = TelemetryClient(APP_INSIGHTS_KEY)
             self._telemetry_channel = self._setup_telemetry_channel()
             print("Telemetry enabled.")
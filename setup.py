@@ -17,6 +17,11 @@ setuptools.setup(
     long_description_content_type='text/markdown',
     url='https://github.com/andrewDoing/hydrate',
     install_requires=['kubernetes', 'ruamel.yaml'],
+    extras_require={
+        'async': ['aiohttp'],
+        'fast': ['orjson'],
+        'bitset': ['numpy'],
+    },
     classifiers=[
         'Programming Language :: Python :: 3.6',
         'License :: OSI Approved :: MIT License',
@@ -0,0 +1,134 @@
+"""Test suite for async_cluster.py."""
+import asyncio
+import json
+import pytest
+
+from hydrate.async_cluster import AsyncCluster
+from hydrate.async_cluster import gather_by_namespace
+
+
+class FakeResponse():
+    """Minimal aiohttp response serving a JSON list page."""
+
+    def __init__(self, doc):
+        self.doc = doc
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def read(self):
+        await asyncio.sleep(0)
+        return json.dumps(self.doc).encode()
+
+
+class FakeSession():
+    """Minimal aiohttp session serving paged object lists by URL."""
+
+    def __init__(self, objects, page_size=2):
+        self.objects = objects
+        self.page_size = page_size
+        self.requests = []
+
+    def get(self, url, params=None):
+        params = dict(params or {})
+        self.requests.append((url, params))
+        names = self.objects[url]
+        start = int(params.get('continue', 0))
+        end = start + self.page_size
+        doc = {"metadata": {"continue": str(end) if end < len(names) else ""},
+               "items": [{"metadata": {"name": name}} for name in names[start:end]]}
+        return FakeResponse(doc)
+
+
+def run(coroutine):
+    """Run a coroutine to completion on a new event loop.
+
+    asyncio.run only exists from Python 3.7.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+class TestAsyncCluster():
+    """Test suite for the AsyncCluster class."""
+
+    @pytest.fixture
+    def async_cluster(self):
+        """AsyncCluster wired to a FakeSession."""
+        cluster = AsyncCluster("tst-kubeconfig", concurrency=4)
+        cluster.host = "https://tst"
+        cluster.session = FakeSession({
+            "https://tst/api/v1/namespaces": ["default", "nginx", "elasticsearch"],
+            "https://tst/apis/apps/v1/namespaces/nginx/deployments":
+                ["nginx-ingress", "nginx-backend", "nginx-frontend"],
+            "https://tst/api/v1/namespaces/nginx/pods": ["nginx-1"],
+            "https://tst/apis/apps/v1/namespaces/elasticsearch/deployments":
+                ["elasticsearch-master"],
+        })
+        return cluster
+
+    def test_get_namespaces(self, async_cluster):
+        """Test that namespaces are paged and listed once."""
+        async def get_twice():
+            return (await async_cluster.get_namespaces(),
+                    await async_cluster.get_namespaces())
+
+        first, second = run(get_twice())
+
+        assert first == second == ["default", "nginx", "elasticsearch"]
+        assert async_cluster.session.requests == [
+            ("https://tst/api/v1/namespaces", {'limit': '500'}),
+            ("https://tst/api/v1/namespaces", {'limit': '500', 'continue': '2'})]
+
+    def test_get_namespaced_deployments(self, async_cluster):
+        """Test that concurrent calls for a namespace share one list."""
+        async def get_concurrently():
+            return await asyncio.gather(
+                async_cluster.get_namespaced_deployments("nginx"),
+                async_cluster.get_namespaced_deployments("nginx"))
+
+        first, second = run(get_concurrently())
+
+        expected = ["nginx-ingress", "nginx-backend", "nginx-frontend"]
+        assert first == second == expected
+        assert async_cluster.namespaced_deployments == {"nginx": expected}
+        assert len(async_cluster.session.requests) == 2
+        assert len(async_cluster.call_latencies) == 2
+        assert async_cluster.query_cache.coalesced == 1
+
+    def test_get_namespaced_pods(self, async_cluster):
+        """Test that pods are cached separately from deployments."""
+        run(async_cluster.get_namespaced_pods("nginx"))
+
+        assert async_cluster.namespaced_pods == {"nginx": ["nginx-1"]}
+        assert async_cluster.namespaced_deployments == {}
+
+    def test_get_deployments_by_namespace(self, async_cluster):
+        """Test that results are keyed in the order of the namespaces."""
+        deployments = run(async_cluster.get_deployments_by_namespace(
+            ["elasticsearch", "nginx"]))
+
+        assert list(deployments) == ["elasticsearch", "nginx"]
+        assert deployments["elasticsearch"] == ["elasticsearch-master"]
+
+
+def test_gather_by_namespace():
+    """Test that the slowest namespace does not reorder the results."""
+    async def slow_upper(namespace):
+        await asyncio.sleep(0.01 * len(namespace))
+        return namespace.upper()
+
+    result = run(gather_by_namespace(slow_upper, ["ccc", "a", "bb"]))
+
+    assert list(result.items()) == [("ccc", "CCC"), ("a", "A"), ("bb", "BB")]
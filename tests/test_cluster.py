@@ -1,11 +1,23 @@
 """Test suite for cluster.py."""
+import gzip
+import json
 import pytest
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from hydrate.component import Component
+from hydrate.cluster import AdaptiveLimiter
 from hydrate.cluster import Cluster
+from hydrate.cluster import ClusterInventory
+from hydrate.cluster import QueryCache
+from hydrate.cluster import WatchExpired
+from hydrate.cluster import CLUSTER_WIDE, NAMESPACED, PARTIAL_METADATA_ACCEPT
 from hydrate.cluster import remove_default_namespaces
+from hydrate.cluster import retry_delay
 from hydrate.cluster import get_first_word
 from hydrate.cluster import count_first_word
+from hydrate.cluster import objects_to_components
 from hydrate.cluster import sort_dict_by_value
 
 
@@ -47,13 +59,15 @@ class TestCluster():
     tst_namespaces = ["elasticsearch", "istio", "jaeger"]
     tst_deps = ["elasticsearch-dep", "istio-dep", "jaeger-dep"]
 
-    @pytest.mark.parametrize("tst_namespaces, tst_deps",
-                             [(tst_namespaces, tst_deps),
-                              (tst_namespaces, None),
-                              (None, tst_deps)])
+    @pytest.mark.parametrize("tst_namespaces, tst_deps, namespaced_components",
+                             [(tst_namespaces, tst_deps, False),
+                              (tst_namespaces, tst_deps, True),
+                              (tst_namespaces, None, True),
+                              (None, tst_deps, False)])
     def test_get_components(self, mocker, cluster_connection,
-                            tst_namespaces, tst_deps):
+                            tst_namespaces, tst_deps, namespaced_components):
         """Test the method get_components."""
+        cluster_connection.namespaced_components = namespaced_components
         mock_get_namespaces = mocker.patch(
             "hydrate.cluster.Cluster.get_namespaces",
             return_value=tst_namespaces)
@@ -61,8 +75,8 @@ class TestCluster():
             "hydrate.cluster.remove_default_namespaces",
             return_value=tst_namespaces)
         mock_get_first_word = mocker.patch("hydrate.cluster.get_first_word")
-        mock_get_namespaced_deployments = mocker.patch(
-            "hydrate.cluster.Cluster.get_namespaced_deployments",
+        mock_get_namespaced_objects = mocker.patch(
+            "hydrate.cluster.Cluster.get_namespaced_objects",
             return_value=tst_deps
         )
         mock_re_sub = mocker.patch("hydrate.cluster.re.sub")
@@ -70,7 +84,9 @@ class TestCluster():
         components = cluster_connection.get_components()
 
         assert components
-        mock_get_namespaced_deployments.assert_called_once()
+        mock_get_namespaced_objects.assert_any_call("deployments", "default")
+        assert mock_get_namespaced_objects.call_count == \
+            1 + (len(tst_namespaces or []) if namespaced_components else 0)
         mock_get_namespaces.assert_called_once()
         mock_remove_defaults.assert_called_once()
         if tst_namespaces:
@@ -92,6 +108,9 @@ class TestCluster():
         namespaces = mock_cluster.get_namespaces()
 
         assert namespaces == tst_get_namespaces
+        assert mock_cluster.get_namespaces() == tst_get_namespaces
+        mock_cluster.core_v1_api.list_namespace.assert_called_once()
+        assert mock_cluster.query_cache.hits == 1
 
     tst_get_namespaced_pods = ["elasticsearch-pod", "istio-pod"]
     @pytest.mark.parametrize("tst_pods", [(tst_get_namespaced_pods)])
@@ -108,11 +127,421 @@ class TestCluster():
 
         assert pods == tst_pods
 
+    @pytest.fixture
+    def paged_pods(self, mocker, metadata_items):
+        """Mock list_namespaced_pod returning two pages linked by a continue token."""
+        def _paged_pods(mock_cluster, first_page, second_page):
+            mock_first = mocker.Mock()
+            mock_first.items = metadata_items(first_page)
+            mock_first.metadata._continue = "tst-token"
+            mock_second = mocker.Mock()
+            mock_second.items = metadata_items(second_page)
+            mock_second.metadata._continue = None
+            mock_cluster.core_v1_api.list_namespaced_pod.side_effect = \
+                [mock_first, mock_second]
+            return mock_cluster.core_v1_api.list_namespaced_pod
+        return _paged_pods
+
+    def test_iter_namespaced_pods_paginates(self, mocker, cluster_connection,
+                                            paged_pods):
+        """Test Cluster.iter_namespaced_pods follows continue tokens."""
+        mock_cluster = cluster_connection
+        mock_cluster.page_size = 2
+        mock_list = paged_pods(mock_cluster, ["istio-pilot", "istio-citadel"],
+                               ["jaeger-agent"])
+
+        pods = mock_cluster.iter_namespaced_pods("FizzBuzz")
+
+        mock_list.assert_not_called()
+        assert list(pods) == ["istio-pilot", "istio-citadel", "jaeger-agent"]
+        assert mock_list.call_args_list == [
+            mocker.call("FizzBuzz", limit=2),
+            mocker.call("FizzBuzz", limit=2, _continue="tst-token")]
+        assert len(mock_cluster.call_latencies) == 2
+
+    def test_get_pod_components_streams(self, cluster_connection, paged_pods):
+        """Test get_pod_components counts pod prefixes across pages."""
+        mock_cluster = cluster_connection
+        paged_pods(mock_cluster, ["istio-pilot", "jaeger-agent"],
+                   ["istio-citadel"])
+
+        components = mock_cluster.get_pod_components("FizzBuzz")
+
+        assert components == [Component(name="istio"), Component(name="jaeger")]
+
+    def test_pagination_disabled(self, mocker, cluster_connection, paged_pods):
+        """Test a page_size of 0 requests the whole list in one call."""
+        mock_cluster = cluster_connection
+        mock_cluster.page_size = 0
+        mock_list = paged_pods(mock_cluster, ["istio-pilot"], ["jaeger-agent"])
+
+        assert mock_cluster.get_namespaced_pods("FizzBuzz") == ["istio-pilot"]
+        mock_list.assert_called_once_with("FizzBuzz")
+
+    def test_metadata_only(self, mocker, cluster_connection):
+        """Test metadata-only listing parses PartialObjectMetadataList pages."""
+        pages = [{"kind": "PartialObjectMetadataList",
+                  "metadata": {"continue": "tst-token", "resourceVersion": "7"},
+                  "items": [{"metadata": {"name": "istio-pilot",
+                                          "namespace": "FizzBuzz"}}]},
+                 {"kind": "PartialObjectMetadataList",
+                  "metadata": {"resourceVersion": "7"},
+                  "items": [{"metadata": {"name": "jaeger-agent",
+                                          "namespace": "FizzBuzz"}}]}]
+        responses = []
+        for page in pages:
+            response = mocker.Mock()
+            response.data = json.dumps(page).encode()
+            responses.append(response)
+        mock_cluster = cluster_connection
+        mock_cluster.metadata_only = True
+        mock_cluster.page_size = 1
+        mock_cluster.metadata_core_v1_api = mocker.Mock()
+        mock_list = mock_cluster.metadata_core_v1_api.list_namespaced_pod
+        mock_list.side_effect = responses
+
+        pods = mock_cluster.get_namespaced_pods("FizzBuzz")
+
+        assert pods == ["istio-pilot", "jaeger-agent"]
+        mock_cluster.core_v1_api.list_namespaced_pod.assert_not_called()
+        assert mock_list.call_args_list == [
+            mocker.call("FizzBuzz", _preload_content=False, limit=1),
+            mocker.call("FizzBuzz", _preload_content=False, limit=1,
+                        _continue="tst-token")]
+
+    def test_raw_json(self, mocker, cluster_connection):
+        """Test the raw-JSON path reads names without client models."""
+        response = mocker.Mock()
+        response.data = json.dumps(
+            {"kind": "PodList", "metadata": {"resourceVersion": "7"},
+             "items": [{"metadata": {"name": "istio-pilot"},
+                        "spec": {"containers": []}}]}).encode()
+        mock_cluster = cluster_connection
+        mock_cluster.raw_json = True
+        mock_cluster.core_v1_api.list_namespaced_pod.return_value = response
+
+        pods = mock_cluster.get_namespaced_pods("FizzBuzz")
+
+        assert pods == ["istio-pilot"]
+        mock_cluster.core_v1_api.list_namespaced_pod.assert_called_once_with(
+            "FizzBuzz", _preload_content=False, limit=500)
+
+    def test_connect_to_cluster_metadata_only(self, mocker, cluster_connection):
+        """Test metadata-only APIs ask for PartialObjectMetadataList."""
+        mocker.patch("kubernetes.config.load_kube_config")
+        cluster_connection.metadata_only = True
+
+        cluster_connection.connect_to_cluster()
+
+        api_client = cluster_connection.metadata_core_v1_api.api_client
+        assert api_client.default_headers['Accept'] == PARTIAL_METADATA_ACCEPT
+        assert cluster_connection.metadata_apps_v1_api.api_client is api_client
+
+    def test_connect_to_cluster_shared_pool(self, mocker, cluster_connection):
+        """Test every API object shares one sized, gzip-enabled connection pool."""
+        mocker.patch("kubernetes.config.load_kube_config")
+        cluster_connection.metadata_only = True
+        cluster_connection.workers = 6
+        cluster_connection.kinds = ("deployments", "services")
+
+        cluster_connection.connect_to_cluster()
+
+        api_client = cluster_connection.core_v1_api.api_client
+        metadata_client = cluster_connection.metadata_core_v1_api.api_client
+        assert cluster_connection.apps_v1_api.api_client is api_client
+        assert cluster_connection.batch_api.api_client is api_client
+        assert metadata_client.rest_client is api_client.rest_client
+        assert api_client.configuration.connection_pool_maxsize == 12
+        assert api_client.default_headers['Accept-Encoding'] == 'gzip'
+        assert metadata_client.default_headers['Accept-Encoding'] == 'gzip'
+        assert not api_client.configuration.retries.respect_retry_after_header
+
+    def test_get_pool_size(self, cluster_connection):
+        """Test a configured pool size wins over the concurrency estimate."""
+        assert cluster_connection.get_pool_size() == 8
+        cluster_connection.pool_size = 3
+        assert cluster_connection.get_pool_size() == 3
+
+    tst_pods_by_namespace = {"elasticsearch": ["elasticsearch-pod"],
+                             "istio": ["istio-pod", "istio-pilot"],
+                             "jaeger": []}
+
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_get_pods_by_namespace(self, mocker, cluster_connection,
+                                   metadata_items, workers):
+        """Test Cluster.get_pods_by_namespace keeps the namespace order."""
+        def list_namespaced_pod(namespace, **kwargs):
+            mock_return_obj = mocker.Mock()
+            mock_return_obj.items = metadata_items(
+                self.tst_pods_by_namespace[namespace])
+            return mock_return_obj
+        mock_cluster = cluster_connection
+        mock_cluster.workers = workers
+        mock_cluster.core_v1_api.list_namespaced_pod.side_effect = \
+            list_namespaced_pod
+
+        pods = mock_cluster.get_pods_by_namespace(list(self.tst_pods_by_namespace))
+
+        assert pods == self.tst_pods_by_namespace
+        assert list(pods) == list(self.tst_pods_by_namespace)
+        assert len(mock_cluster.call_latencies) == 3
+        assert {latency.namespace for latency in mock_cluster.call_latencies} == \
+            set(self.tst_pods_by_namespace)
+
+    @pytest.mark.parametrize("threshold, namespace_count, exp_plan",
+                             [(20, 19, NAMESPACED),
+                              (20, 20, CLUSTER_WIDE),
+                              (0, 600, NAMESPACED)])
+    def test_plan_list_query(self, cluster_connection, threshold, namespace_count,
+                             exp_plan):
+        """Test Cluster.plan_list_query function."""
+        cluster_connection.all_namespaces_threshold = threshold
+        assert cluster_connection.plan_list_query(namespace_count) == exp_plan
+
+    def test_get_pods_by_namespace_cluster_wide(self, mocker, cluster_connection):
+        """Test many namespaces are served by one cluster-wide list."""
+        pods = [("istio", "istio-pilot"), ("jaeger", "jaeger-agent"),
+                ("other", "other-pod"), ("istio", "istio-citadel")]
+        items = []
+        for namespace, name in pods:
+            item = mocker.Mock()
+            item.metadata.namespace = namespace
+            item.metadata.name = name
+            items.append(item)
+        mock_return_obj = mocker.Mock()
+        mock_return_obj.items = items
+        mock_return_obj.metadata._continue = None
+        mock_cluster = cluster_connection
+        mock_cluster.all_namespaces_threshold = 2
+        mock_cluster.core_v1_api.list_pod_for_all_namespaces.return_value = \
+            mock_return_obj
+
+        pods = mock_cluster.get_pods_by_namespace(["jaeger", "istio", "empty"])
+
+        assert pods == {"jaeger": ["jaeger-agent"],
+                        "istio": ["istio-pilot", "istio-citadel"],
+                        "empty": []}
+        assert list(pods) == ["jaeger", "istio", "empty"]
+        mock_cluster.core_v1_api.list_pod_for_all_namespaces.assert_called_once()
+        mock_cluster.core_v1_api.list_namespaced_pod.assert_not_called()
+        assert mock_cluster.get_namespaced_pods("istio") == ["istio-pilot",
+                                                             "istio-citadel"]
+
+    def test_get_components_namespaced_deployments(self, mocker, cluster_connection,
+                                                   metadata_items):
+        """Test get_components adds applications sharing a namespace."""
+        deployments = {"default": ["nginx-deployment"],
+                       "monitoring": ["prometheus-server", "grafana"]}
+
+        def list_namespaced_deployment(namespace, **kwargs):
+            mock_return_obj = mocker.Mock()
+            mock_return_obj.items = metadata_items(deployments.get(namespace, []))
+            return mock_return_obj
+        mock_return_obj = mocker.Mock()
+        mock_return_obj.items = metadata_items(["default", "kube-system",
+                                                "monitoring"])
+        cluster_connection.core_v1_api.list_namespace.return_value = mock_return_obj
+        cluster_connection.apps_v1_api.list_namespaced_deployment.side_effect = \
+            list_namespaced_deployment
+
+        components = cluster_connection.get_components()
+        assert [c.name for c in components] == ["monitoring", "nginx"]
+        cluster_connection.namespaced_components = True
+        components = cluster_connection.get_components()
+
+        assert [c.name for c in components] == ["monitoring", "nginx",
+                                                "prometheus", "grafana"]
+
+    def test_get_components_kinds(self, mocker, cluster_connection, metadata_items):
+        """Test every enabled kind feeds the components, timed per kind."""
+        def lister(names):
+            def list_func(namespace=None, **kwargs):
+                mock_return_obj = mocker.Mock()
+                mock_return_obj.items = metadata_items(names.get(namespace, []))
+                mock_return_obj.metadata._continue = None
+                return mock_return_obj
+            return list_func
+        mock_return_obj = mocker.Mock()
+        mock_return_obj.items = metadata_items(["default", "shop"])
+        mock_return_obj.metadata._continue = None
+        mock_cluster = cluster_connection
+        mock_cluster.kinds = ("deployments", "statefulsets", "cronjobs", "services")
+        mock_cluster.namespaced_components = True
+        mock_cluster.batch_api = mocker.Mock()
+        mock_cluster.core_v1_api.list_namespace.return_value = mock_return_obj
+        mock_cluster.apps_v1_api.list_namespaced_deployment.side_effect = lister(
+            {"shop": ["shop-frontend"]})
+        mock_cluster.apps_v1_api.list_namespaced_stateful_set.side_effect = lister(
+            {"shop": ["mysql-0"]})
+        mock_cluster.batch_api.list_namespaced_cron_job.side_effect = lister(
+            {"default": ["backup-deployment"]})
+        mock_cluster.core_v1_api.list_namespaced_service.side_effect = lister(
+            {"default": ["kubernetes"], "shop": ["redis"]})
+
+        components = mock_cluster.get_components()
+
+        assert [c.name for c in components] == ["shop", "backup", "mysql", "redis"]
+        assert set(mock_cluster.kind_timings) == set(mock_cluster.kinds)
+        assert "\n  services: " in mock_cluster.latency_summary()
+        mock_cluster.apps_v1_api.list_namespaced_daemon_set.assert_not_called()
+
+    def test_namespaced_caches(self, mocker, cluster_connection, metadata_items):
+        """Test deployments and pods of a namespace are cached separately."""
+        mock_deps = mocker.Mock()
+        mock_deps.items = metadata_items(["istio-dep"])
+        mock_pods = mocker.Mock()
+        mock_pods.items = metadata_items(["istio-pod"])
+        mock_cluster = cluster_connection
+        mock_cluster.apps_v1_api.list_namespaced_deployment.return_value = mock_deps
+        mock_cluster.core_v1_api.list_namespaced_pod.return_value = mock_pods
+
+        assert mock_cluster.get_deployments_by_namespace(["istio"]) == \
+            {"istio": ["istio-dep"]}
+        assert mock_cluster.get_pods_by_namespace(["istio"]) == \
+            {"istio": ["istio-pod"]}
+        assert mock_cluster.get_namespaced_deployments("istio") == ["istio-dep"]
+        mock_cluster.apps_v1_api.list_namespaced_deployment.assert_called_once()
+        mock_cluster.core_v1_api.list_namespaced_pod.assert_called_once()
+
+    def test_get_namespaced_pods_coalesces(self, mocker, cluster_connection,
+                                           metadata_items):
+        """Test concurrent requests for one namespace make a single API call."""
+        release = threading.Event()
+
+        def list_namespaced_pod(namespace, **kwargs):
+            release.wait(5)
+            mock_return_obj = mocker.Mock()
+            mock_return_obj.items = metadata_items(["istio-pod"])
+            return mock_return_obj
+        mock_cluster = cluster_connection
+        mock_cluster.core_v1_api.list_namespaced_pod.side_effect = \
+            list_namespaced_pod
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(mock_cluster.get_namespaced_pods, "istio")
+                       for _ in range(4)]
+            time.sleep(0.1)
+            release.set()
+            results = [future.result() for future in futures]
+
+        assert results == [["istio-pod"]] * 4
+        mock_cluster.core_v1_api.list_namespaced_pod.assert_called_once()
+
+    def test_call_latencies(self, mocker, cluster_connection, metadata_items):
+        """Test list calls record their latency."""
+        mock_return_obj = mocker.Mock()
+        mock_return_obj.items = metadata_items(["istio-pod"])
+        mock_cluster = cluster_connection
+        mock_cluster.core_v1_api.list_namespaced_pod.return_value = mock_return_obj
+        assert mock_cluster.latency_summary() == "No cluster API calls made."
+
+        mock_cluster.get_namespaced_pods("istio")
+
+        latency, = mock_cluster.call_latencies
+        assert latency.call == "list_namespaced_pod"
+        assert latency.namespace == "istio"
+        assert latency.seconds >= 0
+        assert mock_cluster.latency_summary().startswith("1 cluster API calls")
+
+    def test_retry_throttled_calls(self, mocker, cluster_connection, metadata_items):
+        """Test throttled calls are retried after Retry-After and slow the limiter."""
+        from kubernetes.client.rest import ApiException
+        throttled = ApiException(status=429, reason="Too Many Requests")
+        throttled.headers = {"Retry-After": "1"}
+        mock_return_obj = mocker.Mock()
+        mock_return_obj.items = metadata_items(["istio-pod"])
+        mock_sleep = mocker.patch("time.sleep")
+        mock_cluster = cluster_connection
+        mock_cluster.core_v1_api.list_namespaced_pod.side_effect = [
+            throttled, throttled, mock_return_obj]
+
+        assert mock_cluster.get_namespaced_pods("istio") == ["istio-pod"]
+
+        assert mock_sleep.call_count == 2
+        assert all(1 <= call[0][0] <= 1.5 for call in mock_sleep.call_args_list)
+        assert len(mock_cluster.call_latencies) == 3
+        assert mock_cluster.retries == 2
+        assert mock_cluster.limiter.throttles == 2
+        assert mock_cluster.limiter.get_limit() == 2
+        assert "2 retries, 2 throttled" in mock_cluster.latency_summary()
+
+    @pytest.mark.parametrize("status, max_retries", [(403, 5), (503, 0)])
+    def test_retry_gives_up(self, mocker, cluster_connection, status, max_retries):
+        """Test client errors and exhausted retries raise."""
+        from kubernetes.client.rest import ApiException
+        mocker.patch("time.sleep")
+        cluster_connection.max_retries = max_retries
+        cluster_connection.core_v1_api.list_namespaced_pod.side_effect = \
+            ApiException(status=status)
+
+        with pytest.raises(ApiException):
+            cluster_connection.get_namespaced_pods("istio")
+        assert cluster_connection.core_v1_api.list_namespaced_pod.call_count == 1
+
+    def test_snapshot_replay(self, tmp_path):
+        """Test a saved snapshot regenerates components without API calls."""
+        tst_snapshot = str(tmp_path / "cluster.json.gz")
+        source = Cluster("tst-kubeconfig")
+        source.namespaces = ["default", "nginx", "kube-system"]
+        source.namespaced_deployments.update({"default": ["grafana-deployment"],
+                                              "nginx": ["nginx-ingress"]})
+        source.namespaced_pods.update({"nginx": ["nginx-ingress-1"]})
+        source.save_snapshot(tst_snapshot)
+
+        replay = Cluster("tst-kubeconfig")
+        assert replay.load_snapshot(tst_snapshot, ttl=60)
+
+        assert replay.namespaced_pods == {"nginx": ["nginx-ingress-1"]}
+        assert [c.name for c in replay.get_components()] == ["nginx", "grafana"]
+        assert replay.call_latencies == []
+
+    def test_snapshot_unusable(self, mocker, tmp_path):
+        """Test that missing, stale and foreign snapshots are not loaded."""
+        tst_snapshot = str(tmp_path / "cluster.json.gz")
+        cluster = Cluster("tst-kubeconfig")
+        assert not cluster.load_snapshot(tst_snapshot)
+
+        cluster.namespaces = ["nginx"]
+        cluster.save_snapshot(tst_snapshot)
+        mocker.patch("hydrate.cluster.time.time", return_value=time.time() + 120)
+        assert not cluster.load_snapshot(tst_snapshot, ttl=60)
+        assert cluster.load_snapshot(tst_snapshot)
+
+        replay = Cluster("tst-kubeconfig", kinds=("deployments", "services"))
+        assert not replay.load_snapshot(tst_snapshot)
+        replay = Cluster("tst-kubeconfig", namespaced_components=True)
+        assert not replay.load_snapshot(tst_snapshot)
+
+        mocker.patch("hydrate.cluster.SNAPSHOT_VERSION", 0)
+        assert not cluster.load_snapshot(tst_snapshot)
+
+    @pytest.mark.parametrize("tst_data", [b"", b"not gzip", gzip.compress(b"{"),
+                                          gzip.compress(b"[]")])
+    def test_snapshot_corrupt(self, tmp_path, tst_data):
+        """Test that truncated and corrupt snapshots are not loaded."""
+        tst_snapshot = tmp_path / "cluster.json.gz"
+        tst_snapshot.write_bytes(tst_data)
+
+        assert not Cluster("tst-kubeconfig").load_snapshot(str(tst_snapshot))
+
+    def test_snapshot_truncated(self, tmp_path):
+        """Test that a snapshot cut short while written is not loaded."""
+        tst_snapshot = str(tmp_path / "cluster.json.gz")
+        cluster = Cluster("tst-kubeconfig")
+        cluster.namespaces = ["nginx"]
+        cluster.save_snapshot(tst_snapshot)
+        with open(tst_snapshot, "rb") as f:
+            data = f.read()
+        with open(tst_snapshot, "wb") as of:
+            of.write(data[:len(data) // 2])
+
+        assert not cluster.load_snapshot(tst_snapshot)
+
     tst_process_cluster_objects = [("elasticsearch", 1), ("istio", 1),
                                    ("jaeger", 1)]
-    exp_process_cluster_objects = [Component("elasticsearch"),
-                                   Component("istio"),
-                                   Component("jaeger")]
+    exp_process_cluster_objects = [Component(name="elasticsearch"),
+                                   Component(name="istio"),
+                                   Component(name="jaeger")]
 
     @pytest.mark.parametrize("tst_objects, exp_components",
                              [(tst_process_cluster_objects,
@@ -148,6 +577,273 @@ class TestCluster():
         assert remove_default_namespaces(tst_namespaces) == exp_namespaces
 
 
+class TestQueryCache():
+    """Test suite for the QueryCache class."""
+
+    def test_get(self, mocker):
+        """Test results are fetched once per key and counted."""
+        fetch = mocker.Mock(side_effect=[["nginx-pod"], ["istio-pod"]])
+        cache = QueryCache()
+
+        assert cache.get("pods", "nginx", fetch) == ["nginx-pod"]
+        assert cache.get("pods", "nginx", fetch) == ["nginx-pod"]
+        assert cache.get("pods", "istio", fetch) == ["istio-pod"]
+
+        assert fetch.call_count == 2
+        assert (cache.hits, cache.misses, cache.coalesced) == (1, 2, 0)
+        assert cache.table("pods") == {"nginx": ["nginx-pod"],
+                                       "istio": ["istio-pod"]}
+        assert cache.summary() == \
+            "Cluster query cache: 1 hits, 2 misses, 0 coalesced"
+
+    def test_get_coalesces(self):
+        """Test concurrent callers wait on the first caller's fetch."""
+        cache = QueryCache()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(1)
+            return ["istio-pod"]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(cache.get, "pods", "istio", fetch)
+                       for _ in range(4)]
+            while cache.coalesced < 3:
+                time.sleep(0.001)
+            release.set()
+            results = [future.result() for future in futures]
+
+        assert results == [["istio-pod"]] * 4
+        assert len(calls) == 1
+        assert (cache.misses, cache.coalesced) == (1, 3)
+
+    def test_get_error(self):
+        """Test a failed fetch raises in every waiting caller and is not cached."""
+        cache = QueryCache()
+        release = threading.Event()
+
+        def fetch():
+            release.wait(1)
+            raise RuntimeError("throttled")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(cache.get, "pods", "istio", fetch)
+                       for _ in range(2)]
+            while cache.coalesced < 1:
+                time.sleep(0.001)
+            release.set()
+            for future in futures:
+                with pytest.raises(RuntimeError):
+                    future.result()
+
+        assert cache.get("pods", "istio", lambda: []) == []
+        assert cache.misses == 2
+
+    def test_fill_and_missing(self):
+        """Test bulk results never replace cached ones."""
+        cache = QueryCache()
+        cache.get("pods", "nginx", lambda: ["nginx-pod"])
+
+        assert cache.missing("pods", ["nginx", "istio"]) == ["istio"]
+        filled = cache.fill("pods", {"nginx": [], "istio": ["istio-pod"]})
+
+        assert filled == {"nginx": ["nginx-pod"], "istio": ["istio-pod"]}
+        assert cache.missing("pods", ["nginx", "istio"]) == []
+        assert cache.misses == 3
+        cache.clear()
+        assert cache.table("pods") == {}
+        assert cache.misses == 0
+
+
+def test_adaptive_limiter():
+    """Test the limit halves once per window of throttling and grows back."""
+    limiter = AdaptiveLimiter(8)
+    for _ in range(4):
+        limiter.acquire()
+    assert limiter.in_flight == 4
+
+    for _ in range(4):
+        limiter.release(throttled=True)
+    assert limiter.get_limit() == 4
+    assert limiter.throttles == 4
+
+    for _ in range(30):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.get_limit() == 8
+
+
+def test_adaptive_limiter_blocks():
+    """Test calls wait for a slot once the limit is reached."""
+    limiter = AdaptiveLimiter(1)
+    limiter.acquire()
+    acquired = threading.Event()
+
+    def acquire():
+        limiter.acquire()
+        acquired.set()
+    thread = threading.Thread(target=acquire)
+    thread.start()
+
+    assert not acquired.wait(0.05)
+    limiter.release()
+    assert acquired.wait(1)
+    thread.join()
+
+
+@pytest.mark.parametrize("headers, attempt, low, high", [
+    ({"Retry-After": "2"}, 0, 2, 2.5),
+    ({"Retry-After": "120"}, 0, 30, 30),
+    (None, 0, 0, 0.5),
+    ({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}, 3, 0, 4),
+])
+def test_retry_delay(mocker, headers, attempt, low, high):
+    """Test Retry-After is honoured, with a jittered backoff fallback."""
+    error = mocker.Mock(headers=headers)
+
+    assert low <= retry_delay(error, attempt) <= high
+
+
+class TestClusterInventory():
+    """Test suite for the ClusterInventory class."""
+
+    @pytest.fixture
+    def inventory(self, mocker):
+        """ClusterInventory synced from mocked cluster-wide lists."""
+        def _list(names, resource_version):
+            items = []
+            for namespace, name in names:
+                item = mocker.Mock()
+                item.metadata.namespace = namespace
+                item.metadata.name = name
+                items.append(item)
+            ret = mocker.Mock()
+            ret.items = items
+            ret.metadata._continue = None
+            ret.metadata.resource_version = resource_version
+            return ret
+        cluster = Cluster("tst-kubeconfig")
+        cluster.core_v1_api = mocker.Mock()
+        cluster.apps_v1_api = mocker.Mock()
+        cluster.core_v1_api.list_namespace.return_value = _list(
+            [(None, "default"), (None, "kube-system"), (None, "istio-system")], "10")
+        cluster.apps_v1_api.list_deployment_for_all_namespaces.return_value = _list(
+            [("default", "nginx-deployment"), ("istio-system", "istio-pilot")], "11")
+        inventory = ClusterInventory(cluster)
+        inventory.sync()
+        return inventory
+
+    @staticmethod
+    def event(event_type, name, namespace=None, resource_version="20"):
+        """Build a raw watch event."""
+        metadata = {"name": name, "resourceVersion": resource_version}
+        if namespace:
+            metadata["namespace"] = namespace
+        return {"type": event_type, "raw_object": {"metadata": metadata}}
+
+    def test_sync(self, inventory):
+        """Test the initial list fills the index and resourceVersions."""
+        assert inventory.get_namespaces() == ["default", "kube-system",
+                                              "istio-system"]
+        assert inventory.resource_versions == {"namespaces": "10",
+                                               "deployments": "11"}
+        assert [c.name for c in inventory.get_components()] == ["istio", "nginx"]
+
+    def test_apply_event(self, inventory):
+        """Test watch events update the index and rebuild components."""
+        components = inventory.get_components()
+        assert inventory.get_components() is components
+        changes = inventory.changes
+
+        inventory.apply_event("deployments",
+                              self.event("ADDED", "redis-deployment", "default"))
+        inventory.apply_event("namespaces", self.event("DELETED", "istio-system"))
+        inventory.apply_event("namespaces",
+                              self.event("BOOKMARK", "", resource_version="30"))
+
+        assert inventory.changes == changes + 2
+        assert inventory.resource_versions["namespaces"] == "30"
+        assert [c.name for c in inventory.get_components()] == ["nginx", "redis"]
+        assert inventory.wait_for_changes(changes, timeout=0) == changes + 2
+
+    @pytest.fixture
+    def streams(self, mocker):
+        """Patch Watch so each stream call plays the next scripted outcome."""
+        mocker.patch("hydrate.cluster.WATCH_RETRY_SECONDS", 0)
+        outcomes = []
+
+        def stream(list_func, **kwargs):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return iter(outcome)
+        mocker.patch("kubernetes.watch.Watch").return_value.stream.side_effect = \
+            stream
+        return outcomes
+
+    def test_follow_dropped_connection(self, inventory, streams):
+        """Test a dropped watch connection is resumed and a failed relist retried."""
+        from urllib3.exceptions import ProtocolError
+        list_func = inventory.cluster.apps_v1_api.list_deployment_for_all_namespaces
+        relist = list_func.return_value
+        list_func.side_effect = [ProtocolError("Connection broken"), relist]
+        changes = inventory.changes
+
+        def stop():
+            inventory.stop()
+            yield self.event("ADDED", "redis-deployment", "default")
+        streams.extend([ProtocolError("Connection broken"),
+                        [{"type": "ERROR", "raw_object": {"message": "Gone"}}],
+                        stop()])
+
+        inventory._follow("deployments")
+
+        assert inventory.error is None
+        assert list_func.call_count == 3
+        assert inventory.changes == changes + 1
+
+    def test_follow_error_stops_waiters(self, inventory, streams):
+        """Test an unexpected error is raised to the thread waiting for changes."""
+        streams.append(ValueError("bad event"))
+        inventory._follow("deployments")
+
+        with pytest.raises(ValueError):
+            inventory.wait_for_changes(inventory.changes)
+
+    def test_kinds(self, mocker, inventory):
+        """Test every collected kind is indexed, without built-in objects."""
+        cluster = inventory.cluster
+        cluster.kinds = ("deployments", "services")
+        services = mocker.Mock()
+        services.items = []
+        for namespace, name in [("default", "kubernetes"),
+                                ("istio-system", "istio-gateway")]:
+            item = mocker.Mock()
+            item.metadata.namespace = namespace
+            item.metadata.name = name
+            services.items.append(item)
+        services.metadata._continue = None
+        services.metadata.resource_version = "12"
+        cluster.core_v1_api.list_service_for_all_namespaces.return_value = services
+        inventory = ClusterInventory(cluster)
+        inventory.sync()
+
+        assert inventory.resource_versions == {"namespaces": "10",
+                                               "deployments": "11",
+                                               "services": "12"}
+        assert [c.name for c in inventory.get_components()] == ["istio", "nginx"]
+        inventory.apply_event("services", self.event("ADDED", "redis", "default"))
+        assert [c.name for c in inventory.get_components()] == ["istio", "nginx",
+                                                                "redis"]
+
+    def test_apply_error_event(self, inventory):
+        """Test an ERROR event asks for a relist."""
+        with pytest.raises(WatchExpired):
+            inventory.apply_event("deployments",
+                                  {"type": "ERROR",
+                                   "raw_object": {"code": 410, "message": "Gone"}})
+
+
 tst_string = "fabrikate-elasticsearch"
 exp_string = "fabrikate"
 
@@ -168,6 +864,15 @@ def test_count_first_word(str_list, expected):
     assert count_first_word(str_list) == expected
 
 
+def test_objects_to_components():
+    """Test components are named after the most frequent first words."""
+    components = objects_to_components(["istio-pilot", "jaeger-query",
+                                        "istio-mixer"])
+
+    assert [c.name for c in components] == ["istio", "jaeger"]
+    assert all(c.source == "<source repository url>" for c in components)
+
+
 tst_fruits = {"apple": 1, "banana": 2, "orange": 3, "kiwi": 4,
               "mango": 5, "raspberry": 6, "peach": 7}
 exp_fruits = [('peach', 7), ('raspberry', 6), ('mango', 5),
@@ -0,0 +1,119 @@
+"""Test suite for benchmarks/fake_apiserver.py."""
+import json
+import pytest
+
+from benchmarks.fake_apiserver import FakeApiServer
+from benchmarks.fake_apiserver import SyntheticCluster
+from hydrate.cluster import COMPONENT_KINDS, Cluster
+
+
+@pytest.fixture(scope="module")
+def api_server():
+    """Serve a small synthetic cluster for the whole module."""
+    with FakeApiServer(SyntheticCluster(namespaces=12, deployments=3, pods=2)) as server:
+        yield server
+
+
+@pytest.fixture
+def kubeconfig(api_server, tmp_path):
+    """Kubeconfig file pointing at the fake API server."""
+    return api_server.write_kubeconfig(str(tmp_path / "kubeconfig"))
+
+
+def test_synthetic_cluster_scale():
+    """Test that objects of a 1M pod cluster are generated on demand."""
+    cluster = SyntheticCluster(namespaces=10000, deployments=10, pods=10)
+
+    last_pod = cluster.object("pods", cluster.count("pods") - 1)
+
+    assert cluster.count("pods") == 1000000
+    assert last_pod["metadata"]["namespace"] == cluster.namespace_name(10002)
+    assert last_pod["metadata"]["name"].startswith("traefik-9-")
+    assert cluster.object("pods", 99, last_pod["metadata"]["namespace"]) == last_pod
+
+
+@pytest.mark.parametrize("path, names", [
+    ("/api/v1/namespaces?limit=2", ["default", "kube-public"]),
+    ("/api/v1/namespaces?limit=2&continue=3", ["nginx-0", "prometheus-1"]),
+    ("/apis/apps/v1/namespaces/grafana-2/deployments",
+     ["grafana-0", "grafana-1", "grafana-2"]),
+    ("/api/v1/namespaces/default/pods", []),
+])
+def test_respond(api_server, path, names):
+    """Test list responses and their paging."""
+    status, body, _ = api_server.respond(path)
+
+    assert status == 200
+    assert [item["metadata"]["name"] for item in json.loads(body)["items"]] == names
+
+
+def test_respond_not_found(api_server):
+    """Test that unknown namespaces and paths are 404s."""
+    assert api_server.respond("/api/v1/namespaces/nginx-99/pods")[0] == 404
+    assert api_server.respond("/api/v1/secrets")[0] == 404
+
+
+def test_respond_metadata_only(api_server):
+    """Test PartialObjectMetadataList responses."""
+    _, body, _ = api_server.respond("/api/v1/pods?limit=1",
+                                    "application/json;as=PartialObjectMetadataList")
+    doc = json.loads(body)
+
+    assert doc["kind"] == "PartialObjectMetadataList"
+    assert list(doc["items"][0]) == ["metadata"]
+    assert doc["metadata"]["continue"] == "1"
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(page_size=4, all_namespaces_threshold=0),
+    dict(page_size=4, all_namespaces_threshold=1, namespaced_components=True),
+    dict(page_size=0, metadata_only=True, namespaced_components=True),
+])
+def test_cluster_get_components(kubeconfig, kwargs):
+    """Test Cluster collection end to end against the fake API server."""
+    cluster = Cluster(kubeconfig, **kwargs)
+    cluster.connect_to_cluster()
+
+    components = cluster.get_components()
+
+    assert len(cluster.get_namespaces()) == 15
+    assert [c.name for c in components][:3] == ["nginx", "prometheus", "grafana"]
+    assert cluster.get_pods_by_namespace(["jaeger-4"])["jaeger-4"][:2] == [
+        "jaeger-0-7d9f8c6b5-00000", "jaeger-0-7d9f8c6b5-00001"]
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(all_namespaces_threshold=0),
+    dict(all_namespaces_threshold=1, metadata_only=True, namespaced_components=True),
+])
+def test_cluster_get_components_all_kinds(kubeconfig, kwargs):
+    """Test that every component kind is listed, without built-in services."""
+    cluster = Cluster(kubeconfig, kinds=COMPONENT_KINDS, **kwargs)
+    cluster.connect_to_cluster()
+
+    cluster.get_components()
+
+    objects = cluster.get_objects_by_kind(COMPONENT_KINDS, ["default", "redis-6"])
+    assert objects["statefulsets"]["redis-6"] == ["redis-db-0"]
+    assert objects["cronjobs"]["redis-6"] == ["redis-backup-0"]
+    assert objects["services"] == {"default": [], "redis-6": ["redis-svc-0"]}
+    assert set(cluster.kind_timings) == set(COMPONENT_KINDS)
+
+
+@pytest.mark.parametrize("raw_json", [False, True])
+def test_cluster_gzip(tmp_path, raw_json):
+    """Test gzip responses are negotiated and decoded by Cluster."""
+    cluster = SyntheticCluster(namespaces=20, deployments=10, pods=2)
+    with FakeApiServer(cluster) as server:
+        kubeconfig = server.write_kubeconfig(str(tmp_path / "kubeconfig"))
+        sizes = dict()
+        for compress in (False, True):
+            cluster = Cluster(kubeconfig, page_size=0, all_namespaces_threshold=1,
+                              raw_json=raw_json, compress=compress)
+            cluster.connect_to_cluster()
+            bytes_sent = server.bytes_sent
+            pods = cluster.get_pods_by_namespace(["nginx-0", "redis-16"])
+            sizes[compress] = server.bytes_sent - bytes_sent
+            assert len(pods["redis-16"]) == 20
+
+    assert sizes[True] * 10 < sizes[False]
@@ -1,29 +1,43 @@
 """Test suite for hld.py."""
 import pytest
 import io
-from collections import namedtuple
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+from hydrate.__main__ import parse_args
 from hydrate.component import Component
 from hydrate.hld import HLD_Generator
+from hydrate.hld import ClusterTarget
+from hydrate.hld import cluster_args
+from hydrate.hld import cluster_targets
+from hydrate.hld import generate_clusters
+from hydrate.hld import make_scraper
+from hydrate.hld import build_index
+from hydrate.index import DefinitionIndex
+from hydrate.hld import StageTiming
+from hydrate.hld import format_timings
+from hydrate.scrape import MergedScraper, Scraper
 from hydrate.telemetry import Telemetry
 
 
+def make_args(**kwargs):
+    """Return the default command line arguments, overridden by kwargs."""
+    args = parse_args(['run'])
+    vars(args).update(kwargs)
+    return args
+
+
 class Test_HLD_Generator():
     """Test Suite for the HLD_Generator class."""
 
     MODULE = 'hydrate.hld'
     CLASS = f'{MODULE}.HLD_Generator'
-    tst_args = namedtuple('tst_args', ['name',
-                                       'kubeconfig',
-                                       'dry_run',
-                                       'output',
-                                       'verbose'])
-    class_tst_args = tst_args
-    class_tst_args.name = "tst_name"
-    class_tst_args.kubeconfig = "tst_kubeconfig"
-    class_tst_args.dry_run = "tst_dry_run"
-    class_tst_args.output = "tst_output"
-    class_tst_args.verbose = "tst_verbose"
+    tst_args = make_args(name="tst_name",
+                         kubeconfig="tst_kubeconfig",
+                         dry_run="tst_dry_run",
+                         output="tst_output",
+                         verbose="tst_verbose")
 
     def test_generate(self, mocker):
         """Test the generate method."""
@@ -51,6 +65,36 @@ class Test_HLD_Generator():
         mock_gen_HLD.assert_called_once()
         mock_gen_manifests.assert_called_once()
 
+    def test_generate_pipelined(self, mocker):
+        """Test that the cluster crawl overlaps the definitions scrape."""
+        tst_hld_generator = HLD_Generator(make_args(pipeline=True, dry_run=True))
+        scraping = threading.Event()
+
+        def get_component_definitions():
+            scraping.set()
+            return [Component(name='repo-comp')]
+
+        def get_cluster_components():
+            # Run in sequence, the scrape would only start after the crawl
+            assert scraping.wait(5)
+            return [Component(name='cluster-comp')]
+
+        mocker.patch(f'{self.CLASS}._get_cluster_components',
+                     side_effect=get_cluster_components)
+        mocker.patch(f'{self.CLASS}._get_component_definitions',
+                     side_effect=get_component_definitions)
+        mock_get_matches = mocker.patch(f'{self.CLASS}._get_matches')
+        mock_gen_HLD = mocker.patch(f'{self.CLASS}._generate_HLD')
+        mocker.patch(f'{self.CLASS}._generate_manifests')
+
+        tst_hld_generator.generate()
+
+        assert tst_hld_generator.matcher.repo_components == [Component(name='repo-comp')]
+        mock_get_matches.assert_called_once_with([Component(name='cluster-comp')])
+        mock_gen_HLD.assert_called_once_with(mock_get_matches.return_value)
+        assert sorted(t.stage for t in tst_hld_generator.timings) == [
+            "cluster", "component.yaml", "definitions", "manifests", "matching"]
+
     def test_get_cluster_components(self, mocker):
         """Test the _get_cluster_components method."""
         # Setup, mock, etc.
@@ -70,11 +114,45 @@ class Test_HLD_Generator():
         # Delete Telemetry Instance
         del test_telemetry
 
+    def test_get_cluster_components_snapshot(self, mocker):
+        """Test that a fresh snapshot replaces the cluster crawl."""
+        tst_hld_generator = HLD_Generator(make_args(
+            name="tst_name", kubeconfig=None, dry_run=False, output=None,
+            verbose=False, snapshot="tst.json.gz", snapshot_ttl=60))
+        mock_cluster = mocker.patch.object(tst_hld_generator, 'cluster')
+        mock_cluster.load_snapshot.return_value = True
+
+        tst_hld_generator._get_cluster_components()
+
+        mock_cluster.load_snapshot.assert_called_once_with("tst.json.gz", 60)
+        mock_cluster.connect_to_cluster.assert_not_called()
+        mock_cluster.save_snapshot.assert_not_called()
+
+        mock_cluster.load_snapshot.return_value = False
+        tst_hld_generator._get_cluster_components()
+
+        mock_cluster.connect_to_cluster.assert_called_once()
+        mock_cluster.save_snapshot.assert_called_once_with("tst.json.gz")
+
+    def test_get_cluster_components_from_snapshot(self, mocker):
+        """Test that --from-snapshot never contacts the cluster."""
+        tst_hld_generator = HLD_Generator(make_args(
+            name="tst_name", kubeconfig=None, dry_run=False, output=None,
+            verbose=False, from_snapshot="tst.json.gz"))
+        mock_cluster = mocker.patch.object(tst_hld_generator, 'cluster')
+        mock_cluster.load_snapshot.return_value = False
+
+        with pytest.raises(Exception, match="No usable snapshot"):
+            tst_hld_generator._get_cluster_components()
+
+        mock_cluster.load_snapshot.assert_called_once_with("tst.json.gz")
+        mock_cluster.connect_to_cluster.assert_not_called()
+
     def test_get_component_definitions(self, mocker):
         """Test the _get_component_definitions method."""
         # Setup, mock, etc.
-        tst_hld_generator = HLD_Generator(self.tst_args)
         mock_scraper = mocker.patch(f'{self.MODULE}.Scraper')
+        tst_hld_generator = HLD_Generator(self.tst_args)
         mock_scraper.return_value.get_repo_components = mocker.MagicMock()
         test_telemetry = Telemetry(True)
 
@@ -106,10 +184,10 @@ class Test_HLD_Generator():
         # Delete Telemetry Instance
         del test_telemetry
 
-    tst_args_1 = tst_args(dry_run=True,
-                          name=None, kubeconfig=None, output=None, verbose=None)
-    tst_args_2 = tst_args(output=True,
-                          name=None, kubeconfig=None, dry_run=None, verbose=None)
+    tst_args_1 = make_args(dry_run=True,
+                           name=None, kubeconfig=None, output=None, verbose=None)
+    tst_args_2 = make_args(output="tst_output",
+                           name=None, kubeconfig=None, dry_run=None, verbose=None)
 
     gen_hld_tst_args = [tst_args_1, tst_args_2]
 
@@ -125,6 +203,8 @@ class Test_HLD_Generator():
                                               return_value=tst_data)
         mock_dump_yaml = mocker.patch(f'{self.CLASS}.dump_yaml',
                                       return_value=None)
+        mock_open = mocker.patch(f'{self.MODULE}.open', mocker.mock_open(),
+                                 create=True)
         test_telemetry = Telemetry(True)
 
         # Call function
@@ -134,6 +214,9 @@ class Test_HLD_Generator():
         mock_set_subcomponents.assert_called()
         if tst_args.dry_run:
             mock_dump_yaml.assert_called_with(tst_data, mock_stdout)
+        else:
+            mock_open.assert_called_once_with(
+                os.path.join("tst_output", "component.yaml"), 'w')
         mock_dump_yaml.assert_called_once()
 
         # Delete Telemetry Instance
@@ -164,3 +247,108 @@ class Test_HLD_Generator():
         # Assert results
         mock_yaml.indent.assert_called_once()
         mock_yaml.dump.assert_called_once()
+
+    def test_generate_with_repo_components(self, mocker):
+        """Test that given repo components are not scraped again."""
+        tst_hld_generator = HLD_Generator(self.tst_args)
+        mocker.patch(f'{self.CLASS}._get_cluster_components', return_value=[])
+        mock_get_cd = mocker.patch(f'{self.CLASS}._get_component_definitions')
+        mock_matcher = mocker.patch(f'{self.MODULE}.Matcher')
+        mocker.patch(f'{self.CLASS}._get_matches')
+        mocker.patch(f'{self.CLASS}._generate_HLD')
+        mocker.patch(f'{self.CLASS}._generate_manifests')
+        tst_repo_components = [Component(name='repo-comp-1')]
+
+        tst_hld_generator.generate(tst_repo_components)
+
+        mock_get_cd.assert_not_called()
+        mock_matcher.assert_called_once_with(tst_repo_components, engine='index')
+
+
+def test_cluster_targets():
+    """Test that clusters are named by kubeconfig file or context."""
+    targets = cluster_targets(["a/prod.yaml", "b/prod.yaml", "c/dev"],
+                              ["staging"], "main-kubeconfig")
+
+    assert targets == [ClusterTarget("prod-0", "a/prod.yaml", None),
+                       ClusterTarget("prod-1", "b/prod.yaml", None),
+                       ClusterTarget("dev", "c/dev", None),
+                       ClusterTarget("staging", "main-kubeconfig", "staging")]
+
+
+def test_generate_clusters(mocker, tmp_path):
+    """Test that definitions are scraped once and each cluster is generated."""
+    mock_scraper = mocker.patch('hydrate.hld.Scraper')
+    mock_scraper.return_value.get_repo_components.return_value = ["repo"]
+    mocker.patch('concurrent.futures.ProcessPoolExecutor', ThreadPoolExecutor)
+    generated = []
+
+    def fake_generate_cluster(args, repo_components):
+        if args.context == "broken":
+            raise Exception("unreachable")
+        generated.append((args.kubeconfig, args.context, args.output,
+                          args.manifests, repo_components))
+    mocker.patch('hydrate.hld.generate_cluster', fake_generate_cluster)
+    tst_args = make_args(kubeconfig="kc", output=str(tmp_path))
+    targets = [ClusterTarget("prod", "kc", "prod"),
+               ClusterTarget("broken", "kc", "broken")]
+
+    failed = generate_clusters(tst_args, targets, processes=2)
+
+    assert failed == ["broken"]
+    mock_scraper.return_value.get_repo_components.assert_called_once()
+    assert generated == [("kc", "prod", str(tmp_path / "prod"),
+                          str(tmp_path / "prod" / "manifests"), ["repo"])]
+
+
+def test_cluster_args_snapshot():
+    """Test that each cluster of a multi-cluster run gets its own snapshot."""
+    tst_args = make_args(kubeconfig="kc", output="out",
+                         snapshot="snaps/cluster.json.gz")
+
+    args = cluster_args(tst_args, ClusterTarget("prod", "prod.yaml", None))
+
+    assert args.snapshot == "snaps/prod-cluster.json.gz"
+    assert args.from_snapshot is None
+    assert tst_args.snapshot == "snaps/cluster.json.gz"
+
+
+def test_make_scraper(tmp_path):
+    """Test that several definition sources are merged in order."""
+    scraper = make_scraper(make_args(definitions_dir=str(tmp_path)))
+    merged = make_scraper(make_args(definitions=["https://github.com/contoso/defs"],
+                                    definitions_dir=str(tmp_path)))
+
+    assert isinstance(make_scraper(make_args()), Scraper)
+    assert scraper.definitions_dir == str(tmp_path)
+    assert isinstance(merged, MergedScraper)
+    assert [s.definition_url for s in merged.scrapers] == [
+        "https://github.com/contoso/defs",
+        "https://github.com/microsoft/fabrikate-definitions"]
+
+
+def test_format_timings():
+    """Test that stage timings are listed by start time."""
+    timings = [StageTiming("definitions", 0.0, 0.5), StageTiming("cluster", 0.0, 1.25),
+               StageTiming("matching", 1.25, 1.5)]
+
+    assert format_timings(timings).splitlines() == [
+        "Stage timings (seconds since start):",
+        "  definitions        0.000 -    0.500  (0.500)",
+        "  cluster            0.000 -    1.250  (1.250)",
+        "  matching           1.250 -    1.500  (0.250)",
+        "  total              1.500"]
+
+
+def test_build_index(mocker, tmp_path):
+    """Test that runs read the definitions from a built index."""
+    path = str(tmp_path / "definitions.idx")
+    repo_components = [Component(name="jaeger", source="src", path="definitions/jaeger")]
+    mock_scraper = mocker.patch('hydrate.hld.Scraper')
+    mock_scraper.return_value.get_repo_components.return_value = repo_components
+
+    build_index(make_args(output=path))
+    scraper = make_scraper(make_args(index=path))
+
+    assert isinstance(scraper, DefinitionIndex)
+    assert list(scraper.get_repo_components()) == repo_components
@@ -0,0 +1,73 @@
+"""Test suite for index.py."""
+import pickle
+from array import array
+import sys
+
+import pytest
+
+from hydrate.component import Component
+from hydrate.index import DefinitionIndex
+from hydrate.index import HEADER, RECORD_FIELDS
+from hydrate.index import write_index
+from hydrate.scrape import Definition
+
+
+def make_components():
+    """Return components with and without enrichment, some non-ASCII."""
+    components = [Component(name="jaeger", source="https://github.com/a/defs",
+                            path="definitions/fabrikate-jaeger"),
+                  Component(name="elasticsearch-fluentd-kibana-fluentd",
+                            source="https://github.com/a/defs", path="définitions/efk"),
+                  Component(name="prometheus", source=None, path=None)]
+    components[1].definition = Definition("helm", ["kibana"], ["elasticsearch", "kibana"])
+    components[2].definition = Definition(None, [], [])
+    return components
+
+
+def test_index_round_trip(tmp_path):
+    """Test that indexed components are read back identical."""
+    path = str(tmp_path / "definitions.idx")
+    write_index(path, make_components())
+
+    index = DefinitionIndex(path)
+
+    assert len(index) == 3
+    assert list(index) == make_components()
+    assert index[-1] is index[2]
+    assert index.get_repo_components() is index
+    assert index.name(1) == "elasticsearch-fluentd-kibana-fluentd"
+    assert index.tokens(1) == ["elasticsearch", "fluentd", "kibana"]
+    assert list(pickle.loads(pickle.dumps(index))) == make_components()
+    index.close()
+
+
+def test_index_other_byte_order(tmp_path):
+    """Test that an index written on another architecture is readable."""
+    path = str(tmp_path / "definitions.idx")
+    write_index(path, make_components())
+    with open(path, "rb") as f:
+        data = f.read()
+    _, _, _, strings, records, items = HEADER.unpack_from(data)
+    end = HEADER.size + 4 * (strings + 1 + records * RECORD_FIELDS + items)
+    values = array("I", data[HEADER.size:end])
+    values.byteswap()
+    other = b"b" if sys.byteorder == "little" else b"l"
+    with open(path, "wb") as f:
+        f.write(data[:12] + other + data[13:HEADER.size])
+        f.write(values.tobytes() + data[end:])
+
+    assert list(DefinitionIndex(path)) == make_components()
+
+
+@pytest.mark.parametrize("size", [0, 10, 100, -1])
+def test_index_invalid(tmp_path, size):
+    """Test that truncated or foreign files are rejected."""
+    path = str(tmp_path / "definitions.idx")
+    write_index(path, make_components())
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:size] if size else b"not an index")
+
+    with pytest.raises(ValueError):
+        DefinitionIndex(path)
@@ -1,19 +1,34 @@
 """Test the __main__.py file."""
 
+import subprocess
+import sys
+
+import pytest
+
 from hydrate.__main__ import main
 from hydrate.__main__ import parse_args
+from hydrate.__main__ import parse_index_args
+
+# Seconds `import hydrate.__main__` may take, well under the ~170ms the
+# eager imports of ruamel.yaml, requests and applicationinsights cost
+IMPORT_BUDGET = 0.15
+HEAVY_MODULES = ("ruamel", "requests", "applicationinsights", "kubernetes",
+                 "numpy", "hydrate.hld")
 
 
 def test_main(mocker):
     """Test the main function."""
     # Setup mock, test objects, etc.
     mock_parse_args = mocker.patch('hydrate.__main__.parse_args')
-    mock_telemetry = mocker.patch('hydrate.__main__.Telemetry')
+    mock_parse_args.return_value.watch = None
+    mock_parse_args.return_value.kubeconfigs = None
+    mock_parse_args.return_value.contexts = None
+    mock_telemetry = mocker.patch('hydrate.telemetry.Telemetry')
     mock_telemetry.return_value.track_event = mocker.MagicMock()
     mock_telemetry.return_value.track_metric = mocker.MagicMock()
     mock_telemetry.return_value.flush = mocker.MagicMock()
     mock_default_timer = mocker.patch('hydrate.__main__.default_timer')
-    mock_HLD_Generator = mocker.patch('hydrate.__main__.HLD_Generator')
+    mock_HLD_Generator = mocker.patch('hydrate.hld.HLD_Generator')
     mock_HLD_Generator.return_value.generate = mocker.MagicMock()
 
     # Call the function
@@ -30,6 +45,30 @@ def test_main(mocker):
     mock_HLD_Generator.return_value.generate.assert_called_once()
 
 
+def test_main_multi_cluster(mocker):
+    """Test that several kubeconfigs are generated in a process pool."""
+    mock_parse_args = mocker.patch('hydrate.__main__.parse_args')
+    mock_parse_args.return_value.kubeconfigs = ["a/prod.yaml", "b/dev.yaml"]
+    mock_parse_args.return_value.contexts = None
+    mock_parse_args.return_value.processes = 2
+    mocker.patch('hydrate.telemetry.Telemetry')
+    mock_generate_clusters = mocker.patch('hydrate.hld.generate_clusters',
+                                          return_value=[])
+    mock_HLD_Generator = mocker.patch('hydrate.hld.HLD_Generator')
+
+    main()
+
+    args, targets, processes = mock_generate_clusters.call_args[0]
+    assert [target.name for target in targets] == ["prod", "dev"]
+    assert processes == 2
+    mock_HLD_Generator.assert_not_called()
+
+    mock_generate_clusters.return_value = ["dev"]
+    with pytest.raises(SystemExit) as exc_info:
+        main()
+    assert exc_info.value.code == "Failed clusters: dev"
+
+
 def test_parse_args(mocker):
     """Test the parse_args function."""
     # Setup mock, test objects, etc
@@ -53,3 +92,74 @@ def test_parse_args(mocker):
     assert args.output
     assert args.verbose
     assert args.dry_run
+
+
+@pytest.mark.parametrize("tst_argv", [
+    ['--watch', '5', '--snapshot', 'cluster.json.gz', 'run'],
+    ['--watch', '5', '--kubeconfigs', 'prod.yaml', 'dev.yaml', 'run'],
+    ['--watch', '5', '--contexts', 'prod', 'run'],
+])
+def test_parse_args_watch_conflicts(tst_argv):
+    """Test that --watch is not combined with snapshots or several clusters."""
+    with pytest.raises(SystemExit):
+        parse_args(tst_argv)
+
+
+def test_parse_args_definitions(tmp_path):
+    """Test that definition sources are GitHub repositories or folders."""
+    args = parse_args(['run', '--definitions', 'https://github.com/contoso/defs',
+                       str(tmp_path)])
+
+    assert args.definitions == ['https://github.com/contoso/defs', str(tmp_path)]
+    with pytest.raises(SystemExit):
+        parse_args(['run', '--definitions', str(tmp_path / 'missing')])
+
+
+def test_parse_args_matcher():
+    """Test that the matching engine is one of the Matcher engines."""
+    assert parse_args(['run']).matcher == 'index'
+    assert parse_args(['run', '--matcher', 'bitset']).matcher == 'bitset'
+    with pytest.raises(SystemExit):
+        parse_args(['run', '--matcher', 'regex'])
+
+
+def test_parse_index_args():
+    """Test the arguments of hydrate index build."""
+    args = parse_index_args(['build', '-o', 'defs.idx', '--enrich-definitions'])
+
+    assert (args.output, args.enrich_definitions, args.index) == \
+        ('defs.idx', True, None)
+    with pytest.raises(SystemExit):
+        parse_index_args(['rebuild'])
+
+
+def test_main_index(mocker):
+    """Test that hydrate index build writes the index."""
+    mocker.patch('sys.argv', ['hydrate', 'index', 'build', '-o', 'defs.idx'])
+    mock_build_index = mocker.patch('hydrate.hld.build_index', return_value=[])
+    mock_parse_args = mocker.patch('hydrate.__main__.parse_args')
+
+    main()
+
+    assert mock_build_index.call_args[0][0].output == 'defs.idx'
+    mock_parse_args.assert_not_called()
+
+
+def test_import_time():
+    """Test that the CLI starts without loading the pipeline dependencies."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import hydrate.__main__"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    # Lines look like "import time: self [us] | cumulative | imported package"
+    timings = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                timings[name.strip()] = int(cumulative)
+
+    loaded = [name for name in timings
+              if name.split(".")[0] in HEAVY_MODULES or name in HEAVY_MODULES]
+    assert loaded == []
+    assert timings["hydrate.__main__"] / 1e6 < IMPORT_BUDGET
@@ -4,8 +4,12 @@ import pytest
 from collections import namedtuple
 from itertools import zip_longest
 
+from benchmarks.bench_matcher import ScanMatcher, make_catalog, matches
 from hydrate.component import Component
+from hydrate.index import DefinitionIndex, write_index
 from hydrate.match import Matcher
+from hydrate.match import BitsetIndex
+from hydrate.match import TokenIndex
 
 
 FILE = 'hydrate.match'
@@ -112,3 +116,70 @@ class TestMatcher():
 
         for no_match, exp in zip(nm_results, expected_nm):
             assert no_match.get_component().name == exp.name
+
+
+def test_token_index():
+    """Test the positions found by the token index, both ways."""
+    token_index = TokenIndex([Component(name="a-b"), Component(name="c"),
+                              Component(name="b-d"), Component(name="a")])
+
+    assert token_index.postings["b"] == [0, 2]
+    assert token_index.candidates({"b"}) == [0, 2]
+    assert token_index.subsets({"a", "b"}) == [0, 3]
+    assert token_index.candidates({"b", "x", "y", "z"}) == [0, 2]
+    assert token_index.subsets({"a", "b", "x", "y"}) == [0, 3]
+
+
+@pytest.mark.parametrize('definitions, components, matching, seed', [
+    (50, 10, 0.9, 0), (50, 200, 0.5, 1), (300, 100, 0.8, 2), (3, 6, 1.0, 3)])
+def test_matcher_same_as_scan(definitions, components, matching, seed):
+    """Test that the token index gives the matches of a full scan."""
+    repo_components, cluster_components = make_catalog(definitions, components,
+                                                       matching, seed)
+
+    assert matches(Matcher(repo_components), cluster_components) == \
+        matches(ScanMatcher(repo_components), cluster_components)
+
+
+def test_matcher_definition_index(tmp_path):
+    """Test that a DefinitionIndex is matched from its indexed tokens."""
+    repo_components, cluster_components = make_catalog(100, 50, 0.8)
+    path = str(tmp_path / "definitions.idx")
+    write_index(path, repo_components)
+    index = DefinitionIndex(path)
+
+    assert matches(Matcher(index), cluster_components) == \
+        matches(ScanMatcher(repo_components), cluster_components)
+
+
+def test_bitset_index():
+    """Test that the bitset index finds the positions of the token index."""
+    pytest.importorskip("numpy")
+    repo_components = [Component(name="a-b"), Component(name="c"),
+                       Component(name="b-d"), Component(name="a")]
+    repo_components += [Component(name="t{}".format(i)) for i in range(70)]
+    bitset_index = BitsetIndex(repo_components)
+    token_index = TokenIndex(repo_components)
+
+    assert bitset_index.words == 2
+    for tokens in [{"b"}, {"a", "b"}, {"b", "x"}, {"t69", "a", "d"}, set()]:
+        assert bitset_index.candidates(tokens) == token_index.candidates(tokens)
+        assert bitset_index.subsets(tokens) == token_index.subsets(tokens)
+
+
+@pytest.mark.parametrize('definitions, components, matching, seed', [
+    (50, 10, 0.9, 0), (50, 200, 0.5, 1), (300, 100, 0.8, 2), (3, 6, 1.0, 3)])
+def test_bitset_matcher_same_as_scan(definitions, components, matching, seed):
+    """Test that the bitset engine gives the matches of a full scan."""
+    pytest.importorskip("numpy")
+    repo_components, cluster_components = make_catalog(definitions, components,
+                                                       matching, seed)
+
+    assert matches(Matcher(repo_components, engine="bitset"), cluster_components) == \
+        matches(ScanMatcher(repo_components), cluster_components)
+
+
+def test_matcher_unknown_engine():
+    """Test that an unknown matching engine is refused."""
+    with pytest.raises(ValueError):
+        Matcher([], engine="regex")
@@ -1,4 +1,8 @@
 """Test suite for scrape.py."""
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
 import pytest
 
 from hydrate.component import Component
@@ -8,6 +12,17 @@ from hydrate.scrape import parse_json
 from hydrate.scrape import construct_components
 from hydrate.scrape import remove_fabrikate_prefix
 from hydrate.scrape import json_get
+from hydrate.scrape import CachedResponse
+from hydrate.scrape import HttpCache
+from hydrate.scrape import Scraper
+from hydrate.scrape import local_json_get
+from hydrate.scrape import tree_json_get
+from hydrate.scrape import FAB_DEFS_TREE, TREES
+from hydrate.scrape import Definition
+from hydrate.scrape import HTTP_TIMEOUT
+from hydrate.scrape import make_session
+from hydrate.scrape import MergedScraper
+from hydrate.scrape import source_scraper
 
 @pytest.mark.parametrize('json_get_ret',
                          [(1), (None)])
@@ -90,10 +105,11 @@ def test_remove_fabriakte_prefix(components, exp_components):
 class Mock_Resp():
     """Mock the response object returned by requests.get()."""
 
-    def __init__(self, status_code, json=None):
+    def __init__(self, status_code, json=None, headers=None):
         """Initialize Mock_Resp object."""
         self.status_code = status_code
         self.json_obj = json
+        self.headers = headers or {}
 
     def json(self):
         """Return json-like python object."""
@@ -111,5 +127,301 @@ mock_resp_fail = Mock_Resp(status_code=404)
                           (tst_url, None, mock_resp_fail)])
 def test_json_get(mocker, tst_url, exp_json, mock_resp):
     """Test the json_get function."""
-    mocker.patch('hydrate.scrape.get', return_value=mock_resp)
+    mocker.patch('requests.get', return_value=mock_resp)
     assert json_get(tst_url) == exp_json
+
+
+def test_http_cache(tmp_path):
+    """Test that only revalidatable responses are stored."""
+    cache = HttpCache(str(tmp_path / "http"))
+    cache.store(tst_url, {"ETag": '"abc"'}, exp_json)
+    cache.store("www.no-validator.com", {}, exp_json)
+
+    assert cache.get(tst_url) == CachedResponse(tst_url, '"abc"', None, exp_json)
+    assert cache.get("www.no-validator.com") is None
+
+
+def test_http_cache_unreadable(tmp_path):
+    """Test that a corrupt cache file is treated as a miss."""
+    cache = HttpCache(str(tmp_path))
+    with open(cache.path(tst_url), "w") as f:
+        f.write("{not json")
+
+    assert cache.get(tst_url) is None
+
+
+def test_json_get_conditional(mocker, tmp_path):
+    """Test that json_get revalidates cached responses."""
+    cache = HttpCache(str(tmp_path))
+    headers = {"ETag": '"abc"', "Last-Modified": "Mon, 01 Jun 2020 00:00:00 GMT"}
+    mock_get = mocker.patch('requests.get', side_effect=[
+        Mock_Resp(status_code=200, json=exp_json, headers=headers),
+        Mock_Resp(status_code=304)])
+
+    assert json_get(tst_url, cache) == exp_json
+    assert json_get(tst_url, cache) == exp_json
+
+    assert mock_get.call_args_list[0][1]["headers"] == {}
+    assert mock_get.call_args_list[1][1]["headers"] == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Mon, 01 Jun 2020 00:00:00 GMT"}
+
+
+def test_scraper_definitions_dir(tmp_path):
+    """Test that a local checkout gives the components GitHub gives."""
+    for name in ("fabrikate-jaeger", "prometheus"):
+        (tmp_path / "definitions" / name).mkdir(parents=True)
+    (tmp_path / "definitions" / "README.md").write_text("not a definition")
+
+    components = Scraper(definitions_dir=str(tmp_path)).get_repo_components()
+
+    assert components == [
+        Component(name="jaeger", source=FAB_DEFS_URL,
+                  path="definitions/fabrikate-jaeger"),
+        Component(name="prometheus", source=FAB_DEFS_URL,
+                  path="definitions/prometheus")]
+
+
+def test_local_json_get_index(mocker, tmp_path):
+    """Test that unchanged checkouts are not scanned again."""
+    definitions = tmp_path / "definitions"
+    (definitions / "jaeger").mkdir(parents=True)
+    cache = HttpCache(str(tmp_path / "cache"))
+    listing = local_json_get(str(tmp_path), cache=cache)
+
+    scandir = mocker.patch('os.scandir', side_effect=AssertionError("rescanned"))
+    assert local_json_get(str(tmp_path), cache=cache) == listing
+    scandir.assert_not_called()
+
+    mocker.stopall()
+    (definitions / "elasticsearch").mkdir()
+    os.utime(str(definitions), ns=(0, 0))
+    assert [entry["name"] for entry in local_json_get(str(tmp_path), cache=cache)] \
+        == ["elasticsearch", "jaeger"]
+
+
+tst_tree = [{"path": "README.md", "type": "blob", "sha": "1"},
+            {"path": "definitions", "type": "tree", "sha": "defs"},
+            {"path": "definitions/fabrikate-jaeger", "type": "tree", "sha": "2"},
+            {"path": "definitions/fabrikate-jaeger/component.yaml", "type": "blob",
+             "sha": "3"},
+            {"path": "definitions/prometheus", "type": "tree", "sha": "4"},
+            {"path": "docs", "type": "tree", "sha": "5"}]
+exp_tree_listing = [
+    {"name": "fabrikate-jaeger",
+     "html_url": FAB_DEFS_URL + "/tree/master/definitions/fabrikate-jaeger"},
+    {"name": "prometheus",
+     "html_url": FAB_DEFS_URL + "/tree/master/definitions/prometheus"}]
+
+
+def test_tree_json_get(mocker):
+    """Test that the definitions are read from one recursive listing."""
+    mock_json_get = mocker.patch("hydrate.scrape.json_get",
+                                 return_value={"tree": tst_tree, "truncated": False})
+
+    assert tree_json_get(FAB_DEFS_TREE) == exp_tree_listing
+    mock_json_get.assert_called_once_with(FAB_DEFS_TREE, None, None)
+
+
+@pytest.mark.parametrize('truncated_tree, exp_urls', [
+    (tst_tree[:2], [FAB_DEFS_TREE, TREES + "/defs"]),
+    (tst_tree[:1], [FAB_DEFS_TREE, TREES + "/master", TREES + "/defs"])])
+def test_tree_json_get_truncated(mocker, truncated_tree, exp_urls):
+    """Test that truncated listings fall back to the definitions folder."""
+    responses = {FAB_DEFS_TREE: {"tree": truncated_tree, "truncated": True},
+                 TREES + "/master": {"tree": tst_tree[:2], "truncated": False},
+                 TREES + "/defs": {"tree": [
+                     {"path": "fabrikate-jaeger", "type": "tree", "sha": "2"},
+                     {"path": "prometheus", "type": "tree", "sha": "4"}],
+                     "truncated": False}}
+    mock_json_get = mocker.patch("hydrate.scrape.json_get",
+                                 side_effect=lambda url, cache, session: responses[url])
+
+    assert tree_json_get(FAB_DEFS_TREE) == exp_tree_listing
+    assert [c[0][0] for c in mock_json_get.call_args_list] == exp_urls
+
+
+def test_scraper_tree_fallback(mocker):
+    """Test that the contents API is used when the tree is unavailable."""
+    mocker.patch("hydrate.scrape.tree_json_get", return_value=None)
+    mock_json_get = mocker.patch("hydrate.scrape.json_get",
+                                 return_value=exp_tree_listing)
+
+    components = Scraper().get_repo_components()
+
+    mock_json_get.assert_called_once()
+    assert mock_json_get.call_args[0][0] == FAB_DEFS_API
+    assert [c.name for c in components] == ["jaeger", "prometheus"]
+
+
+ELASTICSEARCH_YAML = """
+name: elasticsearch
+generator: helm
+source: https://github.com/helm/charts
+method: git
+path: stable/elasticsearch
+"""
+EFK_YAML = """
+name: efk
+subcomponents:
+- name: elasticsearch
+  source: https://github.com/microsoft/fabrikate-definitions
+  method: git
+  path: definitions/fabrikate-elasticsearch
+- name: kibana
+  generator: helm
+  source: https://github.com/helm/charts
+  method: git
+  path: stable/kibana/
+- name: fluentd
+  source: https://github.com/example/fluentd-definition
+  method: git
+"""
+FLUENTD_YAML = """
+name: fluentd
+generator: helm
+source: https://github.com/helm/charts
+path: stable/fluentd
+"""
+LOGGING_YAML = """
+name: logging
+subcomponents:
+- name: elasticsearch
+  source: ../fabrikate-elasticsearch
+- name: fluentd
+  source: https://github.com/example/fluentd-definition
+  method: git
+"""
+
+
+def write_definitions(checkout, definitions):
+    """Write a local checkout holding the component.yaml of definitions."""
+    for name, text in definitions.items():
+        (checkout / "definitions" / name).mkdir(parents=True)
+        (checkout / "definitions" / name / "component.yaml").write_text(text)
+
+
+def test_get_definitions_local(tmp_path):
+    """Test that definitions are enriched from a local checkout."""
+    write_definitions(tmp_path, {"fabrikate-elasticsearch": ELASTICSEARCH_YAML,
+                                 "fabrikate-efk": EFK_YAML,
+                                 "fabrikate-empty": ""})
+    scraper = Scraper(definitions_dir=str(tmp_path), enrich=True)
+
+    components = scraper.get_repo_components()
+
+    assert {c.name: c.definition for c in components} == {
+        "efk": Definition(None, ["elasticsearch", "kibana"],
+                          ["elasticsearch", "kibana", "fluentd"]),
+        "elasticsearch": Definition("helm", ["elasticsearch"], []),
+        "empty": Definition(None, [], [])}
+
+
+def test_get_definitions_remote(mocker):
+    """Test that shared remote subcomponents are fetched once."""
+    raw = "https://raw.githubusercontent.com/{}/master/{}component.yaml"
+    texts = {raw.format("microsoft/fabrikate-definitions",
+                        "definitions/fabrikate-elasticsearch/"): ELASTICSEARCH_YAML,
+             raw.format("microsoft/fabrikate-definitions",
+                        "definitions/fabrikate-efk/"): EFK_YAML,
+             raw.format("microsoft/fabrikate-definitions",
+                        "definitions/fabrikate-logging/"): LOGGING_YAML,
+             raw.format("example/fluentd-definition", ""): FLUENTD_YAML}
+    mocker.patch("hydrate.scrape.json_get", return_value={"tree": [
+        {"path": "definitions/" + name, "type": "tree", "sha": name}
+        for name in ("fabrikate-efk", "fabrikate-elasticsearch", "fabrikate-logging")]})
+    mock_text_get = mocker.patch("hydrate.scrape.text_get",
+                                 side_effect=lambda url, cache, session: texts[url])
+
+    definitions = Scraper().get_definitions()
+
+    fetched = [c[0][0] for c in mock_text_get.call_args_list]
+    assert sorted(fetched) == sorted(texts)
+    assert definitions["efk"].charts == ["elasticsearch", "fluentd", "kibana"]
+    assert definitions["logging"] == Definition(None, ["elasticsearch", "fluentd"],
+                                                ["elasticsearch", "fluentd"])
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Answer 503 to the first request, then the json of the path."""
+
+    requests = []
+
+    def do_GET(self):
+        """Serve a GET request."""
+        self.requests.append(self.headers.get("Authorization"))
+        status = 503 if len(self.requests) == 1 else 200
+        body = b'{"path": "%s"}' % self.path.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Do not log requests."""
+
+
+def test_make_session_retries():
+    """Test that the session retries server errors and sends the token."""
+    server = HTTPServer(("127.0.0.1", 0), FlakyHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = "http://127.0.0.1:{}/definitions".format(server.server_port)
+    try:
+        assert json_get(url, session=make_session(token="secret")) == {
+            "path": "/definitions"}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert FlakyHandler.requests == ["token secret", "token secret"]
+
+
+def test_json_get_timeout(mocker):
+    """Test that requests are sent with connect and read timeouts."""
+    mock_get = mocker.patch('requests.get', return_value=mock_resp_success)
+
+    json_get(tst_url)
+
+    assert mock_get.call_args[1]["timeout"] == HTTP_TIMEOUT
+
+
+def test_merged_scraper(mocker):
+    """Test that sources are scraped concurrently and the first one wins."""
+    barrier = threading.Barrier(2, timeout=5)
+
+    def scraper(*names):
+        def get_repo_components(force_update):
+            barrier.wait()  # Both sources are scraped at once
+            return [Component(name=name, source=names[0]) for name in names]
+        mock_scraper = mocker.MagicMock()
+        mock_scraper.get_repo_components.side_effect = get_repo_components
+        return mock_scraper
+
+    merged = MergedScraper([scraper("internal", "jaeger", "internal"),
+                            scraper("public", "jaeger", "prometheus")])
+
+    assert [(c.name, c.source) for c in merged.get_repo_components()] == [
+        ("internal", "internal"), ("jaeger", "internal"),
+        ("public", "public"), ("prometheus", "public")]
+
+
+def test_source_scraper(tmp_path):
+    """Test that GitHub repositories and local checkouts are both sources."""
+    scraper = source_scraper("https://github.com/contoso/definitions.git")
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "config").write_text(
+        '[remote "origin"]\n\turl = https://github.com/contoso/internal.git\n')
+
+    assert scraper.definition_url == "https://github.com/contoso/definitions"
+    assert scraper.definition_api == \
+        "https://api.github.com/repos/contoso/definitions/contents/definitions"
+    assert scraper.definition_tree == \
+        "https://api.github.com/repos/contoso/definitions/git/trees/master?recursive=1"
+    assert source_scraper(FAB_DEFS_URL).definition_tree == FAB_DEFS_TREE
+    assert source_scraper(str(tmp_path)).definition_url == \
+        "https://github.com/contoso/internal"
+    assert source_scraper(str(tmp_path / ".git")).definition_url == FAB_DEFS_URL
+    with pytest.raises(ValueError):
+        source_scraper(str(tmp_path / "missing"))